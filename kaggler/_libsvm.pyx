@@ -0,0 +1,490 @@
+# cython: boundscheck=False
+# cython: wraparound=False
+# cython: cdivision=True
+import numpy as np
+from scipy import sparse
+
+cimport cython
+from cython.parallel cimport prange
+from libc.limits cimport INT_MAX
+from libc.stdlib cimport malloc, realloc, free, strtod, strtol
+from libc.string cimport memchr, memcpy
+cimport numpy as np
+
+
+np.import_array()
+
+
+cdef enum:
+    INVALID_LABEL = 1
+    NEGATIVE_INDEX = 2
+    INVALID_VALUE = 3
+    OUT_OF_MEMORY = 4
+    INVALID_FIELD_FEATURE = 5
+    NEGATIVE_FIELD = 6
+    LARGE_INDEX = 7
+    LARGE_FIELD = 8
+
+
+ERRORS = {
+    INVALID_LABEL: 'invalid label',
+    NEGATIVE_INDEX: 'negative feature index',
+    INVALID_VALUE: 'invalid feature value',
+    OUT_OF_MEMORY: 'out of memory',
+    INVALID_FIELD_FEATURE: 'invalid field:index:value feature',
+    NEGATIVE_FIELD: 'negative field',
+    LARGE_INDEX: 'feature index too large',
+    LARGE_FIELD: 'field too large',
+}
+
+
+cdef struct CSRBuffer:
+    Py_ssize_t n_rows
+    Py_ssize_t nnz
+    Py_ssize_t rows_capacity
+    Py_ssize_t nnz_capacity
+    int min_index
+    int max_index
+    Py_ssize_t* indptr
+    int* indices
+    double* data
+    double* y
+    int* fields             # fields of non-zero features, or NULL if not parsed
+    int error
+    Py_ssize_t error_pos
+
+
+cdef inline bint is_space(char c) nogil:
+    return c == b' ' or c == b'\t' or c == b'\r'
+
+
+cdef int buffer_init(CSRBuffer* b, Py_ssize_t rows_capacity, Py_ssize_t nnz_capacity, bint with_fields) nogil:
+    """Allocate a buffer. Return 0 on success or OUT_OF_MEMORY."""
+    b.n_rows = 0
+    b.nnz = 0
+    b.rows_capacity = rows_capacity
+    b.nnz_capacity = nnz_capacity
+    b.min_index = -1
+    b.max_index = -1
+    b.error = 0
+    b.error_pos = 0
+    b.indptr = <Py_ssize_t*>malloc((rows_capacity + 1) * sizeof(Py_ssize_t))
+    b.y = <double*>malloc(rows_capacity * sizeof(double))
+    b.indices = <int*>malloc(nnz_capacity * sizeof(int))
+    b.data = <double*>malloc(nnz_capacity * sizeof(double))
+    b.fields = <int*>malloc(nnz_capacity * sizeof(int)) if with_fields else NULL
+    if (b.indptr == NULL or b.y == NULL or b.indices == NULL or b.data == NULL or
+            (with_fields and b.fields == NULL)):
+        b.error = OUT_OF_MEMORY
+        return OUT_OF_MEMORY
+
+    b.indptr[0] = 0
+    return 0
+
+
+cdef void buffer_free(CSRBuffer* b) nogil:
+    free(b.indptr)
+    free(b.y)
+    free(b.indices)
+    free(b.data)
+    free(b.fields)
+    b.indptr = NULL
+    b.y = NULL
+    b.indices = NULL
+    b.data = NULL
+    b.fields = NULL
+
+
+cdef int buffer_grow_rows(CSRBuffer* b) nogil:
+    """Double the row capacity of a buffer. Return 0 on success or OUT_OF_MEMORY."""
+    cdef Py_ssize_t capacity = 2 * b.rows_capacity
+    cdef Py_ssize_t* indptr = <Py_ssize_t*>realloc(b.indptr, (capacity + 1) * sizeof(Py_ssize_t))
+    cdef double* y
+
+    if indptr == NULL:
+        return OUT_OF_MEMORY
+    b.indptr = indptr
+
+    y = <double*>realloc(b.y, capacity * sizeof(double))
+    if y == NULL:
+        return OUT_OF_MEMORY
+    b.y = y
+
+    b.rows_capacity = capacity
+    return 0
+
+
+cdef int buffer_grow_nnz(CSRBuffer* b) nogil:
+    """Double the non-zero capacity of a buffer. Return 0 on success or OUT_OF_MEMORY."""
+    cdef Py_ssize_t capacity = 2 * b.nnz_capacity
+    cdef int* indices = <int*>realloc(b.indices, capacity * sizeof(int))
+    cdef double* data
+    cdef int* fields
+
+    if indices == NULL:
+        return OUT_OF_MEMORY
+    b.indices = indices
+
+    data = <double*>realloc(b.data, capacity * sizeof(double))
+    if data == NULL:
+        return OUT_OF_MEMORY
+    b.data = data
+
+    if b.fields != NULL:
+        fields = <int*>realloc(b.fields, capacity * sizeof(int))
+        if fields == NULL:
+            return OUT_OF_MEMORY
+        b.fields = fields
+
+    b.nnz_capacity = capacity
+    return 0
+
+
+cdef int parse_line(const char* s, Py_ssize_t pos, Py_ssize_t stop, CSRBuffer* b) nogil:
+    """Parse a line in s[pos:stop] into a buffer. Return 0 on success or an error code.
+
+    Tokens that are not index:value pairs, e.g. qid:1, are skipped, and so are
+    blank and comment lines.  If the buffer has fields, features are
+    field:index:value triples instead.  Indices and fields should be less than
+    INT_MAX, so that the number of features fits in int.
+    """
+    cdef const char* p = s + pos
+    cdef const char* end = s + stop
+    cdef char* q
+    cdef long field = 0
+    cdef long index
+    cdef double value
+    cdef double label
+    cdef int error
+
+    while p < end and is_space(p[0]):
+        p += 1
+    if p == end or p[0] == b'#':
+        return 0
+
+    label = strtod(p, &q)
+    if q == p:
+        return INVALID_LABEL
+    p = q
+
+    while True:
+        while p < end and is_space(p[0]):
+            p += 1
+        if p >= end or p[0] == b'#':
+            break
+
+        index = strtol(p, &q, 10)
+        if q == p or q[0] != b':':
+            while p < end and not is_space(p[0]):
+                p += 1
+            continue
+        if b.fields != NULL:
+            field = index
+            if field < 0:
+                return NEGATIVE_FIELD
+            if field >= INT_MAX:
+                return LARGE_FIELD
+
+            # strtol() and strtod() skip leading whitespace, which could run
+            # into the next line
+            p = q + 1
+            if p >= end or is_space(p[0]):
+                return INVALID_FIELD_FEATURE
+            index = strtol(p, &q, 10)
+            if q == p or q[0] != b':':
+                return INVALID_FIELD_FEATURE
+
+        if index < 0:
+            return NEGATIVE_INDEX
+        if index >= INT_MAX:
+            return LARGE_INDEX
+
+        p = q + 1
+        if p >= end or is_space(p[0]):
+            return INVALID_VALUE
+        value = strtod(p, &q)
+        if q == p:
+            return INVALID_VALUE
+        p = q
+
+        if b.nnz == b.nnz_capacity:
+            error = buffer_grow_nnz(b)
+            if error:
+                return error
+        b.indices[b.nnz] = index
+        b.data[b.nnz] = value
+        if b.fields != NULL:
+            b.fields[b.nnz] = field
+        b.nnz += 1
+
+        if index > b.max_index:
+            b.max_index = index
+        if index < b.min_index or b.min_index < 0:
+            b.min_index = index
+
+    if b.n_rows == b.rows_capacity:
+        error = buffer_grow_rows(b)
+        if error:
+            return error
+    b.y[b.n_rows] = label
+    b.n_rows += 1
+    b.indptr[b.n_rows] = b.nnz
+    return 0
+
+
+cdef void parse_lines(const char* s, Py_ssize_t pos, Py_ssize_t end, CSRBuffer* b) nogil:
+    """Parse lines in s[pos:end] into a buffer, and record an error in it if any."""
+    cdef const char* line_end
+    cdef Py_ssize_t stop
+
+    while pos < end and not b.error:
+        line_end = <const char*>memchr(s + pos, b'\n', end - pos)
+        stop = line_end - s if line_end != NULL else end
+        b.error = parse_line(s, pos, stop, b)
+        if b.error:
+            b.error_pos = pos
+        pos = stop + 1
+
+
+cdef np.ndarray int_array(int* p, Py_ssize_t n):
+    a = np.empty((n,), dtype=np.int32)
+    if n > 0:
+        memcpy(np.PyArray_DATA(a), p, n * sizeof(int))
+    return a
+
+
+cdef np.ndarray intp_array(Py_ssize_t* p, Py_ssize_t n):
+    a = np.empty((n,), dtype=np.intp)
+    if n > 0:
+        memcpy(np.PyArray_DATA(a), p, n * sizeof(Py_ssize_t))
+    return a
+
+
+cdef np.ndarray double_array(double* p, Py_ssize_t n):
+    a = np.empty((n,), dtype=np.float64)
+    if n > 0:
+        memcpy(np.PyArray_DATA(a), p, n * sizeof(double))
+    return a
+
+
+def parse_libsvm(bytes buf, Py_ssize_t end=-1, int n_jobs=1, bint fields=False):
+    """Parse lines of a LibSVM file in a buffer into CSR arrays.
+
+    The buffer is split into n_jobs segments at line breaks, which are parsed
+    in parallel.
+
+    Args:
+        buf (bytes): a buffer with lines of a LibSVM file
+        end (int): a position in buf to stop parsing at. If -1, parse all of it
+        n_jobs (int): number of threads to parse the buffer with
+        fields (boolean): whether features are field:index:value triples
+
+    Returns:
+        a tuple of:
+            indptr (numpy.array): CSR row pointers in int64, which to_csr()
+                narrows to int32 if they fit
+            indices (numpy.array): CSR indices of non-zero features
+            data (numpy.array): CSR values of non-zero features
+            y (numpy.array): targets
+            min_index (int): the smallest feature index or -1 if none
+            max_index (int): the largest feature index or -1 if none
+            fields (numpy.array): fields of non-zero features, only if fields
+                is True
+    """
+    cdef const char* s = buf
+    cdef const char* line_end
+    cdef Py_ssize_t[:] starts
+    cdef CSRBuffer* bufs
+    cdef Py_ssize_t pos
+    cdef int t
+    cdef int n_segments
+    cdef Py_ssize_t rows_capacity
+    cdef Py_ssize_t nnz_capacity
+
+    if end < 0:
+        end = len(buf)
+    n_jobs = max(1, min(n_jobs, end // 2**16))
+
+    # split the buffer at line breaks into segments
+    starts = np.zeros((n_jobs + 1,), dtype=np.intp)
+    n_segments = 0
+    for t in range(n_jobs):
+        pos = end * t // n_jobs
+        if t > 0:
+            line_end = <const char*>memchr(s + pos, b'\n', end - pos)
+            pos = line_end - s + 1 if line_end != NULL else end
+        if n_segments == 0 or pos > starts[n_segments - 1]:
+            starts[n_segments] = pos
+            n_segments += 1
+    starts[n_segments] = end
+
+    # guess the capacities from the segment size, then grow them as needed
+    rows_capacity = max(16, (end // n_segments) // 64)
+    nnz_capacity = 8 * rows_capacity
+    bufs = <CSRBuffer*>malloc(n_segments * sizeof(CSRBuffer))
+    if bufs == NULL:
+        raise MemoryError()
+
+    try:
+        for t in range(n_segments):
+            if buffer_init(&bufs[t], rows_capacity, nnz_capacity, fields):
+                raise MemoryError()
+
+        for t in prange(n_segments, nogil=True, num_threads=n_segments, schedule='static', chunksize=1):
+            parse_lines(s, starts[t], starts[t + 1], &bufs[t])
+
+        for t in range(n_segments):
+            if bufs[t].error == OUT_OF_MEMORY:
+                raise MemoryError()
+            elif bufs[t].error:
+                line_end = <const char*>memchr(s + bufs[t].error_pos, b'\n', end - bufs[t].error_pos)
+                line = buf[bufs[t].error_pos:(line_end - s if line_end != NULL else end)]
+                raise ValueError('{} in the line: {!r}'.format(ERRORS[bufs[t].error], line))
+
+        indptr = [np.zeros((1,), dtype=np.intp)]
+        indices = []
+        data = []
+        y = []
+        field_arrays = []
+        min_index = -1
+        max_index = -1
+        nnz = 0
+        for t in range(n_segments):
+            indptr.append(intp_array(bufs[t].indptr + 1, bufs[t].n_rows) + nnz)
+            indices.append(int_array(bufs[t].indices, bufs[t].nnz))
+            data.append(double_array(bufs[t].data, bufs[t].nnz))
+            y.append(double_array(bufs[t].y, bufs[t].n_rows))
+            if fields:
+                field_arrays.append(int_array(bufs[t].fields, bufs[t].nnz))
+            nnz += bufs[t].nnz
+
+            if bufs[t].min_index >= 0 and (min_index < 0 or bufs[t].min_index < min_index):
+                min_index = bufs[t].min_index
+            max_index = max(max_index, bufs[t].max_index)
+    finally:
+        for t in range(n_segments):
+            buffer_free(&bufs[t])
+        free(bufs)
+
+    if fields:
+        return (np.concatenate(indptr), np.concatenate(indices), np.concatenate(data), np.concatenate(y),
+                min_index, max_index, np.concatenate(field_arrays))
+    return (np.concatenate(indptr), np.concatenate(indices), np.concatenate(data), np.concatenate(y),
+            min_index, max_index)
+
+
+def to_csr(indptr, indices, data, int n_features=0):
+    """Build a CSR matrix from arrays, inferring the number of features if 0.
+
+    indptr starts from 0, and is narrowed to int32 if the number of non-zero
+    values fits in it.
+    """
+    cdef int max_index = indices.max() if len(indices) > 0 else -1
+
+    if n_features <= 0:
+        n_features = max_index + 1
+    elif max_index >= n_features:
+        raise ValueError('feature index {} is out of range for {} features'.format(max_index, n_features))
+
+    if len(indices) <= np.iinfo(np.int32).max:
+        indptr = indptr.astype(np.int32)
+    return sparse.csr_matrix((data, indices, indptr), shape=(len(indptr) - 1, n_features))
+
+
+def iter_libsvm(path, int chunk_rows=100000, int n_features=0, int block_size=2**22, int n_jobs=1,
+                bint fields=False):
+    """Read a LibSVM file in chunks without loading the whole file.
+
+    Feature indices are kept as they are in the file.
+
+    Args:
+        path (str): a file path to the libsvm format sparse file
+        chunk_rows (int): maximum number of rows in a chunk
+        n_features (int): number of features. If 0, it is inferred per chunk
+        block_size (int): number of bytes to read from the file at a time
+        n_jobs (int): number of threads to parse each block with
+        fields (boolean): whether features are field:index:value triples as
+            in the libffm format
+
+    Yields:
+        X (scipy.sparse.csr_matrix): a sparse matrix for input features
+        y (numpy.array): targets
+        fields (numpy.array): fields of X.indices, only if fields is True
+    """
+    blocks = []     # (indptr, indices, data, y, fields) of parsed rows not yielded yet
+    n_rows = 0
+
+    rest = b''
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            buf = rest + block
+
+            # parse complete lines only, unless it is the end of the file
+            end = buf.rfind(b'\n') + 1 if block else len(buf)
+            parsed = parse_libsvm(buf, end, n_jobs, fields)
+            rest = buf[end:]
+            if len(parsed[3]) > 0:
+                blocks.append(parsed[:4] + (parsed[6] if fields else None,))
+                n_rows += len(parsed[3])
+
+            # concatenate the blocks once for all chunks in them
+            if n_rows >= chunk_rows or (not block and n_rows > 0):
+                indptr = np.concatenate([np.zeros((1,), dtype=np.intp)] +
+                                        [np.diff(b[0]) for b in blocks]).cumsum()
+                indices, data, y = (np.concatenate([b[i] for b in blocks]) for i in range(1, 4))
+                field_array = np.concatenate([b[4] for b in blocks]) if fields else None
+
+                start = 0
+                while n_rows - start >= chunk_rows or (not block and start < n_rows):
+                    stop = min(start + chunk_rows, n_rows)
+                    nnz_start = indptr[start]
+                    nnz_stop = indptr[stop]
+                    X = to_csr(indptr[start:stop + 1] - nnz_start, indices[nnz_start:nnz_stop],
+                               data[nnz_start:nnz_stop], n_features)
+                    if fields:
+                        yield X, y[start:stop], field_array[nnz_start:nnz_stop]
+                    else:
+                        yield X, y[start:stop]
+                    start = stop
+
+                # carry the rows left over to the next chunk
+                nnz_start = indptr[start]
+                blocks = [(indptr[start:] - nnz_start, indices[nnz_start:], data[nnz_start:], y[start:],
+                           field_array[nnz_start:] if fields else None)] if start < n_rows else []
+                n_rows -= start
+
+            if not block:
+                break
+
+
+def load_libsvm(path, int n_features=0, zero_based='auto', int n_jobs=1, bint fields=False):
+    """Load a LibSVM file into a CSR matrix.
+
+    Args:
+        path (str): a file path to the libsvm format sparse file
+        n_features (int): number of features. If 0, it is inferred from the file
+        zero_based (boolean or 'auto'): whether feature indices start from 0 or
+            1. With 'auto', they are assumed to start from 1 unless there is 0.
+        n_jobs (int): number of threads to parse the file with
+        fields (boolean): whether features are field:index:value triples as
+            in the libffm format. Fields are kept as they are in the file
+
+    Returns:
+        X (scipy.sparse.csr_matrix): a sparse matrix for input features
+        y (numpy.array): targets
+        fields (numpy.array): fields of X.indices, only if fields is True
+    """
+    with open(path, 'rb') as f:
+        buf = f.read()
+
+    parsed = parse_libsvm(buf, -1, n_jobs, fields)
+    indptr, indices, data, y, min_index = parsed[:5]
+    if zero_based is False or (zero_based == 'auto' and min_index > 0):
+        if min_index == 0:
+            raise ValueError('feature index 0 in the one-based file {}'.format(path))
+        indices -= 1
+
+    if fields:
+        return to_csr(indptr, indices, data, n_features), y, parsed[6]
+    return to_csr(indptr, indices, data, n_features), y
@@ -1,10 +1,14 @@
-from .ftrl import FTRL
+from .ftrl import FTRL, FrozenFTRL
 from .fm import FM
+from .ffm import FFM
 from .nn import NN
 from .nn_h2 import NN_H2
 from .sgd import SGD
+from .parallel import merge, parallel_fit
+from .progressive import ProgressiveValidation
 from .classification_tree import ClassificationTree
+from .random_forest import OnlineRandomForest
 
 
-__all__ = ['FTRL', 'FM', 'NN', 'NN_H2', 'SGD',
-           'ClassificationTree']
+__all__ = ['FTRL', 'FrozenFTRL', 'FM', 'FFM', 'NN', 'NN_H2', 'SGD',
+           'ClassificationTree', 'OnlineRandomForest', 'ProgressiveValidation', 'merge', 'parallel_fit']
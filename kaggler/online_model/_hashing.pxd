@@ -0,0 +1,169 @@
+from libc.stdlib cimport abs
+cimport numpy as np
+
+
+cdef extern from "murmurhash/MurmurHash3.h":
+    void MurmurHash3_x86_32(void *key, int len, np.uint32_t seed, void *out) nogil
+
+
+cdef inline int murmurhash3_int_s32(int key, unsigned int seed) nogil:
+    """Compute the 32bit murmurhash3 of a int key at seed."""
+    cdef int out
+    MurmurHash3_x86_32(&key, sizeof(int), seed, &out)
+    return out
+
+
+cdef inline int hash_pair(int a, int b, int n) nogil:
+    """Hash a pair of features into [0, n).
+
+    The smaller feature is the seed to hash the larger one with, so a pair
+    hashes the same in either order, while pairs with the same product of
+    features, e.g. (2, 6) and (3, 4), hash apart.
+    """
+    if a > b:
+        a, b = b, a
+    return <unsigned int>abs(murmurhash3_int_s32(b, seed=a)) % n
+
+
+cdef inline int n_hashed_indices(int x_len, bint interaction) nogil:
+    """Return the number of hashed indices for a row with x_len features."""
+    cdef int indices_num = x_len + 1
+
+    if interaction:
+        indices_num += x_len * (x_len - 1) // 2
+    return indices_num
+
+
+cdef inline int hash_indices(int* x, int x_len, int n, bint interaction, int* indices) nogil:
+    """Hash features into an index buffer.
+
+    The first index is for the bias, followed by the features and, with
+    interaction, the hash_pair() of every pair of features.
+
+    Args:
+        x (int*): index of non-zero features
+        x_len (int): number of non-zero features
+        n (int): number of features after hashing trick
+        interaction (boolean): whether to use 2nd order interaction or not
+        indices (int*): buffer with room for n_hashed_indices(x_len) indices
+
+    Returns:
+        the number of indices written into the buffer
+    """
+    cdef int i
+    cdef int j
+    cdef int k = 0
+
+    indices[k] = n
+    k += 1
+
+    for i in range(x_len):
+        indices[k] = x[i] % n
+        k += 1
+
+    if interaction:
+        for i in range(x_len - 1):
+            for j in range(i + 1, x_len):
+                indices[k] = hash_pair(x[i], x[j], n)
+                k += 1
+    return k
+
+
+cdef struct Crosses:
+    int* groups     # first feature indices of groups in ascending order
+    int n_groups
+    int* pairs      # pairs of crossed groups with the smaller group first
+    int n_pairs
+
+
+cdef inline int n_cross_indices(int x_len, Crosses* crosses) nogil:
+    """Return the size of the index buffer for a row with x_len features and group crosses.
+
+    Room for the hashed indices of all pairs of features is followed by
+    scratch space to sort features by their groups.
+    """
+    return n_hashed_indices(x_len, True) + crosses.n_groups + 1 + 2 * x_len
+
+
+cdef inline int feature_group(int x, Crosses* crosses) nogil:
+    """Return the group of a feature with binary search."""
+    cdef int lo = 0
+    cdef int hi = crosses.n_groups - 1
+    cdef int mid
+
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if crosses.groups[mid] <= x:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+cdef inline int hash_cross_indices(int* x, int x_len, int n, Crosses* crosses, int* indices) nogil:
+    """Hash features and the pairs of features in crossed groups into an index buffer.
+
+    Features are sorted by their groups with counting sort, so that the pairs
+    of each cross are enumerated from the group offsets of the row.
+
+    Args:
+        x (int*): index of non-zero features
+        x_len (int): number of non-zero features
+        n (int): number of features after hashing trick
+        crosses (Crosses*): groups and their crosses
+        indices (int*): buffer with room for n_cross_indices(x_len) indices
+
+    Returns:
+        the number of indices written into the buffer
+    """
+    cdef int* offsets = indices + n_hashed_indices(x_len, True)
+    cdef int* group = offsets + crosses.n_groups + 1
+    cdef int* grouped = group + x_len
+    cdef int g
+    cdef int g1
+    cdef int g2
+    cdef int i
+    cdef int j
+    cdef int p
+    cdef int k = 0
+
+    indices[k] = n
+    k += 1
+
+    for i in range(x_len):
+        indices[k] = x[i] % n
+        k += 1
+
+    # count features per group, and turn the counts into the offsets where
+    # groups start
+    for g in range(crosses.n_groups + 1):
+        offsets[g] = 0
+    for i in range(x_len):
+        group[i] = feature_group(x[i], crosses)
+        offsets[group[i] + 1] += 1
+    for g in range(crosses.n_groups):
+        offsets[g + 1] += offsets[g]
+
+    # place features at the starts of their groups, which moves each offset
+    # to the start of the next group, and shift the offsets back
+    for i in range(x_len):
+        grouped[offsets[group[i]]] = x[i]
+        offsets[group[i]] += 1
+    for g in range(crosses.n_groups, 0, -1):
+        offsets[g] = offsets[g - 1]
+    offsets[0] = 0
+
+    for p in range(crosses.n_pairs):
+        g1 = crosses.pairs[2 * p]
+        g2 = crosses.pairs[2 * p + 1]
+        if g1 == g2:
+            for i in range(offsets[g1], offsets[g1 + 1] - 1):
+                for j in range(i + 1, offsets[g1 + 1]):
+                    indices[k] = hash_pair(grouped[i], grouped[j], n)
+                    k += 1
+        else:
+            for i in range(offsets[g1], offsets[g1 + 1]):
+                for j in range(offsets[g2], offsets[g2 + 1]):
+                    indices[k] = hash_pair(grouped[i], grouped[j], n)
+                    k += 1
+    return k
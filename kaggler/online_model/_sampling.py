@@ -0,0 +1,72 @@
+import numpy as np
+
+
+def check_sample_weight(sample_weight, row_num):
+    """Check sample weights of rows to update an online model with.
+
+    Args:
+        sample_weight (numpy.array): non-negative weights of rows, or None for
+                                     the weight 1 for every row
+        row_num (int): number of rows
+
+    Returns:
+        sample_weight (numpy.array): float64 weights of rows
+    """
+    if sample_weight is None:
+        return np.ones((row_num,), dtype=np.float64)
+
+    sample_weight = np.ascontiguousarray(sample_weight, dtype=np.float64)
+    if sample_weight.shape != (row_num,):
+        raise ValueError('sample_weight should have {} weights, not {}'.format(row_num, sample_weight.shape))
+    if (sample_weight < 0).any():
+        raise ValueError('sample_weight should be non-negative')
+    return sample_weight
+
+
+def check_indices(indices, n):
+    """Check that feature indices are in range of a model without the hashing trick.
+
+    Args:
+        indices (numpy.array): indices of non-zero features, e.g. X.indices
+        n (int): number of features of the model
+
+    Returns:
+        indices (numpy.array): the indices as an int32 array
+    """
+    indices = np.asarray(indices)
+    if len(indices) > 0 and (indices.min() < 0 or indices.max() >= n):
+        raise ValueError('feature indices are out of range for {} features'.format(n))
+    return np.ascontiguousarray(indices, dtype=np.int32)
+
+
+def check_negative_sampling_rate(rate):
+    """Check the rate of negative rows kept in the training data.
+
+    Args:
+        rate (double): a rate in (0, 1]
+
+    Returns:
+        rate (double): the rate
+    """
+    rate = float(rate)
+    if not 0. < rate <= 1.:
+        raise ValueError('negative_sampling_rate should be in (0, 1], not {}'.format(rate))
+    return rate
+
+
+def calibrate(p, rate):
+    """Correct predictions of a model trained with negative rows downsampled by the rate.
+
+    With negative rows kept at the rate, odds of predictions are inflated by
+    1 / rate, which the correction p / (p + (1 - p) / rate) reverts.
+
+    Args:
+        p (numpy.array or double): predictions of the model
+        rate (double): the rate of negative rows kept in the training data
+
+    Returns:
+        p (numpy.array or double): calibrated predictions
+    """
+    if rate == 1.:
+        return p
+    return p / (p + (1. - p) / rate)
@@ -0,0 +1,103 @@
+import json
+import numpy as np
+import os
+
+
+STATE_FILE = 'params.json'
+DTYPES = (np.float32, np.float64)
+
+
+def check_dtype(dtype):
+    """Check the dtype of weights and counters of an online model.
+
+    Args:
+        dtype (numpy.dtype or str): float32 or float64
+
+    Returns:
+        dtype (numpy.dtype): the dtype
+    """
+    dtype = np.dtype(dtype)
+    if dtype not in DTYPES:
+        raise ValueError('dtype should be float32 or float64, not {}'.format(dtype))
+    return dtype
+
+
+def check_n_jobs(n_jobs, name='n_jobs'):
+    """Check the number of threads or processes of an online model.
+
+    Args:
+        n_jobs (int): a positive number, or -1 for all CPUs
+        name (str): the name of the argument for the error message
+
+    Returns:
+        n_jobs (int): the number
+    """
+    if n_jobs == 0 or n_jobs < -1:
+        raise ValueError('{} should be positive or -1 for all CPUs, not {}'.format(name, n_jobs))
+    return n_jobs
+
+
+def save_state(model, path):
+    """Save the state of an online model into a directory.
+
+    Hyperparameters and scalar states are saved in params.json, and each array
+    in its own .npy file so that load_state() can memory-map it.
+
+    Args:
+        model: an online model object with _get_state()
+        path (str): a path to the directory to save the model into
+    """
+    params, arrays = model._get_state()
+
+    os.makedirs(path, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(path, name + '.npy'), np.ascontiguousarray(array))
+
+    with open(os.path.join(path, STATE_FILE), 'w') as f:
+        json.dump({'model': type(model).__name__,
+                   'params': params,
+                   'arrays': sorted(arrays)}, f)
+
+
+def load_state(cls, path, mmap=True):
+    """Load an online model saved by save_state().
+
+    With mmap=True, arrays are memory-mapped copy-on-write instead of being
+    read into memory.  Processes loading the same model share its pages until
+    they update them, and updates are never written back to the files.
+
+    Args:
+        cls (type): a class of the online model
+        path (str): a path to the directory the model is saved in
+        mmap (boolean): whether to memory-map arrays or not
+
+    Returns:
+        an online model object
+    """
+    with open(os.path.join(path, STATE_FILE)) as f:
+        state = json.load(f)
+
+    if state['model'] != cls.__name__:
+        raise ValueError('{} contains a {} model, not {}'.format(path, state['model'], cls.__name__))
+
+    mmap_mode = 'c' if mmap else None
+    arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)
+              for name in state['arrays']}
+
+    return restore_state(cls, state['params'], arrays)
+
+
+def restore_state(cls, params, arrays):
+    """Create an online model object from its state without initializing it.
+
+    Args:
+        cls (type): a class of the online model
+        params (dict): hyperparameters and scalar states of the model
+        arrays (dict): arrays of the model
+
+    Returns:
+        an online model object
+    """
+    model = cls.__new__(cls)
+    model._set_state(params, arrays)
+    return model
@@ -1,125 +1,431 @@
-import random
+# cython: boundscheck=False
+# cython: wraparound=False
+# cython: cdivision=True
 import numpy as np
+
+cimport cython
+from libc.math cimport log, sqrt, INFINITY
 cimport numpy as np
 
 
-ctypedef np.int_t DTYPE_t
+np.import_array()
+
+
+cdef double gini_impurity(double* counts, int n_classes, double n) nogil:
+    """Return the gini impurity of class counts with the total n."""
+    cdef int c
+    cdef double s = 0.
+
+    if n <= 0.:
+        return 0.
 
+    for c in range(n_classes):
+        s += (counts[c] / n) * (counts[c] / n)
+    return 1. - s
 
-cpdef tuple bin_split(list sample_feature, double feature_value):
-    cdef list left, right
-    cdef tuple x
-    left = [x[1] for x in sample_feature if x[0]<=feature_value]
-    right = [x[1] for x in sample_feature if x[0]>feature_value]
-    return left, right
+
+def _grow(a, int n):
+    """Return a copy of an array with n rows, padded with zeros."""
+    a = np.asarray(a)
+    grown = np.zeros((n,) + a.shape[1:], dtype=a.dtype)
+    grown[:a.shape[0]] = a
+    return grown
 
 
 cdef class Tree:
+    """Hoeffding tree with its nodes and leaf statistics in arrays.
+
+    Nodes are rows of arrays, with the split feature and threshold of
+    internal nodes, and the class counts of all nodes.  Each leaf owns a
+    slot of the statistics, the class histograms of number_of_functions
+    randomly selected features, binned by the bin boundaries of features.
+    Slots of split leaves are reused by new leaves.
+
+    Rows are added to the statistics of their leaves without the GIL.  Every
+    min_sample_split rows, a leaf scores the bin boundaries of its features
+    by the gini gain, and splits on the best one if the Hoeffding bound
+    ensures it is better than the best of the other features (VFDT).
+
+    Attributes:
+        number_of_features (int): number of features
+        number_of_functions (int): number of features selected for each leaf
+        min_sample_split (int): number of rows between split attempts of a leaf
+        n_classes (int): number of classes
+        n_bins (int): number of bins of the histograms
+        max_depth (int): maximum depth of leaves
+        delta (double): probability of choosing a wrong split
+        tau (double): Hoeffding bound under which ties are split
+        node_count (int): number of nodes
+    """
+    cdef readonly int number_of_features
+    cdef readonly int number_of_functions
+    cdef readonly int min_sample_split
+    cdef readonly int n_classes
+    cdef readonly int n_bins
+    cdef readonly int max_depth
+    cdef readonly double delta
+    cdef readonly double tau
+    cdef readonly int node_count
+    cdef readonly bint has_bins
+    cdef int slot_count
+    cdef int n_free
+    cdef unsigned long long rng
+
+    cdef int[::1] feature           # split features of nodes, or -1 for leaves
+    cdef double[::1] threshold      # rows with x[feature] <= threshold go left
+    cdef int[::1] left
+    cdef int[::1] right
+    cdef int[::1] depth
+    cdef int[::1] slot              # statistics slots of leaves, or -1
+    cdef double[::1] n_check        # weights of rows since the last split attempt
+    cdef double[:, ::1] counts      # class counts of nodes
+
+    cdef double[:, ::1] edges       # bin boundaries of features, padded with inf
+    cdef int[:, ::1] selected       # features of slots
+    cdef double[:, :, :, ::1] stats     # class histograms of the features of slots
+    cdef int[::1] free_slots
+
+    cdef int[::1] _perm             # permutation of features to select from
+    cdef double[::1] _scratch       # class counts of the total, left and right
+
+    def __init__(self,
+                 int number_of_features,
+                 int number_of_functions=10,
+                 int min_sample_split=200,
+                 int n_classes=2,
+                 int n_bins=32,
+                 int max_depth=20,
+                 double delta=1e-7,
+                 double tau=.05,
+                 random_state=None):
+        """Initialize the Tree class object.
+
+        Args:
+            number_of_features (int): number of features
+            number_of_functions (int): number of features randomly selected
+                                       for the statistics of each leaf
+            min_sample_split (int): number of rows between split attempts of a leaf
+            n_classes (int): number of classes
+            n_bins (int): number of bins of the histograms
+            max_depth (int): maximum depth of leaves
+            delta (double): probability of choosing a wrong split
+            tau (double): Hoeffding bound under which ties are split
+            random_state (int): seed of the feature selection
+        """
+        if number_of_features < number_of_functions:
+            raise ValueError('number_of_functions should not be more than number_of_features')
+        if number_of_functions < 1 or min_sample_split < 1 or n_classes < 2 or n_bins < 2:
+            raise ValueError('number_of_functions, min_sample_split, n_bins should be positive, '
+                             'and n_classes should be at least 2')
 
-    def __cinit__(
-            self,
-            int number_of_features,
-            int number_of_functions=10,
-            int min_sample_split=20,
-            dict predict_initialize={
-                'mean':2.0,
-                'variance':1.0,
-                'num_samples':0
-            }
-        ):
-        # Constant values
         self.number_of_features = number_of_features
         self.number_of_functions = number_of_functions
         self.min_sample_split = min_sample_split
-        self.predict_initialize = predict_initialize
-        self.max_sample = 100
-        # Dynamic values
-        self.left = None
-        self.right = None
-        self.randomly_selected_features = []
-        self._randomly_select()
-        self.criterion = None
-
-
-    def _randomly_select(self):
-        # Check the number of randomly selected features
-        if self.number_of_features < self.number_of_functions:
-            raise Exception("The feature number is more than maximum")
-
-        # Randomly select features into a set, and then transform to a list
-        self.randomly_selected_features=set([])
-        while len(self.randomly_selected_features) < self.number_of_functions:
-            self.randomly_selected_features.add(\
-                random.randint(0, self.number_of_features-1))
-        self.randomly_selected_features = list(self.randomly_selected_features)
-
-        # Initialize the samples belong to the node
-        self.samples = {}
-        self.Y = []
-        for feature in self.randomly_selected_features:
-            self.samples[feature] = []
-
-    def _is_leaf(self):
-        return self.criterion == None
-
-    cpdef update(self, np.ndarray x, y):
-        """
-        Update the model according to a single (x, y) input.
+        self.n_classes = n_classes
+        self.n_bins = n_bins
+        self.max_depth = max_depth
+        self.delta = delta
+        self.tau = tau
+        self.rng = np.random.RandomState(random_state).randint(1, 2**31)
+
+        self.has_bins = False
+        self.edges = np.full((number_of_features, n_bins - 1), np.inf)
+        self._perm = np.arange(number_of_features, dtype=np.int32)
+        self._scratch = np.zeros((3 * n_classes,), dtype=np.float64)
 
-        If the current node is a leaf, then update the samples of the
-        current node.
+        self.node_count = 1
+        self.feature = np.full((16,), -1, dtype=np.int32)
+        self.threshold = np.zeros((16,), dtype=np.float64)
+        self.left = np.full((16,), -1, dtype=np.int32)
+        self.right = np.full((16,), -1, dtype=np.int32)
+        self.depth = np.zeros((16,), dtype=np.int32)
+        self.slot = np.full((16,), -1, dtype=np.int32)
+        self.n_check = np.zeros((16,), dtype=np.float64)
+        self.counts = np.zeros((16, n_classes), dtype=np.float64)
 
-        Else update its left or right node recursively according to the
-        value of x.
-        When the left and right child are created, they inherit mean and
-        sample count information from the parent.
+        self.slot_count = 0
+        self.n_free = 0
+        self.selected = np.zeros((8, number_of_functions), dtype=np.int32)
+        self.stats = np.zeros((8, number_of_functions, n_bins, n_classes), dtype=np.float64)
+        self.free_slots = np.zeros((8,), dtype=np.int32)
+        if self.max_depth > 0:
+            self.slot[0] = self._new_slot()
+
+    def _grow_nodes(self):
+        cdef int n = 2 * self.feature.shape[0]
+
+        self.feature = _grow(self.feature, n)
+        self.threshold = _grow(self.threshold, n)
+        self.left = _grow(self.left, n)
+        self.right = _grow(self.right, n)
+        self.depth = _grow(self.depth, n)
+        self.slot = _grow(self.slot, n)
+        self.n_check = _grow(self.n_check, n)
+        self.counts = _grow(self.counts, n)
+
+    def _grow_slots(self):
+        cdef int n = 2 * self.stats.shape[0]
+
+        self.selected = _grow(self.selected, n)
+        self.stats = _grow(self.stats, n)
+        self.free_slots = _grow(self.free_slots, n)
+
+    def _set_bins(self, X):
+        """Set the bin boundaries of features to their quantiles in X.
+
+        Args:
+            X (numpy.array): rows of features
         """
-        cdef int N
-        if self._is_leaf():
-            N = len(self.Y)
-            if N <= self.max_sample:
-                self._update_samples(x, y)
-            if N == self.min_sample_split or N == 2 * self.min_sample_split:
-                self._apply_best_split()
+        cdef int f
+
+        q = np.linspace(0., 1., self.n_bins + 1)[1:-1]
+        edges = np.full((self.number_of_features, self.n_bins - 1), np.inf)
+        for f in range(self.number_of_features):
+            # the maximum is not a boundary, as no row would go right of it
+            boundaries = np.unique(np.quantile(X[:, f], q))
+            boundaries = boundaries[boundaries < X[:, f].max()]
+            edges[f, :len(boundaries)] = boundaries
+
+        self.edges = edges
+        self.has_bins = True
 
+    cdef inline unsigned long long _rand(self) nogil:
+        """Return a random number with xorshift64*."""
+        self.rng ^= self.rng >> 12
+        self.rng ^= self.rng << 25
+        self.rng ^= self.rng >> 27
+        return self.rng * 2685821657736338717ULL
+
+    cdef int _new_slot(self) nogil:
+        """Return a statistics slot with no rows and randomly selected features."""
+        cdef int s
+        cdef int i
+        cdef int j
+        cdef int f
+        cdef int b
+        cdef int c
+
+        if self.n_free > 0:
+            self.n_free -= 1
+            s = self.free_slots[self.n_free]
         else:
-            if self.criterion(x):
-                self.right.update(x, y)
+            if self.slot_count == self.stats.shape[0]:
+                with gil:
+                    self._grow_slots()
+            s = self.slot_count
+            self.slot_count += 1
+
+        # partial Fisher-Yates shuffle of features
+        for i in range(self.number_of_functions):
+            j = i + <int>(self._rand() % <unsigned long long>(self.number_of_features - i))
+            f = self._perm[j]
+            self._perm[j] = self._perm[i]
+            self._perm[i] = f
+            self.selected[s, i] = f
+            for b in range(self.n_bins):
+                for c in range(self.n_classes):
+                    self.stats[s, i, b, c] = 0.
+        return s
+
+    cdef inline int _bin(self, int f, double x) nogil:
+        """Return the bin of a feature value, the number of boundaries below it."""
+        cdef int lo = 0
+        cdef int hi = self.n_bins - 1
+        cdef int mid
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.edges[f, mid] < x:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    cdef inline int _leaf(self, double* x) nogil:
+        """Return the leaf of a row."""
+        cdef int node = 0
+
+        while self.feature[node] >= 0:
+            if x[self.feature[node]] <= self.threshold[node]:
+                node = self.left[node]
             else:
-                self.left.update(x, y)
-
-    cpdef _update_samples(self, np.ndarray x, DTYPE_t y):
-        cdef int feature
-        for feature in self.randomly_selected_features:
-            self.samples[feature].append((x[feature], y))
-        self.Y.append(y)
-
-    cpdef tuple _find_best_split(self):
-        cdef dict best_split = {}
-        cdef double best_split_score = 0
-        cdef int feature
-        cdef double value
-        cdef DTYPE_t prediction
-        cdef list sample_feature
-        cdef list left, right
-        cdef dict split
-        cdef double split_score
-        # Try all the selected features and values combination, find the best
-        for feature in self.randomly_selected_features:
-            for (value, prediction) in self.samples[feature]:
-                sample_feature = self.samples[feature]
-                left, right = bin_split(sample_feature, value)
-
-                split = {
-                    'left': left,
-                    'right': right,
-                    'value': value,
-                    'feature': feature,
-                }
-
-                split_score = self._calculate_split_score(split)
-                if split_score > best_split_score:
-                    best_split = split
-                    best_split_score = split_score
-
-        return best_split, best_split_score
+                node = self.right[node]
+        return node
+
+    cdef void _update_row(self, double* x, int y, double weight) nogil:
+        """Add a row to the class counts and statistics of its leaf.
+
+        Args:
+            x (double*): features of the row
+            y (int): the class of the row
+            weight (double): the weight of the row
+        """
+        cdef int node = self._leaf(x)
+        cdef int s = self.slot[node]
+        cdef int i
+
+        self.counts[node, y] += weight
+        if s < 0:
+            return
+
+        for i in range(self.number_of_functions):
+            self.stats[s, i, self._bin(self.selected[s, i], x[self.selected[s, i]]), y] += weight
+
+        self.n_check[node] += weight
+        if self.n_check[node] >= self.min_sample_split:
+            self.n_check[node] = 0.
+            self._attempt_split(node)
+
+    cdef void _attempt_split(self, int node) nogil:
+        """Split a leaf on the best bin boundary if the Hoeffding bound allows."""
+        cdef int s = self.slot[node]
+        cdef int nc = self.n_classes
+        cdef double* total = &self._scratch[0]
+        cdef double* left = &self._scratch[nc]
+        cdef double* right = &self._scratch[2 * nc]
+        cdef int i
+        cdef int b
+        cdef int c
+        cdef int f
+        cdef int b_feature = -1
+        cdef int i_best = -1
+        cdef int b_best = -1
+        cdef double n = 0.
+        cdef double n_left
+        cdef double impurity
+        cdef double gain
+        cdef double gain_feature
+        cdef double best = 0.
+        cdef double second = 0.
+        cdef double eps
+
+        for c in range(nc):
+            total[c] = 0.
+            for b in range(self.n_bins):
+                total[c] += self.stats[s, 0, b, c]
+            n += total[c]
+        impurity = gini_impurity(total, nc, n)
+
+        for i in range(self.number_of_functions):
+            f = self.selected[s, i]
+            gain_feature = 0.
+            n_left = 0.
+            for c in range(nc):
+                left[c] = 0.
+
+            # score the boundaries with the cumulative class counts of bins
+            for b in range(self.n_bins - 1):
+                if self.edges[f, b] == INFINITY:
+                    break
+
+                for c in range(nc):
+                    left[c] += self.stats[s, i, b, c]
+                    n_left += self.stats[s, i, b, c]
+                    right[c] = total[c] - left[c]
+                if n_left <= 0. or n_left >= n:
+                    continue
+
+                gain = impurity - (n_left * gini_impurity(left, nc, n_left) +
+                                   (n - n_left) * gini_impurity(right, nc, n - n_left)) / n
+                if gain > gain_feature:
+                    gain_feature = gain
+                    b_feature = b
+
+            if gain_feature > best:
+                second = best
+                best = gain_feature
+                i_best = i
+                b_best = b_feature
+            elif gain_feature > second:
+                second = gain_feature
+
+        if i_best < 0:
+            return
+
+        # the range of the gini gain is at most 1
+        eps = sqrt(log(1. / self.delta) / (2. * n))
+        if best - second > eps or eps < self.tau:
+            self._split(node, i_best, b_best)
+
+    cdef void _split(self, int node, int i, int b) nogil:
+        """Split a leaf on the boundary b of its i-th feature into two leaves."""
+        cdef int s = self.slot[node]
+        cdef int f = self.selected[s, i]
+        cdef int child
+        cdef int k
+        cdef int bb
+        cdef int c
+
+        if self.node_count + 2 > self.feature.shape[0]:
+            with gil:
+                self._grow_nodes()
+
+        self.feature[node] = f
+        self.threshold[node] = self.edges[f, b]
+        self.left[node] = self.node_count
+        self.right[node] = self.node_count + 1
+
+        # children start with the class counts of their sides of the histogram
+        for k in range(2):
+            child = self.node_count + k
+            self.feature[child] = -1
+            self.left[child] = -1
+            self.right[child] = -1
+            self.depth[child] = self.depth[node] + 1
+            self.n_check[child] = 0.
+            for c in range(self.n_classes):
+                self.counts[child, c] = 0.
+                for bb in range(self.n_bins):
+                    if (bb <= b) == (k == 0):
+                        self.counts[child, c] += self.stats[s, i, bb, c]
+        self.node_count += 2
+
+        self.slot[node] = -1
+        self.free_slots[self.n_free] = s
+        self.n_free += 1
+        for k in range(2):
+            child = self.node_count - 2 + k
+            self.slot[child] = self._new_slot() if self.depth[child] < self.max_depth else -1
+
+    def _update(self, double[:, ::1] X, int[::1] y, double[::1] sample_weight):
+        """Add rows to the tree without the GIL.
+
+        Args:
+            X (numpy.array): rows of features
+            y (numpy.array): classes of rows
+            sample_weight (numpy.array): weights of rows
+        """
+        cdef int row
+
+        with nogil:
+            for row in range(X.shape[0]):
+                if sample_weight[row] > 0.:
+                    self._update_row(&X[row, 0], y[row], sample_weight[row])
+
+    def _predict_proba(self, double[:, ::1] X):
+        """Predict class probabilities of rows from the class counts of their leaves.
+
+        Args:
+            X (numpy.array): rows of features
+
+        Returns:
+            p (numpy.array): class probabilities of rows
+        """
+        cdef int row
+        cdef int node
+        cdef int c
+        cdef double n
+        cdef double[:, ::1] p_view
+
+        p = np.zeros((X.shape[0], self.n_classes), dtype=np.float64)
+        p_view = p
+        with nogil:
+            for row in range(X.shape[0]):
+                node = self._leaf(&X[row, 0])
+                n = 0.
+                for c in range(self.n_classes):
+                    n += self.counts[node, c]
+                for c in range(self.n_classes):
+                    p_view[row, c] = self.counts[node, c] / n if n > 0. else 1. / self.n_classes
+
+        return p
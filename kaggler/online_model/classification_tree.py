@@ -1,86 +1,120 @@
+import numpy as np
+
+from ._sampling import check_sample_weight
 from ._tree import Tree
-from ..util import gini, count_dict, argmax
 
 
 class ClassificationTree(Tree):
+    """Online classification tree that splits leaves by the Hoeffding bound (VFDT).
+
+    Each leaf keeps class histograms of number_of_functions randomly selected
+    features in numpy arrays, which it scores every min_sample_split rows for
+    a split.  The bin boundaries of the histograms are the quantiles of the
+    first min_sample_split rows, which are buffered until then.
+
+    Both update() and predict() take a row or a batch of rows.
+    """
 
     def __init__(self,
                  number_of_features,
                  number_of_functions=10,
                  min_sample_split=200,
-                 predict_initialize={'count_dict': {}}):
-
-        # Constant values
-        self.number_of_features = number_of_features
-        self.number_of_functions = number_of_functions
-        self.min_sample_split = min_sample_split
-        self.predict_initialize = predict_initialize
-        self.max_sample = 1000
-
-        # Dynamic values
-        self.left = None
-        self.right = None
-        self.randomly_selected_features = []
-        self._randomly_select()
-        self.criterion = None
-
-    def _calculate_split_score(self, split):
-        """Calculate the score of the split.
-
-        score = current_error - after_split_error
+                 n_classes=2,
+                 n_bins=32,
+                 max_depth=20,
+                 delta=1e-7,
+                 tau=.05,
+                 random_state=None):
+        """Initialize the ClassificationTree class object.
+
+        Args:
+            number_of_features (int): number of features
+            number_of_functions (int): number of features randomly selected
+                                       for the statistics of each leaf
+            min_sample_split (int): number of rows between split attempts of
+                                    a leaf, and the rows to set the bin
+                                    boundaries with
+            n_classes (int): number of classes
+            n_bins (int): number of bins of the histograms
+            max_depth (int): maximum depth of leaves
+            delta (double): probability of choosing a wrong split
+            tau (double): Hoeffding bound under which ties are split
+            random_state (int): seed of the feature selection
         """
-        left_error = gini(split['left'])
-        right_error = gini(split['right'])
-        error = gini(self.Y)
-        # if the split is any good, the score should be greater than 0
-        total = float(len(self.Y))
-        score = (error - 1 / total * (len(split['left']) * left_error +
-                                      len(split['right']) * right_error))
-        return score
-
-    def _apply_best_split(self):
-        best_split, best_split_score = self._find_best_split()
-        if best_split_score > 0:
-            self.criterion = lambda x: x[best_split['feature']] \
-                             > best_split['value']
-            # create the left child
-            self.left = ClassificationTree(
-                number_of_features=self.number_of_features,
-                number_of_functions=self.number_of_functions,
-                min_sample_split=self.min_sample_split,
-                predict_initialize={
-                    'count_dict': count_dict(best_split['left']),
-                }
-            )
-            # create the right child
-            self.right = ClassificationTree(
-                number_of_features=self.number_of_features,
-                number_of_functions=self.number_of_functions,
-                min_sample_split=self.min_sample_split,
-                predict_initialize={
-                    'count_dict': count_dict(best_split['right']),
-                }
-            )
-            # Collect garbage
-            self.samples = {}
-            self.Y = []
+        super().__init__(number_of_features, number_of_functions, min_sample_split, n_classes, n_bins,
+                         max_depth, delta, tau, random_state)
+        self._buffer = []       # rows before the bin boundaries are set
 
-    def predict(self, x):
+    def __repr__(self):
+        return ('ClassificationTree(number_of_features={}, number_of_functions={}, min_sample_split={}, '
+                'n_classes={}, n_bins={}, max_depth={}, delta={}, tau={})').format(
+            self.number_of_features, self.number_of_functions, self.min_sample_split, self.n_classes,
+            self.n_bins, self.max_depth, self.delta, self.tau
+        )
+
+    def _check_input(self, x):
+        X = np.ascontiguousarray(np.atleast_2d(x), dtype=np.float64)
+        if X.ndim != 2 or X.shape[1] != self.number_of_features:
+            raise ValueError('rows should have {} features'.format(self.number_of_features))
+        return X
+
+    def update(self, x, y, sample_weight=None):
+        """Update the model with a row or a batch of rows.
+
+        Args:
+            x (numpy.array): features of a row, or a 2D array of rows
+            y (int or numpy.array): the class of the row, or classes of rows
+            sample_weight (numpy.array): weights of rows
+
+        Returns:
+            the updated model
         """
-        Make prediction recursively. Use both the samples inside the current
-        node and the statistics inherited from parent.
+        X = self._check_input(x)
+        y = np.atleast_1d(np.asarray(y)).astype(np.int32)
+        sample_weight = check_sample_weight(sample_weight, X.shape[0])
+        if y.shape != (X.shape[0],) or (y < 0).any() or (y >= self.n_classes).any():
+            raise ValueError('y should have {} classes in [0, {})'.format(X.shape[0], self.n_classes))
+
+        if not self.has_bins:
+            self._buffer.append((X, y, sample_weight))
+            if sum(len(b[1]) for b in self._buffer) < self.min_sample_split:
+                return self
+
+            X, y, sample_weight = (np.concatenate(a) for a in zip(*self._buffer))
+            self._buffer = []
+            self._set_bins(X)
+
+        self._update(X, y, sample_weight)
+        return self
+
+    def predict_proba(self, x):
+        """Predict class probabilities for a row or a batch of rows.
+
+        Args:
+            x (numpy.array): features of a row, or a 2D array of rows
+
+        Returns:
+            p (numpy.array): class probabilities of the row, or of each row
         """
-        if self._is_leaf():
-            d1 = self.predict_initialize['count_dict']
-            d2 = count_dict(self.Y)
-            for key, value in d1.items():
-                if key in d2:
-                    d2[key] += value
-                else:
-                    d2[key] = value
-            return argmax(d2)
+        X = self._check_input(x)
+        if self.has_bins:
+            p = self._predict_proba(X)
         else:
-            if self.criterion(x):
-                return self.right.predict(x)
-            else:
-                return self.left.predict(x)
+            counts = np.zeros((self.n_classes,))
+            for _, y, sample_weight in self._buffer:
+                counts += np.bincount(y, sample_weight, minlength=self.n_classes)
+            p = np.tile(counts / counts.sum() if counts.sum() > 0 else 1. / self.n_classes, (X.shape[0], 1))
+
+        return p[0] if np.ndim(x) == 1 else p
+
+    def predict(self, x):
+        """Predict the class of a row or classes of a batch of rows.
+
+        Args:
+            x (numpy.array): features of a row, or a 2D array of rows
+
+        Returns:
+            p (int or numpy.array): the most frequent class in the leaf of the
+                                    row, or of each row
+        """
+        return np.argmax(self.predict_proba(x), axis=-1)
@@ -0,0 +1,550 @@
+# cython: boundscheck=False
+# cython: wraparound=False
+# cython: cdivision=True
+from multiprocessing import cpu_count
+import numpy as np
+from .._libsvm import iter_libsvm
+from ._sampling import calibrate, check_indices, check_negative_sampling_rate, check_sample_weight
+from ._state import check_dtype, check_n_jobs, save_state, load_state, restore_state
+
+cimport cython
+from cython.parallel cimport prange
+from libc.math cimport sqrt
+from ..util cimport sigm
+from .progressive cimport ProgressiveValidation
+cimport numpy as np
+
+
+np.import_array()
+
+
+cdef struct FFMWeights32:
+    float* w
+    float* c
+    float* V
+    float* G
+
+
+cdef struct FFMWeights64:
+    double* w
+    double* c
+    double* V
+    double* G
+
+
+ctypedef fused FFMWeights:
+    FFMWeights32
+    FFMWeights64
+
+
+cdef class FFM:
+    """Field-aware Factorization Machine online learner.
+
+    Each feature has a factor per field, and an interaction between two
+    features is the dot product of the factor of each for the field of the
+    other.  Factors are stored in one contiguous array, with the factor of
+    feature i for field f at V[(i * m + f) * k:(i * m + f + 1) * k].
+
+    Attributes:
+        n (int): number of input features
+        m (int): number of fields
+        epoch (int): number of epochs
+        k (int): size of factors for interactions
+        a (double): initial learning rate
+        l2 (double): L2 regularization parameter for factors
+        n_jobs (int): number of threads for Hogwild training. -1 uses all CPUs
+        w0 (double): weight for bias
+        c0 (double): counters
+        w (array of float or double): feature weights
+        c (array of float or double): counters for weights
+        V (array of float or double): feature weights for field-aware factors
+        G (array of float or double): sums of squared gradients for factors
+        dtype (numpy.dtype): float32 or float64 for weights and counters
+        negative_sampling_rate (double): rate of negative rows kept in the training data
+    """
+
+    cdef unsigned int epoch
+    cdef unsigned int n
+    cdef unsigned int m
+    cdef unsigned int k
+    cdef double a
+    cdef double l2
+    cdef int n_jobs
+    cdef double w0
+    cdef double c0
+    cdef object dtype
+    cdef double negative_sampling_rate
+    cdef bint is_float32
+    cdef np.ndarray w
+    cdef np.ndarray c
+    cdef np.ndarray V
+    cdef np.ndarray G
+    cdef FFMWeights32 _w32      # pointers to the arrays if dtype is float32
+    cdef FFMWeights64 _w64      # pointers to the arrays if dtype is float64
+
+    def __init__(self,
+                 unsigned int n,
+                 unsigned int n_fields,
+                 unsigned int epoch=10,
+                 unsigned int dim=4,
+                 double a=0.2,
+                 double l2=0.00002,
+                 seed=0,
+                 int n_jobs=1,
+                 dtype=np.float64,
+                 negative_sampling_rate=1.):
+        """Initialize the FFM class object.
+
+        Args:
+            n (int): number of input features
+            n_fields (int): number of fields
+            epoch (int): number of epochs
+            dim (int): size of factors for interactions
+            a (double): initial learning rate
+            l2 (double): L2 regularization parameter for factors
+            seed (int): random seed
+            n_jobs (int): number of threads for Hogwild training. -1 uses all
+                          CPUs
+            dtype (numpy.dtype): float32 or float64 for weights and counters.
+                                 float32 halves the memory of the model
+            negative_sampling_rate (double): rate of negative rows kept in the
+                                             training data, e.g. by
+                                             util.get_downsampled_index0().
+                                             Predictions are corrected for it
+        """
+        rng = np.random.RandomState(seed)
+
+        self.n = n          # # of features
+        self.m = n_fields   # # of fields
+        self.epoch = epoch  # # of epochs
+        self.k = dim        # interaction dimension
+        self.a = a          # learning rate
+        self.l2 = l2
+        self.n_jobs = check_n_jobs(n_jobs)
+        self.negative_sampling_rate = check_negative_sampling_rate(negative_sampling_rate)
+        self.dtype = check_dtype(dtype)
+
+        # initialize weights, field-aware factors, and counts
+        self.w0 = 0.
+        self.c0 = 0.
+        self.w = np.zeros((self.n,), dtype=self.dtype)
+        self.c = np.zeros((self.n,), dtype=self.dtype)
+        self.V = (rng.rand(self.n * self.m * self.k) / sqrt(max(self.k, 1))).astype(self.dtype)
+        self.G = np.ones((self.n * self.m * self.k,), dtype=self.dtype)
+        self._bind_arrays()
+
+    def __repr__(self):
+        return ('FFM(n={}, n_fields={}, epoch={}, dim={}, a={}, l2={}, n_jobs={}, dtype={}, '
+                'negative_sampling_rate={})').format(
+            self.n, self.m, self.epoch, self.k, self.a, self.l2, self.n_jobs, self.dtype.name,
+            self.negative_sampling_rate
+        )
+
+    def _bind_arrays(self):
+        """Point the weights of the dtype at the arrays."""
+        self.is_float32 = self.dtype == np.float32
+        if self.is_float32:
+            self._w32.w = <float*>np.PyArray_DATA(self.w)
+            self._w32.c = <float*>np.PyArray_DATA(self.c)
+            self._w32.V = <float*>np.PyArray_DATA(self.V)
+            self._w32.G = <float*>np.PyArray_DATA(self.G)
+        else:
+            self._w64.w = <double*>np.PyArray_DATA(self.w)
+            self._w64.c = <double*>np.PyArray_DATA(self.c)
+            self._w64.V = <double*>np.PyArray_DATA(self.V)
+            self._w64.G = <double*>np.PyArray_DATA(self.G)
+
+    def save(self, path):
+        """Save the model into a directory that load() can memory-map.
+
+        Args:
+            path (str): a path to the directory to save the model into
+        """
+        save_state(self, path)
+
+    @classmethod
+    def load(cls, path, bint mmap=True):
+        """Load a model saved by save().
+
+        Args:
+            path (str): a path to the directory the model is saved in
+            mmap (boolean): whether to memory-map the weights and counts
+                            copy-on-write instead of reading them
+
+        Returns:
+            a FFM object
+        """
+        return load_state(cls, path, mmap)
+
+    def __reduce__(self):
+        return (restore_state, (self.__class__,) + self._get_state())
+
+    def _get_state(self):
+        params = {'n': self.n,
+                  'm': self.m,
+                  'epoch': self.epoch,
+                  'k': self.k,
+                  'a': self.a,
+                  'l2': self.l2,
+                  'n_jobs': self.n_jobs,
+                  'negative_sampling_rate': self.negative_sampling_rate,
+                  'dtype': self.dtype.name,
+                  'w0': self.w0,
+                  'c0': self.c0}
+        arrays = {'w': self.w, 'c': self.c, 'V': self.V, 'G': self.G}
+        return params, arrays
+
+    def _set_state(self, dict params, dict arrays):
+        self.n = params['n']
+        self.m = params['m']
+        self.epoch = params['epoch']
+        self.k = params['k']
+        self.a = params['a']
+        self.l2 = params['l2']
+        self.n_jobs = params['n_jobs']
+        self.negative_sampling_rate = params['negative_sampling_rate']
+        self.dtype = check_dtype(params['dtype'])
+        self.w0 = params['w0']
+        self.c0 = params['c0']
+        self.w = np.ascontiguousarray(arrays['w'], dtype=self.dtype)
+        self.c = np.ascontiguousarray(arrays['c'], dtype=self.dtype)
+        self.V = np.ascontiguousarray(arrays['V'], dtype=self.dtype)
+        self.G = np.ascontiguousarray(arrays['G'], dtype=self.dtype)
+        self._bind_arrays()
+
+    def read_sparse(self, path):
+        """Read the libffm format sparse file.
+
+        Args:
+            path (str): a file path to the libffm format sparse file, whose
+                        features are field:index:value triples
+
+        Yields:
+            x (list of tuple): a list of (field, index, value) of non-zero features
+            y (int): target value
+        """
+        for X, y, fields in iter_libsvm(path, fields=True):
+            for row in range(X.shape[0]):
+                start, end = X.indptr[row], X.indptr[row + 1]
+                yield (list(zip(fields[start:end].tolist(), X.indices[start:end].tolist(),
+                                X.data[start:end].tolist())),
+                       int(y[row]))
+
+    def fit(self, X, y, fields, sample_weight=None, validation=None):
+        """Update the model with a sparse input feature matrix and its targets.
+
+        With n_jobs > 1, rows are split into contiguous ranges across threads,
+        which update the shared weights and counts without locks (Hogwild).
+
+        Args:
+            X (scipy.sparse.csr_matrix): a list of (index, value) of non-zero features
+            y (numpy.array): targets
+            fields (numpy.array): fields of non-zero features in X.indices
+            sample_weight (numpy.array): weights of rows. 1 for every row if None
+            validation (ProgressiveValidation): metrics to add the predictions
+                                                of rows before updates to
+
+        Returns:
+            updated model weights and counts
+        """
+        self._fit(X, y, fields, sample_weight, validation, self.epoch)
+        return self
+
+    def partial_fit(self, X, y, fields, sample_weight=None, validation=None):
+        """Update the model with one pass over a sparse input feature matrix.
+
+        Args:
+            X (scipy.sparse.csr_matrix): a list of (index, value) of non-zero features
+            y (numpy.array): targets
+            fields (numpy.array): fields of non-zero features in X.indices
+            sample_weight (numpy.array): weights of rows. 1 for every row if None
+            validation (ProgressiveValidation): metrics to add the predictions
+                                                of rows before updates to
+
+        Returns:
+            updated model weights and counts
+        """
+        self._fit(X, y, fields, sample_weight, validation, 1)
+        return self
+
+    def fit_file(self, path, int chunk_rows=100000, validation=None):
+        """Update the model with a libffm format sparse file in constant memory.
+
+        The file is parsed in chunks of rows, and the model is updated with
+        each chunk before the next one is read.
+
+        Args:
+            path (str): a file path to the libffm format sparse file, whose
+                        features are field:index:value triples
+            chunk_rows (int): number of rows to parse at a time
+            validation (ProgressiveValidation): metrics to add the predictions
+                                                of rows before updates to
+
+        Returns:
+            updated model weights and counts
+        """
+        for epoch in range(self.epoch):
+            for X, y, fields in iter_libsvm(path, chunk_rows=chunk_rows, fields=True):
+                self._fit(X, y, fields, None, validation, 1)
+        return self
+
+    def _check_input(self, X, fields):
+        """Check that features and fields of X are in range of the model.
+
+        Args:
+            X (scipy.sparse.csr_matrix): a sparse matrix for input features
+            fields (numpy.array): fields of non-zero features in X.indices
+
+        Returns:
+            fields (numpy.array): fields as an int32 array
+        """
+        fields = np.asarray(fields, dtype=np.int32)
+        if len(fields) != X.nnz:
+            raise ValueError('{} fields for {} non-zero features'.format(len(fields), X.nnz))
+
+        check_indices(X.indices, self.n)
+        if X.nnz > 0 and (fields.min() < 0 or fields.max() >= self.m):
+            raise ValueError('fields are out of range for {} fields'.format(self.m))
+
+        return fields
+
+    cdef _fit(self, X, y, fields, sample_weight, ProgressiveValidation validation, unsigned int n_epoch):
+        """Update the model with a sparse input feature matrix and its targets.
+
+        Args:
+            X (scipy.sparse.csr_matrix): a list of (index, value) of non-zero features
+            y (numpy.array): targets
+            fields (numpy.array): fields of non-zero features in X.indices
+            sample_weight (numpy.array): weights of rows, which scale their errors
+                                         and regularization. Rows of weight 0 are skipped
+            validation (ProgressiveValidation): metrics to add the predictions
+                                                of rows before updates to
+            n_epoch (int): number of passes over X
+
+        Returns:
+            updated model weights and counts
+        """
+        cdef unsigned int epoch
+        cdef int row
+        cdef int row_num = X.shape[0]
+        cdef int start
+        cdef int block_start
+        cdef int block_end
+        cdef int block_rows = row_num
+        cdef int n_jobs = self.n_jobs if self.n_jobs > 0 else cpu_count()
+        cdef double p
+        cdef bint track = validation is not None
+
+        cdef int[:] fld = self._check_input(X, fields)
+        cdef int[:] indices = X.indices
+        cdef double[:] data = np.asarray(X.data, dtype=np.float64)
+        cdef int[:] indptr = X.indptr
+        cdef double[:] y_view = np.asarray(y, dtype=np.float64)
+        cdef double[:] weight = check_sample_weight(sample_weight, row_num)
+        cdef double[:] p_fit
+
+        if row_num == 0:
+            return
+
+        # with validation, rows are processed in blocks between reports, and
+        # their predictions are added to the metrics after each block
+        if track:
+            block_rows = min(validation.every, row_num)
+            p_fit = np.zeros((row_num,), dtype=np.float64)
+
+        for epoch in range(n_epoch):
+            block_start = 0
+            while block_start < row_num:
+                block_end = min(block_start + block_rows, row_num)
+                for row in prange(block_start, block_end, nogil=True, num_threads=n_jobs, schedule='static'):
+                    start = indptr[row]
+                    p = self._predict_row(&fld[start], &indices[start], &data[start], indptr[row + 1] - start)
+                    if weight[row] != 0.:
+                        self._update_row(&fld[start], &indices[start], &data[start], indptr[row + 1] - start,
+                                         (p - y_view[row]) * weight[row], weight[row])
+                    if track:
+                        p_fit[row] = p
+
+                if track:
+                    validation.add_rows(&p_fit[block_start], &y_view[block_start], &weight[block_start],
+                                        block_end - block_start, self.negative_sampling_rate)
+                    if validation.due():
+                        validation.report()
+                block_start = block_end
+
+    def predict(self, X, fields):
+        """Predict for a sparse matrix X.
+
+        It does not change the model, so it can be called from multiple
+        threads at the same time. Rows are scored across n_jobs threads.
+
+        Args:
+            X (scipy.sparse.csr_matrix): a sparse matrix for input features
+            fields (numpy.array): fields of non-zero features in X.indices
+
+        Returns:
+            p (numpy.array): predictions for input features
+        """
+        cdef int row
+        cdef int row_num = X.shape[0]
+        cdef int start
+        cdef int n_jobs = self.n_jobs if self.n_jobs > 0 else cpu_count()
+
+        cdef int[:] fld = self._check_input(X, fields)
+        cdef int[:] indices = X.indices
+        cdef double[:] data = np.asarray(X.data, dtype=np.float64)
+        cdef int[:] indptr = X.indptr
+        cdef double[:] p_view
+
+        p = np.zeros((row_num, ), dtype=np.float64)
+        p_view = p
+        for row in prange(row_num, nogil=True, num_threads=n_jobs, schedule='static'):
+            start = indptr[row]
+            p_view[row] = self._predict_row(&fld[start], &indices[start], &data[start],
+                                            indptr[row + 1] - start)
+
+        return calibrate(p, self.negative_sampling_rate)
+
+    def predict_one(self, list x):
+        """Predict for features.
+
+        Args:
+            x (list of tuple): a list of (field, index, value) of non-zero features
+
+        Returns:
+            p (double): a prediction for input features
+        """
+        cdef int[:] fld = np.array([f for f, _, _ in x], dtype=np.int32)
+        cdef int[:] idx = np.array([i for _, i, _ in x], dtype=np.int32)
+        cdef double[:] val = np.array([v for _, _, v in x], dtype=np.float64)
+
+        if len(x) == 0:
+            return calibrate(sigm(self.w0), self.negative_sampling_rate)
+        return calibrate(self._predict_row(&fld[0], &idx[0], &val[0], len(x)), self.negative_sampling_rate)
+
+    def update_one(self, list x, double e):
+        """Update the model.
+
+        Args:
+            x (list of tuple): a list of (field, index, value) of non-zero features
+            e (double): error between the prediction of the model and target
+
+        Returns:
+            updated model weights and counts
+        """
+        cdef int[:] fld = np.array([f for f, _, _ in x], dtype=np.int32)
+        cdef int[:] idx = np.array([i for _, i, _ in x], dtype=np.int32)
+        cdef double[:] val = np.array([v for _, _, v in x], dtype=np.float64)
+
+        if len(x) == 0:
+            self._update_row(NULL, NULL, NULL, 0, e, 1.)
+        else:
+            self._update_row(&fld[0], &idx[0], &val[0], len(x), e, 1.)
+
+    cdef double _predict_row(self, int* fld, int* idx, double* val, int x_len) nogil:
+        """Predict for a row with the weights of the dtype."""
+        if self.is_float32:
+            return self._predict_row_typed(&self._w32, fld, idx, val, x_len)
+        return self._predict_row_typed(&self._w64, fld, idx, val, x_len)
+
+    cdef double _predict_row_typed(self, FFMWeights* wt, int* fld, int* idx, double* val, int x_len) nogil:
+        """Predict for a row.
+
+        Args:
+            wt (FFMWeights*): weights and counters of the model
+            fld (int*): fields of non-zero features
+            idx (int*): index of non-zero features
+            val (double*): values of non-zero features
+            x_len (int): number of non-zero features
+
+        Returns:
+            p (double): a prediction for input features
+        """
+        cdef int j1
+        cdef int j2
+        cdef int d
+        cdef Py_ssize_t v1
+        cdef Py_ssize_t v2
+        cdef double vv
+        cdef double p = self.w0
+
+        for j1 in range(x_len):
+            p += wt.w[idx[j1]] * val[j1]
+
+            for j2 in range(j1 + 1, x_len):
+                # factors of feature j1 for the field of j2, and vice versa
+                v1 = (<Py_ssize_t>idx[j1] * self.m + fld[j2]) * self.k
+                v2 = (<Py_ssize_t>idx[j2] * self.m + fld[j1]) * self.k
+
+                vv = 0.
+                for d in range(self.k):
+                    vv += wt.V[v1 + d] * wt.V[v2 + d]
+                p += vv * val[j1] * val[j2]
+
+        return sigm(p)
+
+    cdef void _update_row(self, int* fld, int* idx, double* val, int x_len, double e, double weight) nogil:
+        """Update the model with a row with the weights of the dtype."""
+        if self.is_float32:
+            self._update_row_typed(&self._w32, fld, idx, val, x_len, e, weight)
+        else:
+            self._update_row_typed(&self._w64, fld, idx, val, x_len, e, weight)
+
+    cdef void _update_row_typed(self, FFMWeights* wt, int* fld, int* idx, double* val, int x_len, double e,
+                                double weight) nogil:
+        """Update the model with a row.
+
+        Weights are updated as in FM, and field-aware factors with AdaGrad on
+        their own sums of squared gradients.
+
+        Args:
+            wt (FFMWeights*): weights and counters of the model
+            fld (int*): fields of non-zero features
+            idx (int*): index of non-zero features
+            val (double*): values of non-zero features
+            x_len (int): number of non-zero features
+            e (double): error between the prediction of the model and target,
+                        scaled by the weight of the row
+            weight (double): weight of the row, which scales the L2
+                             regularization as well
+        """
+        cdef int i
+        cdef int j1
+        cdef int j2
+        cdef int d
+        cdef Py_ssize_t v1
+        cdef Py_ssize_t v2
+        cdef double g1
+        cdef double g2
+        cdef double e_xx
+        cdef double e2 = e * e
+        cdef double l2 = self.l2 * weight
+
+        # update w0 and w
+        self.w0 -= self.a / (sqrt(self.c0) + 1) * e
+        for j1 in range(x_len):
+            i = idx[j1]
+            wt.w[i] -= self.a / (sqrt(wt.c[i]) + 1) * e * val[j1]
+
+        # update V and G
+        for j1 in range(x_len):
+            for j2 in range(j1 + 1, x_len):
+                v1 = (<Py_ssize_t>idx[j1] * self.m + fld[j2]) * self.k
+                v2 = (<Py_ssize_t>idx[j2] * self.m + fld[j1]) * self.k
+                e_xx = e * val[j1] * val[j2]
+
+                for d in range(self.k):
+                    g1 = l2 * wt.V[v1 + d] + e_xx * wt.V[v2 + d]
+                    g2 = l2 * wt.V[v2 + d] + e_xx * wt.V[v1 + d]
+
+                    wt.G[v1 + d] += g1 * g1
+                    wt.G[v2 + d] += g2 * g2
+
+                    wt.V[v1 + d] -= self.a / sqrt(wt.G[v1 + d]) * g1
+                    wt.V[v2 + d] -= self.a / sqrt(wt.G[v2 + d]) * g2
+
+        # update c0 and c
+        for j1 in range(x_len):
+            wt.c[idx[j1]] += e2
+
+        self.c0 += e2
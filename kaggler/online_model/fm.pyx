@@ -1,17 +1,40 @@
 # cython: boundscheck=False
 # cython: wraparound=False
 # cython: cdivision=True
+from multiprocessing import cpu_count
 import numpy as np
+from .._libsvm import iter_libsvm
+from ._sampling import calibrate, check_indices, check_negative_sampling_rate, check_sample_weight
+from ._state import check_dtype, check_n_jobs, save_state, load_state, restore_state
 
 cimport cython
-from libc.math cimport sqrt, abs
+from cython.parallel cimport prange
+from libc.math cimport sqrt
 from ..util cimport sigm
+from .progressive cimport ProgressiveValidation
 cimport numpy as np
 
 
 np.import_array()
 
 
+cdef struct FMWeights32:
+    float* w
+    float* c
+    float* V
+
+
+cdef struct FMWeights64:
+    double* w
+    double* c
+    double* V
+
+
+ctypedef fused FMWeights:
+    FMWeights32
+    FMWeights64
+
+
 cdef class FM:
     """Factorization Machine online learner.
 
@@ -22,9 +45,14 @@ cdef class FM:
         a (double): initial learning rate
         w0 (double): weight for bias
         c0 (double): counters
-        w (array of double): feature weights
-        c (array of double): counters for weights
-        V (array of double): feature weights for factors
+        w (array of float or double): feature weights
+        c (array of float or double): counters for weights
+        V (array of float or double): feature weights for factors
+        batch_size (int): number of rows per AdaGrad update
+        n_jobs (int): number of threads for the forward pass of a batch. -1
+                      uses all CPUs
+        dtype (numpy.dtype): float32 or float64 for weights and counters
+        negative_sampling_rate (double): rate of negative rows kept in the training data
     """
 
     cdef unsigned int epoch
@@ -33,16 +61,30 @@ cdef class FM:
     cdef double a
     cdef double w0
     cdef double c0
-    cdef double[:] w
-    cdef double[:] c
-    cdef double[:] V
+    cdef object dtype
+    cdef double negative_sampling_rate
+    cdef bint is_float32
+    cdef np.ndarray w
+    cdef np.ndarray c
+    cdef np.ndarray V
+    cdef FMWeights32 _w32       # pointers to the arrays if dtype is float32
+    cdef FMWeights64 _w64       # pointers to the arrays if dtype is float64
+    cdef unsigned int batch_size
+    cdef int n_jobs
+    cdef double[:] _vx      # sum of V * x for each factor of rows in a batch
+    cdef double[:] _e       # errors of rows in a batch
+    cdef double[:] _p       # predictions of rows in a batch
 
     def __init__(self,
                  unsigned int n,
                  unsigned int epoch=100,
                  unsigned int dim=4,
                  double a=0.01,
-                 seed=0):
+                 seed=0,
+                 int batch_size=1,
+                 int n_jobs=1,
+                 dtype=np.float64,
+                 negative_sampling_rate=1.):
         """Initialize the FM class object.
 
         Args:
@@ -51,28 +93,123 @@ cdef class FM:
             dim (int): size of factors for interactions
             a (double): initial learning rate
             seed (int): random seed
+            batch_size (int): number of rows per AdaGrad update. Gradients
+                              of the rows in a batch are computed from the
+                              same weights and learning rates
+            n_jobs (int): number of threads for the forward pass of a batch.
+                          -1 uses all CPUs
+            dtype (numpy.dtype): float32 or float64 for weights and counters.
+                                 float32 halves the memory of the model
+            negative_sampling_rate (double): rate of negative rows kept in the
+                                             training data, e.g. by
+                                             util.get_downsampled_index0().
+                                             Predictions are corrected for it
         """
         cdef int i
 
+        if batch_size < 1:
+            raise ValueError('batch_size should be positive, not {}'.format(batch_size))
+
         rng = np.random.RandomState(seed)
 
         self.n = n          # # of features
         self.epoch = epoch  # # of epochs
         self.k = dim        # interaction dimension
         self.a = a          # learning rate
+        self.batch_size = batch_size
+        self.n_jobs = check_n_jobs(n_jobs)
+        self.negative_sampling_rate = check_negative_sampling_rate(negative_sampling_rate)
+        self.dtype = check_dtype(dtype)
 
         # initialize weights, factorized interactions, and counts
         self.w0 = 0.
         self.c0 = 0.
-        self.w = np.zeros((self.n,), dtype=np.float64)
-        self.c = np.zeros((self.n,), dtype=np.float64)
-        self.V = (rng.rand(self.n * self.k) - .5) * 1e-6
-
-    def __repr__(self):                                                         
-        return ('FM(n={}, epoch={}, dim={}, a={})').format(
-            self.n, self.epoch, self.dim, self.a
+        self.w = np.zeros((self.n,), dtype=self.dtype)
+        self.c = np.zeros((self.n,), dtype=self.dtype)
+        self.V = ((rng.rand(self.n * self.k) - .5) * 1e-6).astype(self.dtype)
+        self._bind_arrays()
+        self._init_scratch()
+
+    def __repr__(self):
+        return ('FM(n={}, epoch={}, dim={}, a={}, batch_size={}, n_jobs={}, dtype={}, '
+                'negative_sampling_rate={})').format(
+            self.n, self.epoch, self.k, self.a, self.batch_size, self.n_jobs, self.dtype.name,
+            self.negative_sampling_rate
         )
 
+    def _bind_arrays(self):
+        """Point the weights of the dtype at the arrays."""
+        self.is_float32 = self.dtype == np.float32
+        if self.is_float32:
+            self._w32.w = <float*>np.PyArray_DATA(self.w)
+            self._w32.c = <float*>np.PyArray_DATA(self.c)
+            self._w32.V = <float*>np.PyArray_DATA(self.V)
+        else:
+            self._w64.w = <double*>np.PyArray_DATA(self.w)
+            self._w64.c = <double*>np.PyArray_DATA(self.c)
+            self._w64.V = <double*>np.PyArray_DATA(self.V)
+
+    def _init_scratch(self):
+        self._vx = np.zeros((self.batch_size * self.k,), dtype=np.float64)
+        self._e = np.zeros((self.batch_size,), dtype=np.float64)
+        self._p = np.zeros((self.batch_size,), dtype=np.float64)
+
+    def save(self, path):
+        """Save the model into a directory that load() can memory-map.
+
+        Args:
+            path (str): a path to the directory to save the model into
+        """
+        save_state(self, path)
+
+    @classmethod
+    def load(cls, path, bint mmap=True):
+        """Load a model saved by save().
+
+        Args:
+            path (str): a path to the directory the model is saved in
+            mmap (boolean): whether to memory-map the weights and counts
+                            copy-on-write instead of reading them
+
+        Returns:
+            a FM object
+        """
+        return load_state(cls, path, mmap)
+
+    def __reduce__(self):
+        return (restore_state, (self.__class__,) + self._get_state())
+
+    def _get_state(self):
+        params = {'n': self.n,
+                  'epoch': self.epoch,
+                  'k': self.k,
+                  'a': self.a,
+                  'batch_size': self.batch_size,
+                  'n_jobs': self.n_jobs,
+                  'negative_sampling_rate': self.negative_sampling_rate,
+                  'dtype': self.dtype.name,
+                  'w0': self.w0,
+                  'c0': self.c0}
+        arrays = {'w': self.w, 'c': self.c, 'V': self.V}
+        return params, arrays
+
+    def _set_state(self, dict params, dict arrays):
+        self.n = params['n']
+        self.epoch = params['epoch']
+        self.k = params['k']
+        self.a = params['a']
+        self.batch_size = params['batch_size']
+        self.n_jobs = params['n_jobs']
+        self.negative_sampling_rate = params['negative_sampling_rate']
+        self.dtype = check_dtype(params['dtype'])
+        self.w0 = params['w0']
+        self.c0 = params['c0']
+        self.w = np.ascontiguousarray(arrays['w'], dtype=self.dtype)
+        self.c = np.ascontiguousarray(arrays['c'], dtype=self.dtype)
+        self.V = np.ascontiguousarray(arrays['V'], dtype=self.dtype)
+        self._bind_arrays()
+        self._init_scratch()
+
     def read_sparse(self, path):
         """Apply hashing trick to the libsvm format sparse file.
 
@@ -80,48 +217,136 @@ cdef class FM:
             path (str): a file path to the libsvm format sparse file
 
         Yields:
-            idx (list of int): a list of index of non-zero features
-            val (list of double): a list of values of non-zero features
+            x (list of tuple): a list of (index, value) of non-zero features
             y (int): target value
         """
-        for line in open(path):
-            xs = line.rstrip().split(' ')
+        for X, y in iter_libsvm(path):
+            for row in range(X.shape[0]):
+                start, end = X.indptr[row], X.indptr[row + 1]
+                yield list(zip(X.indices[start:end].tolist(), X.data[start:end].tolist())), int(y[row])
 
-            y = int(xs[0])
-            idx = []
-            val = []
-            for item in xs[1:]:
-                i, v = item.split(':')
-                idx.append(int(i))
-                val.append(float(v))
+    cpdef fit(self, X, y, sample_weight=None, validation=None):
+        """Update the model with a sparse input feature matrix and its targets.
 
-            yield zip(idx, val), y
+        Args:
+            X (scipy.sparse.csr_matrix): a list of (index, value) of non-zero features
+            y (numpy.array): targets
+            sample_weight (numpy.array): weights of rows. 1 for every row if None
+            validation (ProgressiveValidation): metrics to add the predictions
+                                                of rows before updates to
 
-    cpdef fit(self, X, y):
-        """Update the model with a sparse input feature matrix and its targets.
+        Returns:
+            updated model weights and counts
+        """
+        self._fit(X, y, sample_weight, validation, self.epoch)
+        return self
+
+    def partial_fit(self, X, y, sample_weight=None, validation=None):
+        """Update the model with one pass over a sparse input feature matrix.
 
         Args:
             X (scipy.sparse.csr_matrix): a list of (index, value) of non-zero features
             y (numpy.array): targets
+            sample_weight (numpy.array): weights of rows. 1 for every row if None
+            validation (ProgressiveValidation): metrics to add the predictions
+                                                of rows before updates to
 
         Returns:
             updated model weights and counts
         """
-        cdef int row
+        self._fit(X, y, sample_weight, validation, 1)
+        return self
 
-        cdef int[:] indices = X.indices
-        cdef double[:] data = X.data
-        cdef int[:] indptr = X.indptr
+    def fit_file(self, path, int chunk_rows=100000, validation=None):
+        """Update the model with a libsvm format sparse file in constant memory.
+
+        The file is parsed in chunks of rows, and the model is updated with
+        each chunk before the next one is read.
+
+        Args:
+            path (str): a file path to the libsvm format sparse file
+            chunk_rows (int): number of rows to parse at a time
+            validation (ProgressiveValidation): metrics to add the predictions
+                                                of rows before updates to
 
+        Returns:
+            updated model weights and counts
+        """
         for epoch in range(self.epoch):
-            for row in range(X.shape[0]):
-                x = zip(
-                    indices[indptr[row] : indptr[row + 1]],
-                    data[indptr[row] : indptr[row + 1]],
-                )
-                self.update_one(x, self.predict_one(x) - y[row])
+            for X, y in iter_libsvm(path, chunk_rows=chunk_rows):
+                self._fit(X, y, None, validation, 1)
         return self
 
+    cdef _fit(self, X, y, sample_weight, ProgressiveValidation validation, unsigned int n_epoch):
+        """Update the model with a sparse input feature matrix and its targets.
+
+        Rows are processed in batches of batch_size.  The forward pass of a
+        batch runs across n_jobs threads, and caches vx and the error of each
+        row in the scratch buffers for the update of the batch.
+
+        Args:
+            X (scipy.sparse.csr_matrix): a list of (index, value) of non-zero features
+            y (numpy.array): targets
+            sample_weight (numpy.array): weights of rows, which scale their errors
+            validation (ProgressiveValidation): metrics to add the predictions
+                                                of rows before updates to
+            n_epoch (int): number of passes over X
+
+        Returns:
+            updated model weights and counts
+        """
+        cdef unsigned int epoch
+        cdef int row
+        cdef int row_num = X.shape[0]
+        cdef int batch_start
+        cdef int batch_num
+        cdef int start
+        cdef int n_jobs = self.n_jobs if self.n_jobs > 0 else cpu_count()
+
+        cdef int[:] indices = check_indices(X.indices, self.n)
+        cdef double[:] data = np.asarray(X.data, dtype=np.float64)
+        cdef int[:] indptr = X.indptr
+        cdef double[:] y_view = np.asarray(y, dtype=np.float64)
+        cdef double[:] weight = check_sample_weight(sample_weight, row_num)
+        cdef double* vx = &self._vx[0]
+        cdef double* e = &self._e[0]
+        cdef double* p = &self._p[0]
+        cdef bint track = validation is not None
+
+        if row_num == 0:
+            return
+
+        with nogil:
+            for epoch in range(n_epoch):
+                batch_start = 0
+                while batch_start < row_num:
+                    batch_num = min(self.batch_size, row_num - batch_start)
+                    if n_jobs == 1 or batch_num == 1:
+                        for row in range(batch_start, batch_start + batch_num):
+                            start = indptr[row]
+                            p[row - batch_start] = self._predict_row(
+                                &indices[start], &data[start], indptr[row + 1] - start,
+                                &vx[(row - batch_start) * self.k])
+                            e[row - batch_start] = (p[row - batch_start] - y_view[row]) * weight[row]
+                    else:
+                        for row in prange(batch_start, batch_start + batch_num,
+                                          num_threads=n_jobs, schedule='static'):
+                            start = indptr[row]
+                            p[row - batch_start] = self._predict_row(
+                                &indices[start], &data[start], indptr[row + 1] - start,
+                                &vx[(row - batch_start) * self.k])
+                            e[row - batch_start] = (p[row - batch_start] - y_view[row]) * weight[row]
+
+                    if track:
+                        validation.add_rows(p, &y_view[batch_start], &weight[batch_start], batch_num,
+                                            self.negative_sampling_rate)
+                        if validation.due():
+                            with gil:
+                                validation.report()
+
+                    self._update_batch(&indices[0], &data[0], &indptr[batch_start], batch_num, e, vx)
+                    batch_start += batch_num
+
     def predict(self, X):
         """Predict for a sparse matrix X.
 
@@ -131,12 +356,24 @@ cdef class FM:
         Returns:
             p (numpy.array): predictions for input features
         """
+        cdef int row
+        cdef int row_num = X.shape[0]
+        cdef int start
+
+        cdef int[:] indices = check_indices(X.indices, self.n)
+        cdef double[:] data = np.asarray(X.data, dtype=np.float64)
+        cdef int[:] indptr = X.indptr
+        cdef double[:] vx = np.zeros((self.k,), dtype=np.float64)
+        cdef double[:] p_view
 
-        p = np.zeros((X.shape[0], ), dtype=np.float64)
-        for row in range(X.shape[0]):
-            p[row] = self.predict_one(zip(X[row].indices, X[row].data))
+        p = np.zeros((row_num, ), dtype=np.float64)
+        p_view = p
+        with nogil:
+            for row in range(row_num):
+                start = indptr[row]
+                p_view[row] = self._predict_row(&indices[start], &data[start], indptr[row + 1] - start, &vx[0])
 
-        return p
+        return calibrate(p, self.negative_sampling_rate)
 
     def predict_one(self, list x):
         """Predict for features.
@@ -147,65 +384,128 @@ cdef class FM:
         Returns:
             p (double): a prediction for input features
         """
-        cdef int i
-        cdef int k
-        cdef double v
-        cdef double p
-        cdef double wx
-        cdef double[:] vx
-        cdef double[:] v2x2
-
-        wx = 0.
-        vx = np.zeros((self.k,), dtype=np.float64)
-        v2x2 = np.zeros((self.k,), dtype=np.float64)
-        for i, v in x:
-            wx += self.w[i] * v
-            for k in range(self.k):
-                vx[k] += self.V[i * self.k + k] * v
-                v2x2[k] += (self.V[i * self.k + k] ** 2) * (v ** 2)
-
-        p = self.w0 + wx
-        for k in range(self.k):
-            p += .5 * (vx[k] ** 2 - v2x2[k])
-
-        return sigm(p)
+        cdef int[:] idx = check_indices([i for i, _ in x], self.n)
+        cdef double[:] val = np.array([v for _, v in x], dtype=np.float64)
+
+        if len(x) == 0:
+            return calibrate(sigm(self.w0), self.negative_sampling_rate)
+        return calibrate(self._predict_row(&idx[0], &val[0], len(x), &self._vx[0]), self.negative_sampling_rate)
 
     def update_one(self, list x, double e):
         """Update the model.
 
         Args:
-            idx (list of int): a list of index of non-zero features
-            val (list of double): a list of values of non-zero features
+            x (list of tuple): a list of (index, value) of non-zero features
             e (double): error between the prediction of the model and target
 
         Returns:
             updated model weights and counts
         """
+        cdef int[:] idx = check_indices([i for i, _ in x], self.n)
+        cdef double[:] val = np.array([v for _, v in x], dtype=np.float64)
+        cdef int ptr[2]
+
+        ptr[0] = 0
+        ptr[1] = len(x)
+        if len(x) == 0:
+            self._update_batch(NULL, NULL, ptr, 1, &e, &self._vx[0])
+        else:
+            self._predict_row(&idx[0], &val[0], len(x), &self._vx[0])
+            self._update_batch(&idx[0], &val[0], ptr, 1, &e, &self._vx[0])
+
+    cdef double _predict_row(self, int* idx, double* val, int x_len, double* vx) nogil:
+        """Predict for a row with the weights of the dtype."""
+        if self.is_float32:
+            return self._predict_row_typed(&self._w32, idx, val, x_len, vx)
+        return self._predict_row_typed(&self._w64, idx, val, x_len, vx)
+
+    cdef double _predict_row_typed(self, FMWeights* wt, int* idx, double* val, int x_len, double* vx) nogil:
+        """Predict for a row.
+
+        Args:
+            wt (FMWeights*): weights and counters of the model
+            idx (int*): index of non-zero features
+            val (double*): values of non-zero features
+            x_len (int): number of non-zero features
+            vx (double*): scratch buffer for k values
+
+        Returns:
+            p (double): a prediction for input features
+        """
         cdef int i
-        cdef int k
+        cdef int j
         cdef int f
         cdef double v
-        cdef double g2
-        cdef double dl_dw
-        cdef double[:] vx
+        cdef double v_x
+        cdef double v2x2 = 0.
+        cdef double p = self.w0
 
-        # calculate v_f * x in advance
-        vx = np.zeros((self.k,), dtype=np.float64)
-        for i, v in x:
-            for k in range(self.k):
-                vx[k] += self.V[i * self.k + k] * v
+        for f in range(self.k):
+            vx[f] = 0.
 
-        # update w0, w, V, c0, and c
-        g2 = e * e
-
-        self.w0 -= self.a / (sqrt(self.c0) + 1) * e
-        for i, v in x:
-            dl_dw = self.a / (sqrt(self.c[i]) + 1) * e * v
-            self.w[i] -= dl_dw
+        for j in range(x_len):
+            i = idx[j]
+            v = val[j]
+            p += wt.w[i] * v
             for f in range(self.k):
-                self.V[i * self.k + f] -= dl_dw * (vx[f] -
-                                                   self.V[i * self.k + f] * v)
+                v_x = wt.V[i * self.k + f] * v
+                vx[f] += v_x
+                v2x2 += v_x * v_x
+
+        for f in range(self.k):
+            p += .5 * vx[f] * vx[f]
 
-            self.c[i] += g2
+        return sigm(p - .5 * v2x2)
 
-        self.c0 += g2
+    cdef void _update_batch(self, int* indices, double* data, int* indptr, int batch_num,
+                            double* e, double* vx) nogil:
+        """Update the model with a batch of rows with the weights of the dtype."""
+        if self.is_float32:
+            self._update_batch_typed(&self._w32, indices, data, indptr, batch_num, e, vx)
+        else:
+            self._update_batch_typed(&self._w64, indices, data, indptr, batch_num, e, vx)
+
+    cdef void _update_batch_typed(self, FMWeights* wt, int* indices, double* data, int* indptr, int batch_num,
+                                  double* e, double* vx) nogil:
+        """Update the model with a batch of rows.
+
+        Learning rates are the ones at the start of the batch, so the weights
+        move by the gradients accumulated over the batch.
+
+        Args:
+            wt (FMWeights*): weights and counters of the model
+            indices (int*): index of non-zero features of the CSR matrix
+            data (double*): values of non-zero features of the CSR matrix
+            indptr (int*): index pointers of the rows in the batch
+            batch_num (int): number of rows in the batch
+            e (double*): errors of the rows in the batch
+            vx (double*): vx of the rows in the batch from _predict_row()
+        """
+        cdef int b
+        cdef int i
+        cdef int j
+        cdef int f
+        cdef double v
+        cdef double g2
+        cdef double dl_dw
+        cdef double lr0 = self.a / (sqrt(self.c0) + 1)
+
+        # update w0, w, and V
+        for b in range(batch_num):
+            self.w0 -= lr0 * e[b]
+            for j in range(indptr[b], indptr[b + 1]):
+                i = indices[j]
+                v = data[j]
+                dl_dw = self.a / (sqrt(wt.c[i]) + 1) * e[b] * v
+                wt.w[i] -= dl_dw
+                for f in range(self.k):
+                    wt.V[i * self.k + f] -= dl_dw * (vx[b * self.k + f] -
+                                                     wt.V[i * self.k + f] * v)
+
+        # update c0 and c
+        for b in range(batch_num):
+            g2 = e[b] * e[b]
+            for j in range(indptr[b], indptr[b + 1]):
+                wt.c[indices[j]] += g2
+
+            self.c0 += g2
@@ -2,25 +2,73 @@
 # cython: wraparound=False
 # cython: cdivision=True
 # cython: linetrace=False
+from multiprocessing import cpu_count
 import numpy as np
+from .._libsvm import iter_libsvm
+from ._sampling import calibrate, check_negative_sampling_rate, check_sample_weight
+from ._state import check_dtype, check_n_jobs, save_state, load_state, restore_state
 
 cimport cython
-from libc.math cimport sqrt, abs
+from cython.parallel cimport parallel, prange
+from libc.math cimport sqrt
+from libc.stdlib cimport malloc, realloc, free
 from ..util cimport sigm
+from .progressive cimport ProgressiveValidation
+from ._hashing cimport Crosses, n_hashed_indices, hash_indices, n_cross_indices, hash_cross_indices
 cimport numpy as np
 
 
-cdef extern from "murmurhash/MurmurHash3.h":
-    void MurmurHash3_x86_32(void *key, int len, np.uint32_t seed, void *out)
+np.import_array()
 
-cdef int murmurhash3_int_s32(int key, unsigned int seed):
-    """Compute the 32bit murmurhash3 of a int key at seed."""
-    cdef int out
-    MurmurHash3_x86_32(&key, sizeof(int), seed, &out)
-    return out
 
+cdef struct FTRLWeights32:
+    float* w
+    float* c
+    float* z
+
+
+cdef struct FTRLWeights64:
+    double* w
+    double* c
+    double* z
+
+
+ctypedef fused FTRLWeights:
+    FTRLWeights32
+    FTRLWeights64
 
-np.import_array()
+
+def _check_crosses(groups, crosses, interaction):
+    """Check feature groups and the crosses between them.
+
+    Args:
+        groups (list of int): first feature indices of groups in ascending order
+        crosses (list of tuple): pairs of crossed groups
+        interaction (boolean): whether to use 2nd order interaction or not
+
+    Returns:
+        groups (list of int): the groups
+        crosses (list of list): unique pairs of crossed groups with the smaller group first
+    """
+    if crosses is None:
+        if groups is not None:
+            raise ValueError('groups should be given with crosses')
+        return None, None
+
+    if not interaction:
+        raise ValueError('crosses should be given with interaction=True')
+    if groups is None or len(groups) == 0 or groups[0] != 0:
+        raise ValueError('groups should start from the feature index 0')
+    groups = [int(g) for g in groups]
+    if any(groups[i] >= groups[i + 1] for i in range(len(groups) - 1)):
+        raise ValueError('groups should be in ascending order')
+
+    pairs = set()
+    for cross in crosses:
+        if len(cross) != 2 or not all(0 <= g < len(groups) for g in cross):
+            raise ValueError('crosses should be pairs of groups in [0, {})'.format(len(groups)))
+        pairs.add(tuple(sorted(int(g) for g in cross)))
+    return groups, [list(pair) for pair in sorted(pairs)]
 
 
 cdef class FTRL:
@@ -36,10 +84,15 @@ cdef class FTRL:
         b (double): beta in the per-coordinate rate
         l1 (double): L1 regularization parameter
         l2 (double): L2 regularization parameter
-        w (array of double): feature weights
-        c (array of double): counters for weights
-        z (array of double): lazy weights
+        w (array of float or double): feature weights
+        c (array of float or double): counters for weights
+        z (array of float or double): lazy weights
         interaction (boolean): whether to use 2nd order interaction or not
+        groups (list of int): first feature indices of feature groups
+        crosses (list of list): pairs of groups whose features interact
+        n_jobs (int): number of threads for Hogwild training. -1 uses all CPUs
+        dtype (numpy.dtype): float32 or float64 for weights and counters
+        negative_sampling_rate (double): rate of negative rows kept in the training data
     """
 
     cdef double a      # learning rate
@@ -49,9 +102,30 @@ cdef class FTRL:
     cdef int epoch
     cdef int n
     cdef bint interaction
-    cdef double[:] w
-    cdef double[:] c
-    cdef double[:] z
+    cdef object groups
+    cdef object crosses
+    cdef bint has_crosses
+    cdef np.ndarray _group_array
+    cdef np.ndarray _pair_array
+    cdef Crosses _crosses       # pointers to the groups and crosses if crosses are given
+    cdef int n_jobs
+    cdef double negative_sampling_rate
+    cdef object dtype
+    cdef bint is_float32
+    cdef np.ndarray w
+    cdef np.ndarray c
+    cdef np.ndarray z
+    cdef FTRLWeights32 _w32     # pointers to the arrays if dtype is float32
+    cdef FTRLWeights64 _w64     # pointers to the arrays if dtype is float64
+    cdef int* _buf      # reusable buffer for the hashed indices of a row
+    cdef int _buf_size
+
+    def __cinit__(self):
+        self._buf = NULL
+        self._buf_size = 0
+
+    def __dealloc__(self):
+        free(self._buf)
 
     def __init__(self,
                  double a=0.01,
@@ -60,7 +134,12 @@ cdef class FTRL:
                  double l2=1.,
                  int n=2**20,
                  int epoch=1,
-                 bint interaction=True):
+                 bint interaction=True,
+                 int n_jobs=1,
+                 dtype=np.float64,
+                 groups=None,
+                 crosses=None,
+                 negative_sampling_rate=1.):
         """Initialize the FTRL class object.
 
         Args:
@@ -71,6 +150,19 @@ cdef class FTRL:
             n (int): number of features after hashing trick
             epoch (int): number of epochs
             interaction (boolean): whether to use 2nd order interaction or not
+            n_jobs (int): number of threads for Hogwild training. -1 uses all CPUs
+            dtype (numpy.dtype): float32 or float64 for weights and counters.
+                                 float32 halves the memory of the model
+            groups (list of int): first feature indices of feature groups in
+                                  ascending order from 0.  Features in
+                                  [groups[i], groups[i + 1]) are in the group i
+            crosses (list of tuple): pairs of groups, e.g. [(0, 1)], whose
+                                     pairs of features interact.  All pairs of
+                                     features interact if None
+            negative_sampling_rate (double): rate of negative rows kept in the
+                                             training data, e.g. by
+                                             util.get_downsampled_index0().
+                                             Predictions are corrected for it
         """
 
         self.a = a
@@ -80,35 +172,141 @@ cdef class FTRL:
         self.n = n
         self.epoch = epoch
         self.interaction = interaction
+        self.groups, self.crosses = _check_crosses(groups, crosses, interaction)
+        self.n_jobs = check_n_jobs(n_jobs)
+        self.negative_sampling_rate = check_negative_sampling_rate(negative_sampling_rate)
+        self.dtype = check_dtype(dtype)
+        self._bind_crosses()
 
         # initialize weights and counts
-        self.w = np.zeros((self.n + 1,), dtype=np.float64)
-        self.c = np.zeros((self.n + 1,), dtype=np.float64)
-        self.z = np.zeros((self.n + 1,), dtype=np.float64)
+        self.w = np.zeros((self.n + 1,), dtype=self.dtype)
+        self.c = np.zeros((self.n + 1,), dtype=self.dtype)
+        self.z = np.zeros((self.n + 1,), dtype=self.dtype)
+        self._bind_arrays()
 
     def __repr__(self):
-        return ('FTRL(a={}, b={}, l1={}, l2={}, n={}, epoch={}, interaction={})').format(
-            self.a, self.b, self.l1, self.l2, self.n, self.epoch, self.interaction
+        return ('FTRL(a={}, b={}, l1={}, l2={}, n={}, epoch={}, interaction={}, n_jobs={}, dtype={}, '
+                'groups={}, crosses={}, negative_sampling_rate={})').format(
+            self.a, self.b, self.l1, self.l2, self.n, self.epoch, self.interaction, self.n_jobs,
+            self.dtype.name, self.groups, self.crosses, self.negative_sampling_rate
         )
 
-    cdef list _indices(self, int[:] x):
-        cdef int x_len = x.shape[0]
-        cdef int index
-        cdef int i
-        cdef int j
-        cdef list indices = []
-        indices.append(self.n)
+    def _bind_crosses(self):
+        """Point the crosses at the arrays of the groups and crosses."""
+        self.has_crosses = self.crosses is not None
+        if self.has_crosses:
+            self._group_array = np.array(self.groups, dtype=np.int32)
+            self._pair_array = np.array(self.crosses, dtype=np.int32).reshape(-1)
+            self._crosses.groups = <int*>np.PyArray_DATA(self._group_array)
+            self._crosses.n_groups = len(self.groups)
+            self._crosses.pairs = <int*>np.PyArray_DATA(self._pair_array)
+            self._crosses.n_pairs = len(self.crosses)
+
+    def _bind_arrays(self):
+        """Point the weights of the dtype at the arrays."""
+        self.is_float32 = self.dtype == np.float32
+        if self.is_float32:
+            self._w32.w = <float*>np.PyArray_DATA(self.w)
+            self._w32.c = <float*>np.PyArray_DATA(self.c)
+            self._w32.z = <float*>np.PyArray_DATA(self.z)
+        else:
+            self._w64.w = <double*>np.PyArray_DATA(self.w)
+            self._w64.c = <double*>np.PyArray_DATA(self.c)
+            self._w64.z = <double*>np.PyArray_DATA(self.z)
+
+    def save(self, path):
+        """Save the model into a directory that load() can memory-map.
+
+        Args:
+            path (str): a path to the directory to save the model into
+        """
+        save_state(self, path)
+
+    @classmethod
+    def load(cls, path, bint mmap=True):
+        """Load a model saved by save().
+
+        Args:
+            path (str): a path to the directory the model is saved in
+            mmap (boolean): whether to memory-map the weights and counts
+                            copy-on-write instead of reading them
+
+        Returns:
+            a FTRL object
+        """
+        return load_state(cls, path, mmap)
+
+    def __reduce__(self):
+        return (restore_state, (self.__class__,) + self._get_state())
+
+    def _get_state(self):
+        params = {'a': self.a,
+                  'b': self.b,
+                  'l1': self.l1,
+                  'l2': self.l2,
+                  'n': self.n,
+                  'epoch': self.epoch,
+                  'interaction': self.interaction,
+                  'n_jobs': self.n_jobs,
+                  'negative_sampling_rate': self.negative_sampling_rate,
+                  'dtype': self.dtype.name,
+                  'groups': self.groups,
+                  'crosses': self.crosses}
+        arrays = {'w': self.w, 'c': self.c, 'z': self.z}
+        return params, arrays
+
+    def _set_state(self, dict params, dict arrays):
+        self.a = params['a']
+        self.b = params['b']
+        self.l1 = params['l1']
+        self.l2 = params['l2']
+        self.n = params['n']
+        self.epoch = params['epoch']
+        self.interaction = params['interaction']
+        self.n_jobs = params['n_jobs']
+        self.negative_sampling_rate = params['negative_sampling_rate']
+        self.dtype = check_dtype(params['dtype'])
+        self.groups = params['groups']
+        self.crosses = params['crosses']
+        self._bind_crosses()
+        self.w = np.ascontiguousarray(arrays['w'], dtype=self.dtype)
+        self.c = np.ascontiguousarray(arrays['c'], dtype=self.dtype)
+        self.z = np.ascontiguousarray(arrays['z'], dtype=self.dtype)
+        self._bind_arrays()
+
+    cdef int _n_indices(self, int x_len) nogil:
+        """Return the size of the index buffer for a row with x_len features."""
+        if self.has_crosses:
+            return n_cross_indices(x_len, &self._crosses)
+        return n_hashed_indices(x_len, self.interaction)
+
+    cdef int* _buffer(self, int x_len) except NULL:
+        """Return the index buffer, growing it to fit a row with x_len features."""
+        cdef int size = self._n_indices(x_len)
+        cdef int* buf
+
+        if size > self._buf_size:
+            buf = <int*>realloc(self._buf, size * sizeof(int))
+            if buf == NULL:
+                raise MemoryError()
+            self._buf = buf
+            self._buf_size = size
+        return self._buf
+
+    cdef int _indices(self, int* x, int x_len, int* indices) nogil:
+        """Hash features into the index buffer.
 
-        for i in range(x_len):
-            index = x[i]
-            indices.append(index % self.n)
+        Args:
+            x (int*): index of non-zero features
+            x_len (int): number of non-zero features
+            indices (int*): buffer with room for _n_indices(x_len) indices
 
-        if self.interaction:
-            for i in range(x_len - 1):
-                for j in range(i + 1, x_len):
-                    index = abs(murmurhash3_int_s32(x[i] * x[j], seed=0))
-                    indices.append(index % self.n)
-        return indices
+        Returns:
+            the number of indices written into the buffer
+        """
+        if self.has_crosses:
+            return hash_cross_indices(x, x_len, self.n, &self._crosses, indices)
+        return hash_indices(x, x_len, self.n, self.interaction, indices)
 
     def read_sparse(self, path):
         """Apply hashing trick to the libsvm format sparse file.
@@ -120,64 +318,156 @@ cdef class FTRL:
             x (list of int): a list of index of non-zero features
             y (int): target value
         """
-        for line in open(path):
-            xs = line.rstrip().split(' ')
+        for X, y in iter_libsvm(path):
+            for row in range(X.shape[0]):
+                start, end = X.indptr[row], X.indptr[row + 1]
+                yield X.indices[start:end].tolist(), int(y[row])
 
-            y = int(xs[0])
-            x = []
-            for item in xs[1:]:
-                index, _ = item.split(':')
-                x.append(int(index))
+    def fit(self, X, y, sample_weight=None, validation=None):
+        """Update the model with a sparse input feature matrix and its targets.
 
-            yield x, y
+        With n_jobs > 1, rows are split into contiguous ranges across threads,
+        which update the shared weights and counts without locks (Hogwild).
 
-    def fit(self, X, y):
-        """Update the model with a sparse input feature matrix and its targets.
+        Args:
+            X (scipy.sparse.csr_matrix): a list of (index, value) of non-zero features
+            y (numpy.array): targets
+            sample_weight (numpy.array): weights of rows. 1 for every row if None
+            validation (ProgressiveValidation): metrics to add the predictions
+                                                of rows before updates to
+
+        Returns:
+            updated model weights and counts
+        """
+        if y.dtype != np.float64:
+            y = y.astype(np.float64)
+        self._fit(X, y, check_sample_weight(sample_weight, X.shape[0]), validation, self.epoch)
+        return self
+
+    def partial_fit(self, X, y, sample_weight=None, validation=None):
+        """Update the model with one pass over a sparse input feature matrix.
 
         Args:
             X (scipy.sparse.csr_matrix): a list of (index, value) of non-zero features
             y (numpy.array): targets
+            sample_weight (numpy.array): weights of rows. 1 for every row if None
+            validation (ProgressiveValidation): metrics to add the predictions
+                                                of rows before updates to
 
         Returns:
             updated model weights and counts
         """
         if y.dtype != np.float64:
             y = y.astype(np.float64)
-        self._fit(X, y)
+        self._fit(X, y, check_sample_weight(sample_weight, X.shape[0]), validation, 1)
+        return self
+
+    def fit_file(self, path, int chunk_rows=100000, validation=None):
+        """Update the model with a libsvm format sparse file in constant memory.
+
+        The file is parsed in chunks of rows, and the model is updated with
+        each chunk before the next one is read.
+
+        Args:
+            path (str): a file path to the libsvm format sparse file
+            chunk_rows (int): number of rows to parse at a time
+            validation (ProgressiveValidation): metrics to add the predictions
+                                                of rows before updates to
+
+        Returns:
+            updated model weights and counts
+        """
+        for epoch in range(self.epoch):
+            for X, y in iter_libsvm(path, chunk_rows=chunk_rows):
+                self._fit(X, y, check_sample_weight(None, X.shape[0]), validation, 1)
         return self
 
-    cdef void _fit(self, X, double[:] y):
+    cdef _fit(self, X, double[:] y, double[:] sample_weight, ProgressiveValidation validation, int n_epoch):
         """Update the model with a sparse input feature matrix and its targets.
 
         Args:
             X (scipy.sparse.csr_matrix): a list of (index, value) of non-zero features
             y (numpy.array): targets
+            sample_weight (numpy.array): weights of rows, which scale their errors
+            validation (ProgressiveValidation): metrics to add the predictions
+                                                of rows before updates to
+            n_epoch (int): number of passes over X
 
         Returns:
             updated model weights and counts
         """
+        cdef int epoch
         cdef int row
         cdef int row_num = X.shape[0]
+        cdef int indices_num
+        cdef int buf_size
+        cdef int block_start
+        cdef int block_end
+        cdef int block_rows = row_num
+        cdef int n_jobs = self.n_jobs if self.n_jobs > 0 else cpu_count()
+        cdef double p
+        cdef bint track = validation is not None
 
-        cdef int[:] x
         cdef int[:] indices = X.indices
         cdef int[:] indptr = X.indptr
-
-        for epoch in range(self.epoch):
-            for row in range(row_num):
-                x = indices[indptr[row] : indptr[row + 1]]
-                self._update_one(x, self._predict_one(x) - y[row])
+        cdef double[:] p_fit
+        cdef int* buf
+
+        if row_num == 0:
+            return
+
+        # with validation, rows are processed in blocks between reports, and
+        # their predictions are added to the metrics after each block
+        if track:
+            block_rows = min(validation.every, row_num)
+            p_fit = np.zeros((row_num,), dtype=np.float64)
+
+        # each thread hashes a row once into its own buffer, which is shared
+        # by the prediction and the update of the row
+        buf_size = self._n_indices(np.diff(X.indptr).max())
+        for epoch in range(n_epoch):
+            block_start = 0
+            while block_start < row_num:
+                block_end = min(block_start + block_rows, row_num)
+                with nogil, parallel(num_threads=n_jobs):
+                    buf = <int*>malloc(buf_size * sizeof(int))
+                    if buf == NULL:
+                        with gil:
+                            raise MemoryError()
+
+                    for row in prange(block_start, block_end, schedule='static'):
+                        indices_num = self._indices(&indices[indptr[row]], indptr[row + 1] - indptr[row], buf)
+                        if self.is_float32:
+                            p = self._predict_indices(&self._w32, buf, indices_num)
+                            self._update_indices(&self._w32, buf, indices_num, (p - y[row]) * sample_weight[row])
+                        else:
+                            p = self._predict_indices(&self._w64, buf, indices_num)
+                            self._update_indices(&self._w64, buf, indices_num, (p - y[row]) * sample_weight[row])
+                        if track:
+                            p_fit[row] = p
+
+                    free(buf)
+
+                if track:
+                    validation.add_rows(&p_fit[block_start], &y[block_start], &sample_weight[block_start],
+                                        block_end - block_start, self.negative_sampling_rate)
+                    if validation.due():
+                        validation.report()
+                block_start = block_end
 
     def predict(self, X):
         """Predict for a sparse matrix X.
 
+        It does not change the model, so it can be called from multiple
+        threads at the same time. Rows are scored across n_jobs threads.
+
         Args:
             X (scipy.sparse.csr_matrix): a sparse matrix for input features
 
         Returns:
             p (numpy.array): predictions for input features
         """
-        return self._predict(X)
+        return calibrate(self._predict(X), self.negative_sampling_rate)
 
     cdef _predict(self, X):
         """Predict for a sparse matrix X.
@@ -190,18 +480,74 @@ cdef class FTRL:
         """
         cdef int row
         cdef int row_num = X.shape[0]
-        cdef int[:] x
+        cdef int indices_num
+        cdef int buf_size
+        cdef int n_jobs = self.n_jobs if self.n_jobs > 0 else cpu_count()
+
         cdef int[:] indices = X.indices
         cdef int[:] indptr = X.indptr
+        cdef int* buf
+        cdef double[:] p_view
 
         p = np.zeros((row_num, ), dtype=np.float64)
-        for row in range(row_num):
-            x = indices[indptr[row] : indptr[row + 1]]
-            p[row] = self._predict_one(x)
+        if row_num == 0:
+            return p
+
+        p_view = p
+        buf_size = self._n_indices(np.diff(X.indptr).max())
+        with nogil, parallel(num_threads=n_jobs):
+            buf = <int*>malloc(buf_size * sizeof(int))
+            if buf == NULL:
+                with gil:
+                    raise MemoryError()
+
+            for row in prange(row_num, schedule='static'):
+                indices_num = self._indices(&indices[indptr[row]], indptr[row + 1] - indptr[row], buf)
+                if self.is_float32:
+                    p_view[row] = self._score_indices(&self._w32, buf, indices_num)
+                else:
+                    p_view[row] = self._score_indices(&self._w64, buf, indices_num)
+
+            free(buf)
+
         return p
 
+    def freeze(self, dtype=np.float64):
+        """Return a compact predictor with the nonzero weights of the model.
+
+        Args:
+            dtype (numpy.dtype): numpy.float64 or numpy.float32 for the weights
+
+        Returns:
+            a FrozenFTRL object that predicts the same as the model
+        """
+        cdef int i
+        cdef int k = 0
+        cdef int nnz = 0
+        cdef double z_i
+        cdef int[:] keys
+        cdef double[:] values
+
+        for i in range(self.n + 1):
+            if self._weight(i) != 0.:
+                nnz += 1
+
+        keys = np.zeros((nnz,), dtype=np.int32)
+        values = np.zeros((nnz,), dtype=np.float64)
+        for i in range(self.n + 1):
+            z_i = self._weight(i)
+            if z_i != 0.:
+                keys[k] = i
+                values[k] = z_i
+                k += 1
+
+        return FrozenFTRL(np.asarray(keys), np.asarray(values).astype(dtype),
+                          n=self.n, interaction=self.interaction, n_jobs=self.n_jobs,
+                          groups=self.groups, crosses=self.crosses,
+                          negative_sampling_rate=self.negative_sampling_rate)
+
     def update_one(self, x, e):
-        x = np.array(x, dtype=int)
+        x = np.array(x, dtype=np.int32)
         self._update_one(x, e)
 
     cpdef void _update_one(self, int[:] x, double e):
@@ -214,23 +560,39 @@ cdef class FTRL:
         Returns:
             updates model weights and counts
         """
+        cdef int x_len = x.shape[0]
+        cdef int* buf = self._buffer(x_len)
+        cdef int indices_num = self._indices(&x[0] if x_len > 0 else NULL, x_len, buf)
+
+        if self.is_float32:
+            self._update_indices(&self._w32, buf, indices_num, e)
+        else:
+            self._update_indices(&self._w64, buf, indices_num, e)
+
+    cdef void _update_indices(self, FTRLWeights* wt, int* indices, int indices_num, double e) nogil:
+        """Update the model with hashed indices.
+
+        Args:
+            wt (FTRLWeights*): weights and counters of the model
+            indices (int*): hashed indices of a row
+            indices_num (int): number of hashed indices
+            e (double): error between prediction of the model and target
+        """
         cdef int i
         cdef int j
         cdef double e2
         cdef double s
-        cdef list indices = self._indices(x)
-        cdef int indices_num = len(indices)
 
         e2 = e * e
         for j in range(indices_num):
             i = indices[j]
-            s = (sqrt(self.c[i] + e2) - sqrt(self.c[i])) / self.a
-            self.w[i] += e - s * self.z[i]
-            self.c[i] += e2
+            s = (sqrt(wt.c[i] + e2) - sqrt(wt.c[i])) / self.a
+            wt.w[i] += e - s * wt.z[i]
+            wt.c[i] += e2
 
     def predict_one(self, x):
-        x = np.array(x, dtype=int)
-        return self._predict_one(x)
+        x = np.array(x, dtype=np.int32)
+        return calibrate(self._predict_one(x), self.negative_sampling_rate)
 
     cpdef double _predict_one(self, int[:] x):
         """Predict for features.
@@ -238,26 +600,306 @@ cdef class FTRL:
         Args:
             x (list of int): a list of index of non-zero features
 
+        Returns:
+            p (double): a prediction for input features
+        """
+        cdef int x_len = x.shape[0]
+        cdef int* buf = self._buffer(x_len)
+        cdef int indices_num = self._indices(&x[0] if x_len > 0 else NULL, x_len, buf)
+
+        if self.is_float32:
+            return self._predict_indices(&self._w32, buf, indices_num)
+        return self._predict_indices(&self._w64, buf, indices_num)
+
+    cdef double _predict_indices(self, FTRLWeights* wt, int* indices, int indices_num) nogil:
+        """Predict for hashed indices and update the lazy weights.
+
+        Args:
+            wt (FTRLWeights*): weights and counters of the model
+            indices (int*): hashed indices of a row
+            indices_num (int): number of hashed indices
+
         Returns:
             p (double): a prediction for input features
         """
         cdef int i
         cdef int j
-        cdef double sign
         cdef double wTx
-        cdef list indices = self._indices(x)
-        cdef int indices_num = len(indices)
 
         wTx = 0.
         for j in range(indices_num):
             i = indices[j]
-            sign = -1. if self.w[i] < 0 else 1.
-            if sign * self.w[i] <= self.l1:
-                self.z[i] = 0.
+            wt.z[i] = self._lazy_weight(wt, i)
+            wTx += wt.z[i]
+
+        return sigm(wTx)
+
+    cdef double _score_indices(self, FTRLWeights* wt, int* indices, int indices_num) nogil:
+        """Predict for hashed indices without changing the model.
+
+        Args:
+            wt (FTRLWeights*): weights and counters of the model
+            indices (int*): hashed indices of a row
+            indices_num (int): number of hashed indices
+
+        Returns:
+            p (double): a prediction for input features
+        """
+        cdef int j
+        cdef double wTx
+
+        wTx = 0.
+        for j in range(indices_num):
+            wTx += self._lazy_weight(wt, indices[j])
+
+        return sigm(wTx)
+
+    cdef double _weight(self, int i) nogil:
+        """Return the lazy weight of the i-th feature."""
+        if self.is_float32:
+            return self._lazy_weight(&self._w32, i)
+        return self._lazy_weight(&self._w64, i)
+
+    cdef double _lazy_weight(self, FTRLWeights* wt, int i) nogil:
+        """Return the lazy weight of the i-th feature."""
+        cdef double sign = -1. if wt.w[i] < 0 else 1.
+
+        if sign * wt.w[i] <= self.l1:
+            return 0.
+        return (sign * self.l1 - wt.w[i]) / ((self.b + sqrt(wt.c[i])) / self.a + self.l2)
+
+
+cdef class FrozenFTRL:
+    """Compact FTRL predictor that keeps only the nonzero weights.
+
+    Weights are stored in a table sorted by their hashed indices, and looked
+    up with binary search.  It is created by FTRL.freeze().
+
+    Attributes:
+        n (int): number of features after hashing trick
+        interaction (boolean): whether to use 2nd order interaction or not
+        groups (list of int): first feature indices of feature groups
+        crosses (list of list): pairs of groups whose features interact
+        n_jobs (int): number of threads for prediction. -1 uses all CPUs
+        negative_sampling_rate (double): rate of negative rows kept in the training data
+        keys (array of int): sorted hashed indices of nonzero weights
+        values (array of float or double): nonzero weights
+    """
+
+    cdef int n
+    cdef bint interaction
+    cdef object groups
+    cdef object crosses
+    cdef bint has_crosses
+    cdef np.ndarray _group_array
+    cdef np.ndarray _pair_array
+    cdef Crosses _crosses       # pointers to the groups and crosses if crosses are given
+    cdef int n_jobs
+    cdef double negative_sampling_rate
+    cdef int nnz
+    cdef bint is_float32
+    cdef int[:] keys
+    cdef double[:] values64
+    cdef float[:] values32
+
+    def __init__(self, keys, values, int n, bint interaction=True, int n_jobs=1, groups=None, crosses=None,
+                 negative_sampling_rate=1.):
+        """Initialize the FrozenFTRL class object.
+
+        Args:
+            keys (numpy.array): sorted hashed indices of nonzero weights
+            values (numpy.array): float64 or float32 nonzero weights
+            n (int): number of features after hashing trick
+            interaction (boolean): whether to use 2nd order interaction or not
+            n_jobs (int): number of threads for prediction. -1 uses all CPUs
+            groups (list of int): first feature indices of feature groups
+            crosses (list of tuple): pairs of groups whose features interact
+            negative_sampling_rate (double): rate of negative rows kept in the
+                                             training data
+        """
+        self.n = n
+        self.interaction = interaction
+        self.groups, self.crosses = _check_crosses(groups, crosses, interaction)
+        self._bind_crosses()
+        self.n_jobs = check_n_jobs(n_jobs)
+        self.negative_sampling_rate = check_negative_sampling_rate(negative_sampling_rate)
+        self.nnz = len(keys)
+        self.keys = np.ascontiguousarray(keys, dtype=np.int32)
+
+        self.is_float32 = values.dtype == np.float32
+        if self.is_float32:
+            self.values32 = np.ascontiguousarray(values)
+        else:
+            self.values64 = np.ascontiguousarray(values, dtype=np.float64)
+
+    def __repr__(self):
+        return ('FrozenFTRL(n={}, interaction={}, n_jobs={}, nnz={}, dtype={}, groups={}, crosses={}, '
+                'negative_sampling_rate={})').format(
+            self.n, self.interaction, self.n_jobs, self.nnz,
+            'float32' if self.is_float32 else 'float64', self.groups, self.crosses, self.negative_sampling_rate
+        )
+
+    def _bind_crosses(self):
+        """Point the crosses at the arrays of the groups and crosses."""
+        self.has_crosses = self.crosses is not None
+        if self.has_crosses:
+            self._group_array = np.array(self.groups, dtype=np.int32)
+            self._pair_array = np.array(self.crosses, dtype=np.int32).reshape(-1)
+            self._crosses.groups = <int*>np.PyArray_DATA(self._group_array)
+            self._crosses.n_groups = len(self.groups)
+            self._crosses.pairs = <int*>np.PyArray_DATA(self._pair_array)
+            self._crosses.n_pairs = len(self.crosses)
+
+    def save(self, path):
+        """Save the model into a directory that load() can memory-map.
+
+        Args:
+            path (str): a path to the directory to save the model into
+        """
+        save_state(self, path)
+
+    @classmethod
+    def load(cls, path, bint mmap=True):
+        """Load a model saved by save().
+
+        Args:
+            path (str): a path to the directory the model is saved in
+            mmap (boolean): whether to memory-map the weights copy-on-write
+                            instead of reading them
+
+        Returns:
+            a FrozenFTRL object
+        """
+        return load_state(cls, path, mmap)
+
+    def __reduce__(self):
+        return (restore_state, (self.__class__,) + self._get_state())
+
+    def _get_state(self):
+        params = {'n': self.n, 'interaction': self.interaction, 'n_jobs': self.n_jobs,
+                  'groups': self.groups, 'crosses': self.crosses,
+                  'negative_sampling_rate': self.negative_sampling_rate}
+        arrays = {'keys': np.asarray(self.keys),
+                  'values': np.asarray(self.values32) if self.is_float32 else np.asarray(self.values64)}
+        return params, arrays
+
+    def _set_state(self, dict params, dict arrays):
+        self.__init__(arrays['keys'], arrays['values'], **params)
+
+    cdef int _n_indices(self, int x_len) nogil:
+        """Return the size of the index buffer for a row with x_len features."""
+        if self.has_crosses:
+            return n_cross_indices(x_len, &self._crosses)
+        return n_hashed_indices(x_len, self.interaction)
+
+    cdef int _indices(self, int* x, int x_len, int* indices) nogil:
+        """Hash features into the index buffer.
+
+        Args:
+            x (int*): index of non-zero features
+            x_len (int): number of non-zero features
+            indices (int*): buffer with room for _n_indices(x_len) indices
+
+        Returns:
+            the number of indices written into the buffer
+        """
+        if self.has_crosses:
+            return hash_cross_indices(x, x_len, self.n, &self._crosses, indices)
+        return hash_indices(x, x_len, self.n, self.interaction, indices)
+
+    cdef double _weight(self, int i) nogil:
+        """Return the weight of the i-th hashed feature."""
+        cdef int lo = 0
+        cdef int hi = self.nnz
+        cdef int mid
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.keys[mid] < i:
+                lo = mid + 1
             else:
-                self.z[i] = (sign * self.l1 - self.w[i]) / \
-                            ((self.b + sqrt(self.c[i])) / self.a + self.l2)
+                hi = mid
+
+        if lo == self.nnz or self.keys[lo] != i:
+            return 0.
+        return self.values32[lo] if self.is_float32 else self.values64[lo]
+
+    cdef double _score_indices(self, int* indices, int indices_num) nogil:
+        """Predict for hashed indices.
 
-            wTx += self.z[i]
+        Args:
+            indices (int*): hashed indices of a row
+            indices_num (int): number of hashed indices
+
+        Returns:
+            p (double): a prediction for input features
+        """
+        cdef int j
+        cdef double wTx
+
+        wTx = 0.
+        for j in range(indices_num):
+            wTx += self._weight(indices[j])
 
         return sigm(wTx)
+
+    def predict(self, X):
+        """Predict for a sparse matrix X.
+
+        Args:
+            X (scipy.sparse.csr_matrix): a sparse matrix for input features
+
+        Returns:
+            p (numpy.array): predictions for input features
+        """
+        cdef int row
+        cdef int row_num = X.shape[0]
+        cdef int indices_num
+        cdef int buf_size
+        cdef int n_jobs = self.n_jobs if self.n_jobs > 0 else cpu_count()
+
+        cdef int[:] indices = X.indices
+        cdef int[:] indptr = X.indptr
+        cdef int* buf
+        cdef double[:] p_view
+
+        p = np.zeros((row_num, ), dtype=np.float64)
+        if row_num == 0:
+            return p
+
+        p_view = p
+        buf_size = self._n_indices(np.diff(X.indptr).max())
+        with nogil, parallel(num_threads=n_jobs):
+            buf = <int*>malloc(buf_size * sizeof(int))
+            if buf == NULL:
+                with gil:
+                    raise MemoryError()
+
+            for row in prange(row_num, schedule='static'):
+                indices_num = self._indices(&indices[indptr[row]], indptr[row + 1] - indptr[row], buf)
+                p_view[row] = self._score_indices(buf, indices_num)
+
+            free(buf)
+
+        return calibrate(p, self.negative_sampling_rate)
+
+    def predict_one(self, x):
+        """Predict for features.
+
+        Args:
+            x (list of int): a list of index of non-zero features
+
+        Returns:
+            p (double): a prediction for input features
+        """
+        cdef int[:] x_view = np.array(x, dtype=np.int32)
+        cdef int x_len = x_view.shape[0]
+        cdef int* buf = <int*>malloc(self._n_indices(x_len) * sizeof(int))
+        cdef double p
+
+        if buf == NULL:
+            raise MemoryError()
+
+        p = self._score_indices(buf, self._indices(&x_view[0] if x_len > 0 else NULL, x_len, buf))
+        free(buf)
+        return calibrate(p, self.negative_sampling_rate)
@@ -2,16 +2,39 @@
 # cython: wraparound=False
 # cython: cdivision=True
 import numpy as np
+from .._libsvm import iter_libsvm
+from ._sampling import calibrate, check_indices, check_negative_sampling_rate, check_sample_weight
+from ._state import check_dtype, save_state, load_state, restore_state
 
 cimport cython
-from libc.math cimport sqrt, abs
+from libc.math cimport sqrt
 from ..util cimport sigm
+from .progressive cimport ProgressiveValidation
 cimport numpy as np
 
 
 np.import_array()
 
 
+cdef struct NNWeights32:
+    float* w0
+    float* w1
+    float* c0
+    float* c1
+
+
+cdef struct NNWeights64:
+    double* w0
+    double* w1
+    double* c0
+    double* c1
+
+
+ctypedef fused NNWeights:
+    NNWeights32
+    NNWeights64
+
+
 cdef class NN:
     """Neural Network with a single ReLU hidden layer online learner.
 
@@ -21,11 +44,13 @@ cdef class NN:
         h (int): number of hidden units
         a (double): initial learning rate
         l2 (double): L2 regularization parameter
-        w0 (array of double): weights between the input and hidden layers
-        w1 (array of double): weights between the hidden and output layers
+        w0 (array of float or double): weights between the input and hidden layers
+        w1 (array of float or double): weights between the hidden and output layers
         z (array of double): hidden units
         c (double): counter
-        c1 (array of double): counters for hidden units
+        c1 (array of float or double): counters for hidden units
+        dtype (numpy.dtype): float32 or float64 for weights and counters
+        negative_sampling_rate (double): rate of negative rows kept in the training data
     """
 
     cdef unsigned int epoch # number of epochs
@@ -33,12 +58,18 @@ cdef class NN:
     cdef unsigned int h     # number of hidden units
     cdef double a           # learning rate
     cdef double l2          # L2 regularization parameter
-    cdef double[:] w0       # weights between the input and hidden layers
-    cdef double[:] w1       # weights between the hidden and output layers
+    cdef double negative_sampling_rate  # rate of negative rows kept in the training data
+    cdef object dtype       # dtype of weights and counters
+    cdef bint is_float32
+    cdef np.ndarray w0      # weights between the input and hidden layers
+    cdef np.ndarray w1      # weights between the hidden and output layers
     cdef double[:] z        # hidden units
+    cdef double[:] dl_dz    # gradients of hidden units
     cdef double c           # counter
-    cdef double[:] c0       # counters for input units
-    cdef double[:] c1       # counters for hidden units
+    cdef np.ndarray c0      # counters for input units
+    cdef np.ndarray c1      # counters for hidden units
+    cdef NNWeights32 _w32   # pointers to the arrays if dtype is float32
+    cdef NNWeights64 _w64   # pointers to the arrays if dtype is float64
 
     def __init__(self,
                  unsigned int n,
@@ -46,7 +77,9 @@ cdef class NN:
                  unsigned int h=10,
                  double a=0.01,
                  double l2=0.,
-                 unsigned int seed=0):
+                 unsigned int seed=0,
+                 dtype=np.float64,
+                 negative_sampling_rate=1.):
         """Initialize the NN class object.
 
         Args:
@@ -56,6 +89,12 @@ cdef class NN:
             a (double): initial learning rate
             l2 (double): L2 regularization parameter
             seed (unsigned int): random seed
+            dtype (numpy.dtype): float32 or float64 for weights and counters.
+                                 float32 halves the memory of the model
+            negative_sampling_rate (double): rate of negative rows kept in the
+                                             training data, e.g. by
+                                             util.get_downsampled_index0().
+                                             Predictions are corrected for it
         """
 
         cdef int i
@@ -68,23 +107,98 @@ cdef class NN:
 
         self.a = a
         self.l2 = l2
+        self.negative_sampling_rate = check_negative_sampling_rate(negative_sampling_rate)
+        self.dtype = check_dtype(dtype)
 
-        self.w1 = (rng.rand(self.h + 1) - .5) * 1e-6
-        self.w0 = (rng.rand((self.n + 1) * self.h) - .5) * 1e-6
+        self.w1 = ((rng.rand(self.h + 1) - .5) * 1e-6).astype(self.dtype)
+        self.w0 = ((rng.rand((self.n + 1) * self.h) - .5) * 1e-6).astype(self.dtype)
 
         # hidden units in the hidden layer
         self.z = np.zeros((self.h,), dtype=np.float64)
+        self.dl_dz = np.zeros((self.h,), dtype=np.float64)
 
         # counters for biases and inputs
         self.c = 0.
-        self.c1 = np.zeros((self.h,), dtype=np.float64)
-        self.c0 = np.zeros((self.n,), dtype=np.float64)
+        self.c1 = np.zeros((self.h,), dtype=self.dtype)
+        self.c0 = np.zeros((self.n,), dtype=self.dtype)
+        self._bind_arrays()
 
     def __repr__(self):
-        return ('NN(n={}, epoch={}, h={}, a={}, l2={})').format(
-            self.n, self.epoch, self.h, self.a, self.l2
+        return ('NN(n={}, epoch={}, h={}, a={}, l2={}, dtype={}, negative_sampling_rate={})').format(
+            self.n, self.epoch, self.h, self.a, self.l2, self.dtype.name, self.negative_sampling_rate
         )
 
+    def _bind_arrays(self):
+        """Point the weights of the dtype at the arrays."""
+        self.is_float32 = self.dtype == np.float32
+        if self.is_float32:
+            self._w32.w0 = <float*>np.PyArray_DATA(self.w0)
+            self._w32.w1 = <float*>np.PyArray_DATA(self.w1)
+            self._w32.c0 = <float*>np.PyArray_DATA(self.c0)
+            self._w32.c1 = <float*>np.PyArray_DATA(self.c1)
+        else:
+            self._w64.w0 = <double*>np.PyArray_DATA(self.w0)
+            self._w64.w1 = <double*>np.PyArray_DATA(self.w1)
+            self._w64.c0 = <double*>np.PyArray_DATA(self.c0)
+            self._w64.c1 = <double*>np.PyArray_DATA(self.c1)
+
+    def save(self, path):
+        """Save the model into a directory that load() can memory-map.
+
+        Args:
+            path (str): a path to the directory to save the model into
+        """
+        save_state(self, path)
+
+    @classmethod
+    def load(cls, path, bint mmap=True):
+        """Load a model saved by save().
+
+        Args:
+            path (str): a path to the directory the model is saved in
+            mmap (boolean): whether to memory-map the weights and counts
+                            copy-on-write instead of reading them
+
+        Returns:
+            a NN object
+        """
+        return load_state(cls, path, mmap)
+
+    def __reduce__(self):
+        return (restore_state, (self.__class__,) + self._get_state())
+
+    def _get_state(self):
+        params = {'n': self.n,
+                  'epoch': self.epoch,
+                  'h': self.h,
+                  'a': self.a,
+                  'l2': self.l2,
+                  'negative_sampling_rate': self.negative_sampling_rate,
+                  'dtype': self.dtype.name,
+                  'c': self.c}
+        arrays = {'w0': self.w0,
+                  'w1': self.w1,
+                  'c0': self.c0,
+                  'c1': self.c1}
+        return params, arrays
+
+    def _set_state(self, dict params, dict arrays):
+        self.n = params['n']
+        self.epoch = params['epoch']
+        self.h = params['h']
+        self.a = params['a']
+        self.l2 = params['l2']
+        self.negative_sampling_rate = params['negative_sampling_rate']
+        self.dtype = check_dtype(params['dtype'])
+        self.c = params['c']
+        self.w0 = np.ascontiguousarray(arrays['w0'], dtype=self.dtype)
+        self.w1 = np.ascontiguousarray(arrays['w1'], dtype=self.dtype)
+        self.c0 = np.ascontiguousarray(arrays['c0'], dtype=self.dtype)
+        self.c1 = np.ascontiguousarray(arrays['c1'], dtype=self.dtype)
+        self._bind_arrays()
+        self.z = np.zeros((self.h,), dtype=np.float64)
+        self.dl_dz = np.zeros((self.h,), dtype=np.float64)
+
     def read_sparse(self, path):
         """Read a libsvm format sparse file line by line.
 
@@ -92,48 +206,111 @@ cdef class NN:
             path (str): a file path to the libsvm format sparse file
 
         Yields:
-            idx (list of int): a list of index of non-zero features
-            val (list of double): a list of values of non-zero features
+            x (list of tuple): a list of (index, value) of non-zero features
             y (int): target value
         """
-        for line in open(path):
-            xs = line.rstrip().split(' ')
+        for X, y in iter_libsvm(path):
+            for row in range(X.shape[0]):
+                start, end = X.indptr[row], X.indptr[row + 1]
+                yield list(zip((X.indices[start:end] % self.n).tolist(), X.data[start:end].tolist())), int(y[row])
 
-            y = int(xs[0])
-            idx = []
-            val = []
-            for item in xs[1:]:
-                i, v = item.split(':')
-                idx.append(int(i) % self.n)
-                val.append(float(v))
+    cpdef fit(self, X, y, sample_weight=None, validation=None):
+        """Update the model with a sparse input feature matrix and its targets.
 
-            yield zip(idx, val), y
+        Args:
+            X (scipy.sparse.csr_matrix): a list of (index, value) of non-zero features
+            y (numpy.array): targets
+            sample_weight (numpy.array): weights of rows. 1 for every row if None
+            validation (ProgressiveValidation): metrics to add the predictions
+                                                of rows before updates to
 
-    cpdef fit(self, X, y):
-        """Update the model with a sparse input feature matrix and its targets.
+        Returns:
+            updated model weights and counts
+        """
+        self._fit(X, y, sample_weight, validation, self.epoch)
+        return self
+
+    def partial_fit(self, X, y, sample_weight=None, validation=None):
+        """Update the model with one pass over a sparse input feature matrix.
 
         Args:
             X (scipy.sparse.csr_matrix): a list of (index, value) of non-zero features
             y (numpy.array): targets
+            sample_weight (numpy.array): weights of rows. 1 for every row if None
+            validation (ProgressiveValidation): metrics to add the predictions
+                                                of rows before updates to
 
         Returns:
             updated model weights and counts
         """
-        cdef int row
+        self._fit(X, y, sample_weight, validation, 1)
+        return self
 
-        cdef int[:] indices = X.indices
-        cdef int[:] data = X.data
-        cdef int[:] indptr = X.indptr
+    def fit_file(self, path, int chunk_rows=100000, validation=None):
+        """Update the model with a libsvm format sparse file in constant memory.
+
+        The file is parsed in chunks of rows, and the model is updated with
+        each chunk before the next one is read.
 
+        Args:
+            path (str): a file path to the libsvm format sparse file
+            chunk_rows (int): number of rows to parse at a time
+            validation (ProgressiveValidation): metrics to add the predictions
+                                                of rows before updates to
+
+        Returns:
+            updated model weights and counts
+        """
         for epoch in range(self.epoch):
-            for row in range(X.shape[0]):
-                x = zip(
-                    indices[indptr[row] : indptr[row + 1]], 
-                    data[indptr[row] : indptr[row + 1]],
-                )
-                self.update_one(x, self.predict_one(x) - y[row])
+            for X, y in iter_libsvm(path, chunk_rows=chunk_rows):
+                self._fit(X, y, None, validation, 1)
         return self
 
+    cdef _fit(self, X, y, sample_weight, ProgressiveValidation validation, unsigned int n_epoch):
+        """Update the model with a sparse input feature matrix and its targets.
+
+        Args:
+            X (scipy.sparse.csr_matrix): a list of (index, value) of non-zero features
+            y (numpy.array): targets
+            sample_weight (numpy.array): weights of rows, which scale their errors
+                                         and regularization. Rows of weight 0 are skipped
+            validation (ProgressiveValidation): metrics to add the predictions
+                                                of rows before updates to
+            n_epoch (int): number of passes over X
+
+        Returns:
+            updated model weights and counts
+        """
+        cdef unsigned int epoch
+        cdef int row
+        cdef int row_num = X.shape[0]
+        cdef int start
+
+        cdef int[:] indices = check_indices(X.indices, self.n)
+        cdef double[:] data = np.asarray(X.data, dtype=np.float64)
+        cdef int[:] indptr = X.indptr
+        cdef double[:] y_view = np.asarray(y, dtype=np.float64)
+        cdef double[:] weight = check_sample_weight(sample_weight, row_num)
+        cdef double p
+        cdef bint track = validation is not None
+        cdef double* z = &self.z[0]
+        cdef double* dl_dz = &self.dl_dz[0]
+
+        with nogil:
+            for epoch in range(n_epoch):
+                for row in range(row_num):
+                    start = indptr[row]
+                    p = self._predict_row(&indices[start], &data[start], indptr[row + 1] - start, z)
+                    if weight[row] != 0.:
+                        self._update_row(&indices[start], &data[start], indptr[row + 1] - start,
+                                         (p - y_view[row]) * weight[row], weight[row], z, dl_dz)
+
+                    if track:
+                        validation.add(p, y_view[row], weight[row], self.negative_sampling_rate)
+                        if validation.due():
+                            with gil:
+                                validation.report()
+
     def predict(self, X):
         """Predict for a sparse matrix X.
 
@@ -143,12 +320,24 @@ cdef class NN:
         Returns:
             p (numpy.array): predictions for input features
         """
+        cdef int row
+        cdef int row_num = X.shape[0]
+        cdef int start
+
+        cdef int[:] indices = check_indices(X.indices, self.n)
+        cdef double[:] data = np.asarray(X.data, dtype=np.float64)
+        cdef int[:] indptr = X.indptr
+        cdef double[:] z = np.zeros((self.h,), dtype=np.float64)
+        cdef double[:] p_view
 
-        p = np.zeros((X.shape[0], ), dtype=np.float64)
-        for row in range(X.shape[0]):
-            p[row] = self.predict_one(zip(X[row].indices, X[row].data))
+        p = np.zeros((row_num, ), dtype=np.float64)
+        p_view = p
+        with nogil:
+            for row in range(row_num):
+                start = indptr[row]
+                p_view[row] = self._predict_row(&indices[start], &data[start], indptr[row + 1] - start, &z[0])
 
-        return p
+        return calibrate(p, self.negative_sampling_rate)
 
     def predict_one(self, list x):
         """Predict for features.
@@ -156,84 +345,169 @@ cdef class NN:
         Args:
             x (list of tuple): a list of (index, value) of non-zero features
 
+        Returns:
+            p (double): a prediction for input features
+        """
+        cdef int[:] idx = check_indices([i for i, _ in x], self.n)
+        cdef double[:] val = np.array([v for _, v in x], dtype=np.float64)
+
+        if len(x) == 0:
+            return calibrate(self._predict_row(NULL, NULL, 0, &self.z[0]), self.negative_sampling_rate)
+        return calibrate(self._predict_row(&idx[0], &val[0], len(x), &self.z[0]), self.negative_sampling_rate)
+
+    def update_one(self, list x, double e):
+        """Update the model with one observation.
+
+        Args:
+            x (list of tuple): a list of (index, value) of non-zero features
+            e (double): error between the prediction of the model and target
+
+        Returns:
+            updated model weights and counts
+        """
+        cdef int[:] idx = check_indices([i for i, _ in x], self.n)
+        cdef double[:] val = np.array([v for _, v in x], dtype=np.float64)
+
+        if len(x) == 0:
+            self._update_row(NULL, NULL, 0, e, 1., &self.z[0], &self.dl_dz[0])
+        else:
+            self._update_row(&idx[0], &val[0], len(x), e, 1., &self.z[0], &self.dl_dz[0])
+
+    cdef double _predict_row(self, int* idx, double* val, int x_len, double* z) nogil:
+        """Predict for a row with the weights of the dtype."""
+        if self.is_float32:
+            return self._predict_row_typed(&self._w32, idx, val, x_len, z)
+        return self._predict_row_typed(&self._w64, idx, val, x_len, z)
+
+    cdef double _predict_row_typed(self, NNWeights* wt, int* idx, double* val, int x_len, double* z) nogil:
+        """Predict for a row.
+
+        Hidden weights of an input unit are contiguous in w0, so they are
+        accumulated into the hidden units in one pass per non-zero input.
+
+        Args:
+            wt (NNWeights*): weights and counters of the model
+            idx (int*): index of non-zero features
+            val (double*): values of non-zero features
+            x_len (int): number of non-zero features
+            z (double*): hidden units to fill in
+
         Returns:
             p (double): a prediction for input features
         """
         cdef double p
-        cdef int j
-        cdef int i
         cdef double v
+        cdef int o
+        cdef int j
+        cdef int k
 
-        # starting with the bias in the hidden layer
-        p = self.w1[self.h]
-
-        # calculating and adding values of hidden units
+        # starting with the bias in the input layer
         for j in range(self.h):
-            # starting with the bias in the input layer
-            self.z[j] = self.w0[self.n * self.h + j]
+            z[j] = wt.w0[self.n * self.h + j]
 
-            # calculating and adding values of input units
-            for i, v in x:
-                self.z[j] += self.w0[i * self.h + j] * v
+        # calculating and adding values of input units
+        for k in range(x_len):
+            v = val[k]
+            if v == 0.:
+                continue
 
-            # apply the ReLU activation function to the hidden unit
-            self.z[j] = self.z[j] if self.z[j] > 0. else 0.
+            o = idx[k] * self.h
+            for j in range(self.h):
+                z[j] += wt.w0[o + j] * v
 
-            p += self.w1[j] * self.z[j]
+        # starting with the bias in the hidden layer
+        p = wt.w1[self.h]
+
+        # apply the ReLU activation function to the hidden units
+        for j in range(self.h):
+            z[j] = z[j] if z[j] > 0. else 0.
+            p += wt.w1[j] * z[j]
 
         # apply the sigmoid activation function to the output unit
         return sigm(p)
 
-    def update_one(self, list x, double e):
-        """Update the model with one observation.
+    cdef void _update_row(self, int* idx, double* val, int x_len, double e, double weight, double* z,
+                          double* dl_dz) nogil:
+        """Update the model with a row with the weights of the dtype."""
+        if self.is_float32:
+            self._update_row_typed(&self._w32, idx, val, x_len, e, weight, z, dl_dz)
+        else:
+            self._update_row_typed(&self._w64, idx, val, x_len, e, weight, z, dl_dz)
 
-        Args:
-            x (list of tuple): a list of (index, value) of non-zero features
-            e (double): error between the prediction of the model and target
+    cdef void _update_row_typed(self, NNWeights* wt, int* idx, double* val, int x_len, double e, double weight,
+                                double* z, double* dl_dz) nogil:
+        """Update the model with a row.
 
-        Returns:
-            updated model weights and counts
+        Args:
+            wt (NNWeights*): weights and counters of the model
+            idx (int*): index of non-zero features
+            val (double*): values of non-zero features
+            x_len (int): number of non-zero features
+            e (double): error between the prediction of the model and target,
+                        scaled by the weight of the row
+            weight (double): weight of the row, which scales the L2
+                             regularization as well
+            z (double*): hidden units filled in by _predict_row()
+            dl_dz (double*): scratch buffer for h gradients of hidden units
         """
         cdef int j
         cdef int i
+        cdef int k
+        cdef double v
+        cdef double lr
+        cdef double g2
         cdef double dl_dy
-        cdef double dl_dz
         cdef double dl_dw1
         cdef double dl_dw0
-        cdef double v
+        cdef int o
+        cdef double l2 = self.l2 * weight
 
         dl_dy = e      # dl/dy * (initial learning rate)
 
         # starting with the bias in the hidden layer
-        self.w1[self.h] -= (dl_dy + self.l2 * self.w1[self.h]) * self.a / (sqrt(self.c) + 1)
+        wt.w1[self.h] -= (dl_dy + l2 * wt.w1[self.h]) * self.a / (sqrt(self.c) + 1)
         for j in range(self.h):
             # update weights related to non-zero hidden units
-            if self.z[j] == 0.:
+            if z[j] == 0.:
                 continue
 
             # update weights between the hidden units and output
             # dl/dw1 = dl/dy * dy/dw1 = dl/dy * z
-            dl_dw1 = dl_dy * self.z[j]
-            self.w1[j] -= (dl_dw1 + self.l2 * self.w1[j]) * self.a / (sqrt(self.c1[j]) + 1)
+            dl_dw1 = dl_dy * z[j]
+            wt.w1[j] -= (dl_dw1 + l2 * wt.w1[j]) * self.a / (sqrt(wt.c1[j]) + 1)
 
             # starting with the bias in the input layer
             # dl/dz = dl/dy * dy/dz = dl/dy * w1
-            dl_dz = dl_dy * self.w1[j]
-            self.w0[self.n * self.h + j] -= (dl_dz +
-                                             self.l2 * self.w0[self.n * self.h + j]) * self.a / (sqrt(self.c1[j]) + 1)
-            # update weights related to non-zero input units
-            for i, v in x:
+            dl_dz[j] = dl_dy * wt.w1[j]
+            wt.w0[self.n * self.h + j] -= (dl_dz[j] +
+                                           l2 * wt.w0[self.n * self.h + j]) * self.a / (sqrt(wt.c1[j]) + 1)
+
+            # update counter for the hidden unit j
+            wt.c1[j] += dl_dw1 * dl_dw1
+
+        # update weights related to non-zero input units, whose hidden weights
+        # are contiguous in w0
+        for k in range(x_len):
+            i = idx[k]
+            v = val[k]
+            if v == 0.:
+                continue
+
+            o = i * self.h
+            lr = self.a / (sqrt(wt.c0[i]) + 1)
+            g2 = 0.
+            for j in range(self.h):
+                if z[j] == 0.:
+                    continue
+
                 # update weights between the hidden unit j and input i
                 # dl/dw0 = dl/dz * dz/dw0 = dl/dz * v
-                dl_dw0 = dl_dz * v
-                self.w0[i * self.h + j] -= (dl_dw0 +
-                                            self.l2 * self.w0[i * self.h + j]) * self.a / (sqrt(self.c0[i]) + 1)
-
-                # update counter for the input i
-                self.c0[i] += dl_dw0 * dl_dw0
+                dl_dw0 = dl_dz[j] * v
+                wt.w0[o + j] -= (dl_dw0 + l2 * wt.w0[o + j]) * lr
+                g2 += dl_dw0 * dl_dw0
 
-            # update counter for the hidden unit j
-            self.c1[j] += dl_dw1 * dl_dw1
+            # update counter for the input i
+            wt.c0[i] += g2
 
         # update overall counter
         self.c += dl_dy * dl_dy
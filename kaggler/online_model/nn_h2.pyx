@@ -2,16 +2,43 @@
 # cython: wraparound=False
 # cython: cdivision=True
 import numpy as np
+from .._libsvm import iter_libsvm
+from ._sampling import calibrate, check_indices, check_negative_sampling_rate, check_sample_weight
+from ._state import check_dtype, save_state, load_state, restore_state
 
 cimport cython
-from libc.math cimport sqrt, abs
+from libc.math cimport sqrt
 from ..util cimport sigm
+from .progressive cimport ProgressiveValidation
 cimport numpy as np
 
 
 np.import_array()
 
 
+cdef struct NN_H2Weights32:
+    float* w0
+    float* w1
+    float* w2
+    float* c0
+    float* c1
+    float* c2
+
+
+cdef struct NN_H2Weights64:
+    double* w0
+    double* w1
+    double* w2
+    double* c0
+    double* c1
+    double* c2
+
+
+ctypedef fused NN_H2Weights:
+    NN_H2Weights32
+    NN_H2Weights64
+
+
 cdef class NN_H2:
     """Neural Network with 2 ReLU hidden layers online learner.
 
@@ -22,30 +49,40 @@ cdef class NN_H2:
         h2 (int): number of the 2nd level hidden units
         a (double): initial learning rate
         l2 (double): L2 regularization parameter
-        w0 (array of double): weights between the input and 1st hidden layers
-        w1 (array of double): weights between the 1st and 2nd hidden layers
-        w2 (array of double): weights between the 2nd hidden and output layers
+        w0 (array of float or double): weights between the input and 1st hidden layers
+        w1 (array of float or double): weights between the 1st and 2nd hidden layers
+        w2 (array of float or double): weights between the 2nd hidden and output layers
         z1 (array of double): 1st level hidden units
         z2 (array of double): 2nd level hidden units
         c (double): counter
-        c1 (array of double): counters for 1st level hidden units
-        c2 (array of double): counters for 2nd level hidden units
+        c1 (array of float or double): counters for 1st level hidden units
+        c2 (array of float or double): counters for 2nd level hidden units
+        dtype (numpy.dtype): float32 or float64 for weights and counters
+        negative_sampling_rate (double): rate of negative rows kept in the training data
     """
 
+    cdef unsigned int epoch # number of epochs
     cdef unsigned int n     # number of input units
     cdef unsigned int h1    # number of the 1st level hidden units
     cdef unsigned int h2    # number of the 2nd level hidden units
     cdef double a           # learning rate
     cdef double l2          # L2 regularization parameter
-    cdef double[:] w0       # weights between the input and 1st hidden layers
-    cdef double[:] w1       # weights between the 1st and 2nd hidden layers
-    cdef double[:] w2       # weights between the 2nd hidden and output layers
+    cdef double negative_sampling_rate  # rate of negative rows kept in the training data
+    cdef object dtype       # dtype of weights and counters
+    cdef bint is_float32
+    cdef np.ndarray w0      # weights between the input and 1st hidden layers
+    cdef np.ndarray w1      # weights between the 1st and 2nd hidden layers
+    cdef np.ndarray w2      # weights between the 2nd hidden and output layers
     cdef double[:] z1       # 1st level hidden units
     cdef double[:] z2       # 2nd level hidden units
+    cdef double[:] dl_dz1   # gradients of 1st level hidden units
+    cdef double[:] dl_dz2   # gradients of 2nd level hidden units
     cdef double c           # counter
-    cdef double[:] c0       # counters for input units
-    cdef double[:] c1       # counters for 1st level hidden units
-    cdef double[:] c2       # counters for 2nd level hidden units
+    cdef np.ndarray c0      # counters for input units
+    cdef np.ndarray c1      # counters for 1st level hidden units
+    cdef np.ndarray c2      # counters for 2nd level hidden units
+    cdef NN_H2Weights32 _w32    # pointers to the arrays if dtype is float32
+    cdef NN_H2Weights64 _w64    # pointers to the arrays if dtype is float64
 
     def __init__(self,
                  unsigned int n,
@@ -54,7 +91,9 @@ cdef class NN_H2:
                  unsigned int h2=256,
                  double a=0.01,
                  double l2=0.,
-                 unsigned int seed=0):
+                 unsigned int seed=0,
+                 dtype=np.float64,
+                 negative_sampling_rate=1.):
         """Initialize the NN class object.
 
         Args:
@@ -65,6 +104,12 @@ cdef class NN_H2:
             a (double): initial learning rate
             l2 (double): L2 regularization parameter
             seed (unsigned int): random seed
+            dtype (numpy.dtype): float32 or float64 for weights and counters.
+                                 float32 halves the memory of the model
+            negative_sampling_rate (double): rate of negative rows kept in the
+                                             training data, e.g. by
+                                             util.get_downsampled_index0().
+                                             Predictions are corrected for it
         """
 
         cdef int i
@@ -78,15 +123,17 @@ cdef class NN_H2:
 
         self.a = a
         self.l2 = l2
+        self.negative_sampling_rate = check_negative_sampling_rate(negative_sampling_rate)
+        self.dtype = check_dtype(dtype)
 
         # weights between the output and 2nd hidden layer
-        self.w2 = (rng.rand(self.h2 + 1) - .5) * 1e-7
+        self.w2 = ((rng.rand(self.h2 + 1) - .5) * 1e-7).astype(self.dtype)
 
         # weights between the 2nd hidden layer and 1st hidden layer
-        self.w1 = (rng.rand((self.h1 + 1) * self.h2) - .5) * 1e-7
+        self.w1 = ((rng.rand((self.h1 + 1) * self.h2) - .5) * 1e-7).astype(self.dtype)
 
         # weights between the 1st hidden layer and inputs
-        self.w0 = (rng.rand((self.n + 1) * self.h1) - .5) * 1e-7
+        self.w0 = ((rng.rand((self.n + 1) * self.h1) - .5) * 1e-7).astype(self.dtype)
 
         # hidden units in the 2nd hidden layer
         self.z2 = np.zeros((self.h2,), dtype=np.float64)
@@ -94,17 +141,105 @@ cdef class NN_H2:
         # hidden units in the 1st hidden layer
         self.z1 = np.zeros((self.h1,), dtype=np.float64)
 
+        # gradients of the hidden units
+        self.dl_dz1 = np.zeros((self.h1,), dtype=np.float64)
+        self.dl_dz2 = np.zeros((self.h2,), dtype=np.float64)
+
         # counters for the hidden units and inputs
         self.c = 0.
-        self.c2 = np.zeros((self.h2,), dtype=np.float64)
-        self.c1 = np.zeros((self.h1,), dtype=np.float64)
-        self.c0 = np.zeros((self.n,), dtype=np.float64)
-
-    def __repr__(self):                                                         
-        return ('NN_H2(n={}, epoch={}, h1={}, h2={}, a={}, l2={})').format(
-            self.n, self.epoch, self.h1, self.h2, self.a, self.l2
+        self.c2 = np.zeros((self.h2,), dtype=self.dtype)
+        self.c1 = np.zeros((self.h1,), dtype=self.dtype)
+        self.c0 = np.zeros((self.n,), dtype=self.dtype)
+        self._bind_arrays()
+
+    def __repr__(self):
+        return ('NN_H2(n={}, epoch={}, h1={}, h2={}, a={}, l2={}, dtype={}, negative_sampling_rate={})').format(
+            self.n, self.epoch, self.h1, self.h2, self.a, self.l2, self.dtype.name, self.negative_sampling_rate
         )
 
+    def _bind_arrays(self):
+        """Point the weights of the dtype at the arrays."""
+        self.is_float32 = self.dtype == np.float32
+        if self.is_float32:
+            self._w32.w0 = <float*>np.PyArray_DATA(self.w0)
+            self._w32.w1 = <float*>np.PyArray_DATA(self.w1)
+            self._w32.w2 = <float*>np.PyArray_DATA(self.w2)
+            self._w32.c0 = <float*>np.PyArray_DATA(self.c0)
+            self._w32.c1 = <float*>np.PyArray_DATA(self.c1)
+            self._w32.c2 = <float*>np.PyArray_DATA(self.c2)
+        else:
+            self._w64.w0 = <double*>np.PyArray_DATA(self.w0)
+            self._w64.w1 = <double*>np.PyArray_DATA(self.w1)
+            self._w64.w2 = <double*>np.PyArray_DATA(self.w2)
+            self._w64.c0 = <double*>np.PyArray_DATA(self.c0)
+            self._w64.c1 = <double*>np.PyArray_DATA(self.c1)
+            self._w64.c2 = <double*>np.PyArray_DATA(self.c2)
+
+    def save(self, path):
+        """Save the model into a directory that load() can memory-map.
+
+        Args:
+            path (str): a path to the directory to save the model into
+        """
+        save_state(self, path)
+
+    @classmethod
+    def load(cls, path, bint mmap=True):
+        """Load a model saved by save().
+
+        Args:
+            path (str): a path to the directory the model is saved in
+            mmap (boolean): whether to memory-map the weights and counts
+                            copy-on-write instead of reading them
+
+        Returns:
+            a NN_H2 object
+        """
+        return load_state(cls, path, mmap)
+
+    def __reduce__(self):
+        return (restore_state, (self.__class__,) + self._get_state())
+
+    def _get_state(self):
+        params = {'n': self.n,
+                  'epoch': self.epoch,
+                  'h1': self.h1,
+                  'h2': self.h2,
+                  'a': self.a,
+                  'l2': self.l2,
+                  'negative_sampling_rate': self.negative_sampling_rate,
+                  'dtype': self.dtype.name,
+                  'c': self.c}
+        arrays = {'w0': self.w0,
+                  'w1': self.w1,
+                  'w2': self.w2,
+                  'c0': self.c0,
+                  'c1': self.c1,
+                  'c2': self.c2}
+        return params, arrays
+
+    def _set_state(self, dict params, dict arrays):
+        self.n = params['n']
+        self.epoch = params['epoch']
+        self.h1 = params['h1']
+        self.h2 = params['h2']
+        self.a = params['a']
+        self.l2 = params['l2']
+        self.negative_sampling_rate = params['negative_sampling_rate']
+        self.dtype = check_dtype(params['dtype'])
+        self.c = params['c']
+        self.w0 = np.ascontiguousarray(arrays['w0'], dtype=self.dtype)
+        self.w1 = np.ascontiguousarray(arrays['w1'], dtype=self.dtype)
+        self.w2 = np.ascontiguousarray(arrays['w2'], dtype=self.dtype)
+        self.c0 = np.ascontiguousarray(arrays['c0'], dtype=self.dtype)
+        self.c1 = np.ascontiguousarray(arrays['c1'], dtype=self.dtype)
+        self.c2 = np.ascontiguousarray(arrays['c2'], dtype=self.dtype)
+        self._bind_arrays()
+        self.z1 = np.zeros((self.h1,), dtype=np.float64)
+        self.z2 = np.zeros((self.h2,), dtype=np.float64)
+        self.dl_dz1 = np.zeros((self.h1,), dtype=np.float64)
+        self.dl_dz2 = np.zeros((self.h2,), dtype=np.float64)
+
     def read_sparse(self, path):
         """Read the libsvm format sparse file line by line.
 
@@ -112,39 +247,113 @@ cdef class NN_H2:
             path (str): a file path to the libsvm format sparse file
 
         Yields:
-            idx (list of int): a list of index of non-zero features
-            val (list of double): a list of values of non-zero features
+            x (list of tuple): a list of (index, value) of non-zero features
             y (int): target value
         """
-        for line in open(path):
-            xs = line.rstrip().split(' ')
+        for X, y in iter_libsvm(path):
+            for row in range(X.shape[0]):
+                start, end = X.indptr[row], X.indptr[row + 1]
+                yield list(zip((X.indices[start:end] % self.n).tolist(), X.data[start:end].tolist())), int(y[row])
 
-            y = int(xs[0])
-            idx = []
-            val = []
-            for item in xs[1:]:
-                i, v = item.split(':')
-                idx.append(abs(hash(i)) % self.n)
-                val.append(float(v))
+    def fit(self, X, y, sample_weight=None, validation=None):
+        """Update the model with a sparse input feature matrix and its targets.
 
-            yield zip(idx, val), y
+        Args:
+            X (scipy.sparse.csr_matrix): a list of (index, value) of non-zero features
+            y (numpy.array): targets
+            sample_weight (numpy.array): weights of rows. 1 for every row if None
+            validation (ProgressiveValidation): metrics to add the predictions
+                                                of rows before updates to
 
-    def fit(self, X, y):
-        """Update the model with a sparse input feature matrix and its targets.
+        Returns:
+            updated model weights and counts
+        """
+        self._fit(X, y, sample_weight, validation, self.epoch)
+        return self
+
+    def partial_fit(self, X, y, sample_weight=None, validation=None):
+        """Update the model with one pass over a sparse input feature matrix.
 
         Args:
             X (scipy.sparse.csr_matrix): a list of (index, value) of non-zero features
             y (numpy.array): targets
+            sample_weight (numpy.array): weights of rows. 1 for every row if None
+            validation (ProgressiveValidation): metrics to add the predictions
+                                                of rows before updates to
+
+        Returns:
+            updated model weights and counts
+        """
+        self._fit(X, y, sample_weight, validation, 1)
+        return self
+
+    def fit_file(self, path, int chunk_rows=100000, validation=None):
+        """Update the model with a libsvm format sparse file in constant memory.
+
+        The file is parsed in chunks of rows, and the model is updated with
+        each chunk before the next one is read.
+
+        Args:
+            path (str): a file path to the libsvm format sparse file
+            chunk_rows (int): number of rows to parse at a time
+            validation (ProgressiveValidation): metrics to add the predictions
+                                                of rows before updates to
 
         Returns:
             updated model weights and counts
         """
         for epoch in range(self.epoch):
-            for row in range(X.shape[0]):
-                x = zip(X[row].indices, X[row].data)
-                self.update_one(x, self.predict_one(x) - y[row])
+            for X, y in iter_libsvm(path, chunk_rows=chunk_rows):
+                self._fit(X, y, None, validation, 1)
         return self
 
+    cdef _fit(self, X, y, sample_weight, ProgressiveValidation validation, unsigned int n_epoch):
+        """Update the model with a sparse input feature matrix and its targets.
+
+        Args:
+            X (scipy.sparse.csr_matrix): a list of (index, value) of non-zero features
+            y (numpy.array): targets
+            sample_weight (numpy.array): weights of rows, which scale their errors
+                                         and regularization. Rows of weight 0 are skipped
+            validation (ProgressiveValidation): metrics to add the predictions
+                                                of rows before updates to
+            n_epoch (int): number of passes over X
+
+        Returns:
+            updated model weights and counts
+        """
+        cdef unsigned int epoch
+        cdef int row
+        cdef int row_num = X.shape[0]
+        cdef int start
+
+        cdef int[:] indices = check_indices(X.indices, self.n)
+        cdef double[:] data = np.asarray(X.data, dtype=np.float64)
+        cdef int[:] indptr = X.indptr
+        cdef double[:] y_view = np.asarray(y, dtype=np.float64)
+        cdef double[:] weight = check_sample_weight(sample_weight, row_num)
+        cdef double p
+        cdef bint track = validation is not None
+        cdef double* z1 = &self.z1[0]
+        cdef double* z2 = &self.z2[0]
+        cdef double* dl_dz1 = &self.dl_dz1[0]
+        cdef double* dl_dz2 = &self.dl_dz2[0]
+
+        with nogil:
+            for epoch in range(n_epoch):
+                for row in range(row_num):
+                    start = indptr[row]
+                    p = self._predict_row(&indices[start], &data[start], indptr[row + 1] - start, z1, z2)
+                    if weight[row] != 0.:
+                        self._update_row(&indices[start], &data[start], indptr[row + 1] - start,
+                                         (p - y_view[row]) * weight[row], weight[row], z1, z2, dl_dz1, dl_dz2)
+
+                    if track:
+                        validation.add(p, y_view[row], weight[row], self.negative_sampling_rate)
+                        if validation.due():
+                            with gil:
+                                validation.report()
+
     def predict(self, X):
         """Predict for a sparse matrix X.
 
@@ -154,12 +363,26 @@ cdef class NN_H2:
         Returns:
             p (numpy.array): predictions for input features
         """
-
-        p = np.zeros((X.shape[0], ), dtype=np.float64)
-        for row in range(X.shape[0]):
-            p[row] = self.predict_one(zip(X[row].indices, X[row].data))
-
-        return p
+        cdef int row
+        cdef int row_num = X.shape[0]
+        cdef int start
+
+        cdef int[:] indices = check_indices(X.indices, self.n)
+        cdef double[:] data = np.asarray(X.data, dtype=np.float64)
+        cdef int[:] indptr = X.indptr
+        cdef double[:] z1 = np.zeros((self.h1,), dtype=np.float64)
+        cdef double[:] z2 = np.zeros((self.h2,), dtype=np.float64)
+        cdef double[:] p_view
+
+        p = np.zeros((row_num, ), dtype=np.float64)
+        p_view = p
+        with nogil:
+            for row in range(row_num):
+                start = indptr[row]
+                p_view[row] = self._predict_row(&indices[start], &data[start], indptr[row + 1] - start,
+                                                &z1[0], &z2[0])
+
+        return calibrate(p, self.negative_sampling_rate)
 
     def predict_one(self, list x):
         """Predict for features.
@@ -167,118 +390,227 @@ cdef class NN_H2:
         Args:
             x (list of tuple): a list of (index, value) of non-zero features
 
+        Returns:
+            p (double): a prediction for input features
+        """
+        cdef int[:] idx = check_indices([i for i, _ in x], self.n)
+        cdef double[:] val = np.array([v for _, v in x], dtype=np.float64)
+
+        if len(x) == 0:
+            p = self._predict_row(NULL, NULL, 0, &self.z1[0], &self.z2[0])
+        else:
+            p = self._predict_row(&idx[0], &val[0], len(x), &self.z1[0], &self.z2[0])
+        return calibrate(p, self.negative_sampling_rate)
+
+    def update_one(self, list x, double e):
+        """Update the model.
+
+        Args:
+            x (list of tuple): a list of (index, value) of non-zero features
+            e (double): error between the prediction of the model and target
+
+        Returns:
+            updated model weights and counts
+        """
+        cdef int[:] idx = check_indices([i for i, _ in x], self.n)
+        cdef double[:] val = np.array([v for _, v in x], dtype=np.float64)
+
+        if len(x) == 0:
+            self._update_row(NULL, NULL, 0, e, 1., &self.z1[0], &self.z2[0], &self.dl_dz1[0], &self.dl_dz2[0])
+        else:
+            self._update_row(&idx[0], &val[0], len(x), e, 1., &self.z1[0], &self.z2[0],
+                             &self.dl_dz1[0], &self.dl_dz2[0])
+
+    cdef double _predict_row(self, int* idx, double* val, int x_len, double* z1, double* z2) nogil:
+        """Predict for a row with the weights of the dtype."""
+        if self.is_float32:
+            return self._predict_row_typed(&self._w32, idx, val, x_len, z1, z2)
+        return self._predict_row_typed(&self._w64, idx, val, x_len, z1, z2)
+
+    cdef double _predict_row_typed(self, NN_H2Weights* wt, int* idx, double* val, int x_len, double* z1,
+                                   double* z2) nogil:
+        """Predict for a row.
+
+        Weights out of a unit are contiguous in w0 and w1, so they are
+        accumulated into the next layer in one pass per non-zero unit.
+
+        Args:
+            wt (NN_H2Weights*): weights and counters of the model
+            idx (int*): index of non-zero features
+            val (double*): values of non-zero features
+            x_len (int): number of non-zero features
+            z1 (double*): 1st level hidden units to fill in
+            z2 (double*): 2nd level hidden units to fill in
+
         Returns:
             p (double): a prediction for input features
         """
         cdef double p
+        cdef double v
+        cdef int o
         cdef int k
         cdef int j
-        cdef int i
-        cdef double v
+        cdef int l
 
-        # starting from the bias in the 2nd hidden layer
-        p = self.w2[self.h2]
+        # starting with the bias in the input layer
+        for j in range(self.h1):
+            z1[j] = wt.w0[self.n * self.h1 + j]
 
-        # calculating and adding values of 2nd level hidden units
-        for k in range(self.h2):
-            # staring with the bias in the 1st hidden layer
-            self.z2[k] = self.w1[self.h1 * self.h2 + k]
+        # calculating and adding values of input units
+        for l in range(x_len):
+            v = val[l]
+            if v == 0.:
+                continue
 
-            # calculating and adding values of 1st level hidden units
+            o = idx[l] * self.h1
             for j in range(self.h1):
-                # starting with the bias in the input layer
-                self.z1[j] = self.w0[self.n * self.h1 + j]
+                z1[j] += wt.w0[o + j] * v
 
-                # calculating and adding values of input units
-                for i, v in x:
-                    self.z1[j] += self.w0[i * self.h1 + j] * v
+        # staring with the bias in the 1st hidden layer
+        for k in range(self.h2):
+            z2[k] = wt.w1[self.h1 * self.h2 + k]
 
-                # apply the ReLU activation function to the first level hidden unit
-                self.z1[j] = self.z1[j] if self.z1[j] > 0. else 0.
+        # calculating and adding values of 1st level hidden units
+        for j in range(self.h1):
+            # apply the ReLU activation function to the first level hidden unit
+            if z1[j] <= 0.:
+                z1[j] = 0.
+                continue
 
-                self.z2[k] += self.w1[j * self.h2 + k] * self.z1[j]
+            o = j * self.h2
+            for k in range(self.h2):
+                z2[k] += wt.w1[o + k] * z1[j]
 
-            # apply the ReLU activation function to the 2nd level hidden unit
-            self.z2[k] = self.z2[k] if self.z2[k] > 0. else 0.
+        # starting from the bias in the 2nd hidden layer
+        p = wt.w2[self.h2]
 
-            p += self.w2[k] * self.z2[k]
+        # apply the ReLU activation function to the 2nd level hidden units
+        for k in range(self.h2):
+            z2[k] = z2[k] if z2[k] > 0. else 0.
+            p += wt.w2[k] * z2[k]
 
         # apply the sigmoid activation function to the output unit
         return sigm(p)
 
-    def update_one(self, list x, double e):
-        """Update the model.
+    cdef void _update_row(self, int* idx, double* val, int x_len, double e, double weight, double* z1,
+                          double* z2, double* dl_dz1, double* dl_dz2) nogil:
+        """Update the model with a row with the weights of the dtype."""
+        if self.is_float32:
+            self._update_row_typed(&self._w32, idx, val, x_len, e, weight, z1, z2, dl_dz1, dl_dz2)
+        else:
+            self._update_row_typed(&self._w64, idx, val, x_len, e, weight, z1, z2, dl_dz1, dl_dz2)
 
-        Args:
-            x (list of tuple): a list of (index, value) of non-zero features
-            e (double): error between the prediction of the model and target
+    cdef void _update_row_typed(self, NN_H2Weights* wt, int* idx, double* val, int x_len, double e,
+                                double weight, double* z1, double* z2, double* dl_dz1, double* dl_dz2) nogil:
+        """Update the model with a row.
 
-        Returns:
-            updated model weights and counts
+        Gradients of hidden units are accumulated first, so that weights out
+        of each unit are updated in one pass over their contiguous block.
+
+        Args:
+            wt (NN_H2Weights*): weights and counters of the model
+            idx (int*): index of non-zero features
+            val (double*): values of non-zero features
+            x_len (int): number of non-zero features
+            e (double): error between the prediction of the model and target,
+                        scaled by the weight of the row
+            weight (double): weight of the row, which scales the L2
+                             regularization as well
+            z1 (double*): 1st level hidden units filled in by _predict_row()
+            z2 (double*): 2nd level hidden units filled in by _predict_row()
+            dl_dz1 (double*): scratch buffer for h1 gradients of 1st level hidden units
+            dl_dz2 (double*): scratch buffer for h2 gradients of 2nd level hidden units
         """
         cdef int k
         cdef int j
         cdef int i
+        cdef int l
+        cdef double v
         cdef double dl_dy
-        cdef double dl_dz1
-        cdef double dl_dz2
         cdef double dl_dw0
         cdef double dl_dw1
         cdef double dl_dw2
-        cdef double v
+        cdef double lr
+        cdef double g2
+        cdef int o
+        cdef double l2 = self.l2 * weight
 
-        # XXX: assuming predict() was called right before with the same idx and
-        # val inputs.  Otherwise self.z will be incorrect for updates.
         dl_dy = e      # dl/dy * (initial learning rate)
 
         # starting with the bias in the 2nd hidden layer
-        self.w2[self.h2] -= (dl_dy + self.l2 * self.w2[self.h2]) * self.a / (sqrt(self.c) + 1)
+        wt.w2[self.h2] -= (dl_dy + l2 * wt.w2[self.h2]) * self.a / (sqrt(self.c) + 1)
         for k in range(self.h2):
             # update weights related to non-zero 2nd level hidden units
-            if self.z2[k] == 0.:
+            if z2[k] == 0.:
+                dl_dz2[k] = 0.
                 continue
 
             # update weights between the 2nd hidden units and output
             # dl/dw2 = dl/dy * dy/dw2 = dl/dy * z2
-            dl_dw2 = dl_dy * self.z2[k]
-            self.w2[k] -= (dl_dw2 + self.l2 * self.w2[k]) * self.a / (sqrt(self.c2[k]) + 1)
+            dl_dw2 = dl_dy * z2[k]
+            wt.w2[k] -= (dl_dw2 + l2 * wt.w2[k]) * self.a / (sqrt(wt.c2[k]) + 1)
 
             # starting with the bias in the 1st hidden layer
             # dl/dz2 = dl/dy * dy/dz2 = dl/dy * w2
-            dl_dz2 = dl_dy * self.w2[k]
-            self.w1[self.h1 * self.h2 + k] -= (dl_dz2 +
-                                               self.l2 * self.w1[self.h1 * self.h2 + k]) * self.a / (sqrt(self.c2[k]) + 1)
-            for j in range(self.h1):
-                # update weights realted to non-zero hidden units
-                if self.z1[j] == 0.:
+            dl_dz2[k] = dl_dy * wt.w2[k]
+            wt.w1[self.h1 * self.h2 + k] -= (dl_dz2[k] +
+                                               l2 * wt.w1[self.h1 * self.h2 + k]) * self.a / (sqrt(wt.c2[k]) + 1)
+
+            # update counter for the 2nd level hidden unit k
+            wt.c2[k] += dl_dw2 * dl_dw2
+
+        for j in range(self.h1):
+            # update weights realted to non-zero hidden units
+            dl_dz1[j] = 0.
+            if z1[j] == 0.:
+                continue
+
+            o = j * self.h2
+            lr = self.a / (sqrt(wt.c1[j]) + 1)
+            g2 = 0.
+            for k in range(self.h2):
+                if z2[k] == 0.:
                     continue
 
-                # update weights between the hidden units and output
+                # update weights between the 1st and 2nd hidden units
                 # dl/dw1 = dl/dz2 * dz2/dw1 = dl/dz2 * z1
-                dl_dw1 = dl_dz2 * self.z1[j]
-                self.w1[j * self.h2 + k] -= (dl_dw1 + self.l2 * self.w1[j]) * self.a / (sqrt(self.c1[j]) + 1)
+                dl_dw1 = dl_dz2[k] * z1[j]
+                wt.w1[o + k] -= (dl_dw1 + l2 * wt.w1[o + k]) * lr
+                g2 += dl_dw1 * dl_dw1
 
-                # starting with the bias in the input layer
                 # dl/dz1 = dl/dz2 * dz2/dz1 = dl/dz2 * w1
-                dl_dz1 = dl_dz2 * self.w1[j * self.h2 + k]
-                self.w0[self.n * self.h1 + j] -= (dl_dz1 +
-                                                  self.l2 * self.w0[self.n * self.h1 + j]) * self.a / (sqrt(self.c1[j]) + 1)
-                # update weights related to non-zero input units
-                for i, v in x:
-                    # update weights between the hidden unit j and input i
-                    # dl/dw0 = dl/dz1 * dz/dw0 = dl/dz1 * v
-                    dl_dw0 = dl_dz1 * v
-                    self.w0[i * self.h1 + j] -= (dl_dw0 +
-                                                 self.l2 * self.w0[i * self.h1 + j]) * self.a / (sqrt(self.c0[i]) + 1)
-
-                    # update counter for the input i
-                    self.c0[i] += dl_dw0 * dl_dw0
-
-                # update counter for the 1st level hidden unit j
-                self.c1[j] += dl_dw1 * dl_dw1
+                dl_dz1[j] += dl_dz2[k] * wt.w1[o + k]
 
-            # update counter for the 2nd level hidden unit k
-            self.c2[k] += dl_dw2 * dl_dw2
+            # starting with the bias in the input layer
+            wt.w0[self.n * self.h1 + j] -= (dl_dz1[j] +
+                                              l2 * wt.w0[self.n * self.h1 + j]) * lr
+
+            # update counter for the 1st level hidden unit j
+            wt.c1[j] += g2
+
+        # update weights related to non-zero input units, whose hidden weights
+        # are contiguous in w0
+        for l in range(x_len):
+            i = idx[l]
+            v = val[l]
+            if v == 0.:
+                continue
+
+            o = i * self.h1
+            lr = self.a / (sqrt(wt.c0[i]) + 1)
+            g2 = 0.
+            for j in range(self.h1):
+                if z1[j] == 0.:
+                    continue
+
+                # update weights between the hidden unit j and input i
+                # dl/dw0 = dl/dz1 * dz/dw0 = dl/dz1 * v
+                dl_dw0 = dl_dz1[j] * v
+                wt.w0[o + j] -= (dl_dw0 + l2 * wt.w0[o + j]) * lr
+                g2 += dl_dw0 * dl_dw0
+
+            # update counter for the input i
+            wt.c0[i] += g2
 
         # update overall counter
         self.c += dl_dy * dl_dy
@@ -0,0 +1,154 @@
+from multiprocessing import Pool, cpu_count
+import numpy as np
+import os
+import tempfile
+
+from .._libsvm import iter_libsvm
+from ._state import check_n_jobs, restore_state
+from .ftrl import FTRL
+from .sgd import SGD
+
+
+def _ftrl_weights(params, w, c):
+    """Return the lazy weights of FTRL from its accumulated gradients and counters."""
+    shrunk = np.sign(w) * np.maximum(np.abs(w) - params['l1'], 0.)
+    return -shrunk / ((params['b'] + np.sqrt(c)) / params['a'] + params['l2'])
+
+
+def _ftrl_accumulators(params, z, c, w):
+    """Return the accumulated gradients of FTRL that give the lazy weights z with the counters c.
+
+    Features with zero lazy weights keep w clipped into [-l1, l1], where the
+    lazy weights stay zero.
+    """
+    l1 = params['l1']
+    return np.where(z == 0.,
+                    np.clip(w, -l1, l1),
+                    -z * ((params['b'] + np.sqrt(c)) / params['a'] + params['l2']) - np.sign(z) * l1)
+
+
+def merge(models, weights=None, base=None):
+    """Merge online models trained in parallel into one model.
+
+    Weights the models predict with are averaged, and the counters of the
+    AdaGrad learning rates are summed, so the merged model continues with the
+    learning rates of the data seen by all models.
+
+    Args:
+        models (list of FTRL or SGD): models with the same hyperparameters
+        weights (list of float): weights of the models in the average.
+                                 Models are weighted equally if None
+        base (FTRL or SGD): a model all models were trained from.  Counters
+                            of the base are counted once instead of once per
+                            model if given
+
+    Returns:
+        a merged model of the same class as the models
+    """
+    if len(models) == 0:
+        raise ValueError('no models to merge')
+
+    cls = type(models[0])
+    if cls not in (FTRL, SGD):
+        raise TypeError('merge() supports FTRL and SGD models, not {}'.format(cls.__name__))
+
+    params = models[0]._get_state()[0]
+    states = [model._get_state() for model in models]
+    if base is not None:
+        states.append(base._get_state())
+    for model, (model_params, _) in zip(list(models) + [base], states):
+        if type(model) != cls or model_params != params:
+            raise ValueError('models to merge should have the same class and hyperparameters')
+
+    if weights is None:
+        weights = np.ones(len(models))
+    weights = np.asarray(weights, dtype=np.float64)
+    if weights.shape != (len(models),) or (weights < 0).any() or weights.sum() == 0:
+        raise ValueError('weights should be {} non-negative numbers with a positive sum'.format(len(models)))
+    weights = weights / weights.sum()
+
+    # sum the counters of updates on top of the base
+    c = sum(arrays['c'].astype(np.float64) for _, arrays in states[:len(models)])
+    if base is not None:
+        c -= (len(models) - 1) * states[-1][1]['c'].astype(np.float64)
+
+    w = sum(weight * arrays['w'].astype(np.float64) for weight, (_, arrays) in zip(weights, states))
+    arrays = {'w': w, 'c': c}
+    if cls is FTRL:
+        # average the lazy weights, and invert them with the merged counters
+        z = sum(weight * _ftrl_weights(params, model_arrays['w'].astype(np.float64),
+                                       model_arrays['c'].astype(np.float64))
+                for weight, (_, model_arrays) in zip(weights, states))
+        arrays = {'w': _ftrl_accumulators(params, z, c, w), 'c': c, 'z': z}
+
+    return restore_state(cls, params, arrays)
+
+
+def _fit_shard(args):
+    """Update a model loaded from a path with libsvm files, and save it into another path.
+
+    Returns:
+        the number of rows the model is updated with
+    """
+    cls, model_path, files, out_path, chunk_rows = args
+    model = cls.load(model_path, mmap=True)
+
+    row_num = 0
+    for path in files:
+        for X, y in iter_libsvm(path, chunk_rows=chunk_rows):
+            model.partial_fit(X, y)
+            row_num += X.shape[0]
+
+    model.save(out_path)
+    return row_num
+
+
+def parallel_fit(model, files, n_workers=-1, chunk_rows=100000):
+    """Update a model with libsvm files in parallel processes.
+
+    Files are split into a shard per worker process.  In each epoch, every
+    worker updates a copy of the model with its shard, and the copies are
+    merged with weights proportional to their numbers of rows.  The merged
+    model is saved into a temporary directory that workers memory-map
+    copy-on-write, so its pages are shared instead of copied per worker.
+
+    Unlike Hogwild training, the result does not depend on the scheduling of
+    the workers.
+
+    Args:
+        model (FTRL or SGD): a model to start from
+        files (list of str): file paths to the libsvm format sparse files
+        n_workers (int): number of worker processes. -1 uses all CPUs
+        chunk_rows (int): number of rows to parse at a time
+
+    Returns:
+        a merged model updated with the files
+    """
+    if len(files) == 0:
+        raise ValueError('no files to fit')
+
+    if check_n_jobs(n_workers, 'n_workers') == -1:
+        n_workers = cpu_count()
+    n_workers = min(n_workers, len(files))
+    shards = [files[i::n_workers] for i in range(n_workers)]
+    cls = type(model)
+    epoch = model._get_state()[0]['epoch']
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        model_path = os.path.join(tmp_dir, 'model0')
+        model.save(model_path)
+
+        with Pool(n_workers) as pool:
+            for i in range(epoch):
+                out_paths = [os.path.join(tmp_dir, 'epoch{}_worker{}'.format(i, j)) for j in range(n_workers)]
+                row_nums = pool.map(_fit_shard, [(cls, model_path, shard, out_path, chunk_rows)
+                                                 for shard, out_path in zip(shards, out_paths)])
+                model = merge([cls.load(out_path) for out_path in out_paths], row_nums,
+                              base=cls.load(model_path))
+
+                # save the merged model into a new directory, as the previous
+                # one may still be memory-mapped
+                model_path = os.path.join(tmp_dir, 'model{}'.format(i + 1))
+                model.save(model_path)
+
+    return model
@@ -0,0 +1,16 @@
+cdef class ProgressiveValidation:
+    cdef object callback
+    cdef long every
+    cdef int n_buckets
+    cdef long n_rows
+    cdef long next_report
+    cdef double loss
+    cdef double weight
+    cdef double[::1] pos
+    cdef double[::1] neg
+    cdef double start_time
+
+    cdef void add(self, double p, double y, double weight, double rate) nogil
+    cdef void add_rows(self, double* p, double* y, double* weight, int n, double rate) nogil
+    cdef bint due(self) nogil
+    cpdef report(self)
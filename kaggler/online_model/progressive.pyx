@@ -0,0 +1,150 @@
+# cython: boundscheck=False
+# cython: wraparound=False
+# cython: cdivision=True
+from logging import getLogger
+import numpy as np
+import time
+
+from ..const import EPS
+
+cimport cython
+from libc.math cimport log
+from ..util cimport fmax, fmin
+
+
+logger = getLogger(__name__)
+cdef double eps = EPS      # bound of predictions in the logloss
+
+
+cdef class ProgressiveValidation:
+    """Progressive validation metrics of an online learner during training.
+
+    Each row is predicted before the model is updated with it, so the
+    predictions made in the fit loop are out-of-sample.  They are accumulated
+    into the logloss, and the histograms of predictions of positive and
+    negative rows for an approximate AUC, without another pass over the data.
+    Predictions of models trained with negative rows downsampled are
+    calibrated as the predictions of predict() are.
+
+    Attributes:
+        callback (function): a function called with the metrics every
+                             `every` rows.  Metrics are logged if None
+        every (int): number of rows between reports
+        n_buckets (int): number of buckets of predictions for AUC
+        n_rows (int): number of rows predicted so far
+    """
+
+    def __init__(self, callback=None, long every=100000, int n_buckets=1000):
+        """Initialize the ProgressiveValidation class object.
+
+        Args:
+            callback (function): a function called with the metrics every
+                                 `every` rows.  Metrics are logged if None
+            every (int): number of rows between reports
+            n_buckets (int): number of buckets of predictions for AUC
+        """
+        if every < 1 or n_buckets < 1:
+            raise ValueError('every and n_buckets should be positive')
+
+        self.callback = callback
+        self.every = every
+        self.n_buckets = n_buckets
+        self.reset()
+
+    def __repr__(self):
+        return 'ProgressiveValidation(every={}, n_buckets={}, n_rows={})'.format(
+            self.every, self.n_buckets, self.n_rows
+        )
+
+    def reset(self):
+        """Clear the metrics and restart the timer."""
+        self.n_rows = 0
+        self.next_report = self.every
+        self.loss = 0.
+        self.weight = 0.
+        self.pos = np.zeros((self.n_buckets,), dtype=np.float64)
+        self.neg = np.zeros((self.n_buckets,), dtype=np.float64)
+        self.start_time = time.time()
+
+    cdef void add(self, double p, double y, double weight, double rate) nogil:
+        """Add the prediction of a row made before the model is updated with it.
+
+        Args:
+            p (double): a prediction for the row
+            y (double): the target of the row
+            weight (double): the weight of the row
+            rate (double): the rate of negative rows kept in the training
+                           data, which the prediction is calibrated for
+        """
+        cdef int bucket
+
+        self.n_rows += 1
+        if weight == 0.:
+            return
+
+        if rate < 1.:
+            p = p / (p + (1. - p) / rate)
+        bucket = <int>(p * self.n_buckets)
+        bucket = bucket if bucket < self.n_buckets else self.n_buckets - 1
+        p = fmax(fmin(p, 1. - eps), eps)
+        self.weight += weight
+        if y > 0.:
+            self.loss -= weight * log(p)
+            self.pos[bucket] += weight
+        else:
+            self.loss -= weight * log(1. - p)
+            self.neg[bucket] += weight
+
+    cdef void add_rows(self, double* p, double* y, double* weight, int n, double rate) nogil:
+        """Add the predictions of rows made before the model is updated with them.
+
+        Args:
+            p (double*): predictions for the rows
+            y (double*): targets of the rows
+            weight (double*): weights of the rows
+            n (int): number of rows
+            rate (double): the rate of negative rows kept in the training
+                           data, which the predictions are calibrated for
+        """
+        cdef int i
+
+        for i in range(n):
+            self.add(p[i], y[i], weight[i], rate)
+
+    cdef bint due(self) nogil:
+        """Return whether `every` rows are added since the last report."""
+        return self.n_rows >= self.next_report
+
+    def metrics(self):
+        """Return the metrics of the rows added so far.
+
+        Returns:
+            a dict of the number of rows, logloss, AUC from the histograms of
+            predictions, and rows per second since the start
+        """
+        cdef int i
+        cdef double n_neg = 0.
+        cdef double auc = 0.
+
+        # pairs of a positive and a negative row in the same bucket count half
+        for i in range(self.n_buckets):
+            auc += self.pos[i] * (n_neg + .5 * self.neg[i])
+            n_neg += self.neg[i]
+
+        n_pos = np.sum(self.pos)
+        return {'rows': self.n_rows,
+                'logloss': self.loss / self.weight if self.weight > 0. else np.nan,
+                'auc': auc / (n_pos * n_neg) if n_pos > 0. and n_neg > 0. else np.nan,
+                'rows_per_sec': self.n_rows / max(time.time() - self.start_time, EPS)}
+
+    cpdef report(self):
+        """Report the metrics to the callback, and schedule the next report."""
+        metrics = self.metrics()
+        if self.callback is None:
+            logger.info('rows: {rows}, logloss: {logloss:.6f}, auc: {auc:.6f}, '
+                        'rows/sec: {rows_per_sec:.0f}'.format(**metrics))
+        else:
+            self.callback(metrics)
+
+        while self.next_report <= self.n_rows:
+            self.next_report += self.every
@@ -0,0 +1,127 @@
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import cpu_count
+import numpy as np
+
+from ._sampling import check_sample_weight
+from .classification_tree import ClassificationTree
+
+
+class OnlineRandomForest(object):
+    """Online random forest of Hoeffding trees.
+
+    Each tree sees each row a Poisson(1) number of times, the online
+    counterpart of bootstrap sampling (Oza and Russell, 2001), and selects
+    number_of_functions random features for each leaf.  Trees are updated
+    and predict across n_jobs threads, as they release the GIL.
+
+    Attributes:
+        n_estimators (int): number of trees
+        n_jobs (int): number of threads. -1 uses all CPUs
+        trees (list of ClassificationTree): trees of the forest
+    """
+
+    def __init__(self,
+                 number_of_features,
+                 n_estimators=10,
+                 number_of_functions=None,
+                 min_sample_split=200,
+                 n_classes=2,
+                 n_bins=32,
+                 max_depth=20,
+                 delta=1e-7,
+                 tau=.05,
+                 n_jobs=-1,
+                 random_state=None):
+        """Initialize the OnlineRandomForest class object.
+
+        Args:
+            number_of_features (int): number of features
+            n_estimators (int): number of trees
+            number_of_functions (int): number of features randomly selected
+                                       for each leaf. The square root of
+                                       number_of_features if None
+            min_sample_split (int): number of rows between split attempts of a leaf
+            n_classes (int): number of classes
+            n_bins (int): number of bins of the histograms
+            max_depth (int): maximum depth of leaves
+            delta (double): probability of choosing a wrong split
+            tau (double): Hoeffding bound under which ties are split
+            n_jobs (int): number of threads. -1 uses all CPUs
+            random_state (int): seed of the bootstrap and feature selection
+        """
+        if n_estimators < 1:
+            raise ValueError('n_estimators should be positive')
+        if number_of_functions is None:
+            number_of_functions = max(1, int(np.sqrt(number_of_features)))
+
+        self.n_estimators = n_estimators
+        self.n_classes = n_classes
+        self.n_jobs = n_jobs
+        self._rng = np.random.RandomState(random_state)
+        self.trees = [ClassificationTree(number_of_features, number_of_functions, min_sample_split, n_classes,
+                                         n_bins, max_depth, delta, tau, self._rng.randint(2**31))
+                      for _ in range(n_estimators)]
+
+    def __repr__(self):
+        return 'OnlineRandomForest(n_estimators={}, n_jobs={}, tree={})'.format(
+            self.n_estimators, self.n_jobs, self.trees[0]
+        )
+
+    def _map(self, func, *args):
+        n_jobs = self.n_jobs if self.n_jobs > 0 else cpu_count()
+        if n_jobs == 1:
+            return list(map(func, *args))
+
+        with ThreadPoolExecutor(max_workers=min(n_jobs, self.n_estimators)) as executor:
+            return list(executor.map(func, *args))
+
+    def update(self, x, y, sample_weight=None):
+        """Update the trees with a row or a batch of rows.
+
+        Args:
+            x (numpy.array): features of a row, or a 2D array of rows
+            y (int or numpy.array): the class of the row, or classes of rows
+            sample_weight (numpy.array): weights of rows
+
+        Returns:
+            the updated model
+        """
+        X = self.trees[0]._check_input(x)
+        y = np.atleast_1d(np.asarray(y)).astype(np.int32)
+        sample_weight = check_sample_weight(sample_weight, X.shape[0])
+
+        # draw the bootstrap weights of all trees up front, so they do not
+        # depend on the scheduling of threads
+        weights = self._rng.poisson(1., size=(self.n_estimators, X.shape[0])) * sample_weight
+        self._map(lambda tree, weight: tree.update(X, y, weight), self.trees, weights)
+        return self
+
+    def predict_proba(self, x):
+        """Predict class probabilities for a row or a batch of rows by votes of the trees.
+
+        Args:
+            x (numpy.array): features of a row, or a 2D array of rows
+
+        Returns:
+            p (numpy.array): fractions of the trees voting for each class for
+                             the row, or for each row
+        """
+        X = self.trees[0]._check_input(x)
+        votes = np.zeros((X.shape[0], self.n_classes))
+        for p in self._map(lambda tree: tree.predict(X), self.trees):
+            votes[np.arange(X.shape[0]), p] += 1.
+        votes /= self.n_estimators
+
+        return votes[0] if np.ndim(x) == 1 else votes
+
+    def predict(self, x):
+        """Predict the class of a row or classes of a batch of rows by majority vote.
+
+        Args:
+            x (numpy.array): features of a row, or a 2D array of rows
+
+        Returns:
+            p (int or numpy.array): the class with the most votes for the row,
+                                    or for each row
+        """
+        return np.argmax(self.predict_proba(x), axis=-1)
@@ -2,16 +2,37 @@
 # cython: wraparound=False
 # cython: cdivision=True
 import numpy as np
+from .._libsvm import iter_libsvm
+from ._sampling import calibrate, check_negative_sampling_rate, check_sample_weight
+from ._state import check_dtype, save_state, load_state, restore_state
 
 cimport cython
-from libc.math cimport sqrt, abs
+from libc.math cimport sqrt
+from libc.stdlib cimport malloc, realloc, free
 from ..util cimport sigm
+from .progressive cimport ProgressiveValidation
+from ._hashing cimport n_hashed_indices, hash_indices
 cimport numpy as np
 
 
 np.import_array()
 
 
+cdef struct SGDWeights32:
+    float* w
+    float* c
+
+
+cdef struct SGDWeights64:
+    double* w
+    double* c
+
+
+ctypedef fused SGDWeights:
+    SGDWeights32
+    SGDWeights64
+
+
 cdef class SGD:
     """Simple online learner using a hasing trick.
 
@@ -21,18 +42,34 @@ cdef class SGD:
         a (double): initial learning rate
         l1 (double): L1 regularization parameter
         l2 (double): L2 regularization parameter
-        w (array of double): feature weights
-        c (array of double): counters for weights
+        w (array of float or double): feature weights
+        c (array of float or double): counters for weights
         interaction (boolean): whether to use 2nd order interaction or not
+        dtype (numpy.dtype): float32 or float64 for weights and counters
+        negative_sampling_rate (double): rate of negative rows kept in the training data
     """
     cdef unsigned int epoch
     cdef unsigned int n
     cdef double a
     cdef double l1
     cdef double l2
-    cdef double[:] w
-    cdef double[:] c
     cdef bint interaction
+    cdef double negative_sampling_rate
+    cdef object dtype
+    cdef bint is_float32
+    cdef np.ndarray w
+    cdef np.ndarray c
+    cdef SGDWeights32 _w32      # pointers to the arrays if dtype is float32
+    cdef SGDWeights64 _w64      # pointers to the arrays if dtype is float64
+    cdef int* _buf      # reusable buffer for the hashed indices of a row
+    cdef int _buf_size
+
+    def __cinit__(self):
+        self._buf = NULL
+        self._buf_size = 0
+
+    def __dealloc__(self):
+        free(self._buf)
 
     def __init__(self,
                  double a=0.01,
@@ -40,7 +77,9 @@ cdef class SGD:
                  double l2=0.0,
                  unsigned int n=2**20,
                  unsigned int epoch=10,
-                 bint interaction=True):
+                 bint interaction=True,
+                 dtype=np.float64,
+                 negative_sampling_rate=1.):
         """Initialize the SGD class object.
 
         Args:
@@ -52,6 +91,12 @@ cdef class SGD:
             w (array of double): feature weights
             c (array of double): counters for weights
             interaction (boolean): whether to use 2nd order interaction or not
+            dtype (numpy.dtype): float32 or float64 for weights and counters.
+                                 float32 halves the memory of the model
+            negative_sampling_rate (double): rate of negative rows kept in the
+                                             training data, e.g. by
+                                             util.get_downsampled_index0().
+                                             Predictions are corrected for it
         """
 
         self.epoch = epoch
@@ -60,33 +105,107 @@ cdef class SGD:
         self.l1 = l1
         self.l2 = l2
 
-        # initialize weights and counts
-        self.w = np.zeros((self.n + 1,), dtype=np.float64)
-        self.c = np.zeros((self.n + 1,), dtype=np.float64)
         self.interaction = interaction
+        self.negative_sampling_rate = check_negative_sampling_rate(negative_sampling_rate)
+        self.dtype = check_dtype(dtype)
+
+        # initialize weights and counts
+        self.w = np.zeros((self.n + 1,), dtype=self.dtype)
+        self.c = np.zeros((self.n + 1,), dtype=self.dtype)
+        self._bind_arrays()
 
     def __repr__(self):
-        return ('SGD(a={}, l1={}, l2={}, n={}, epoch={}, interaction={})').format(
-            self.a, self.l1, self.l2, self.n, self.epoch, self.interaction
+        return ('SGD(a={}, l1={}, l2={}, n={}, epoch={}, interaction={}, dtype={}, '
+                'negative_sampling_rate={})').format(
+            self.a, self.l1, self.l2, self.n, self.epoch, self.interaction, self.dtype.name,
+            self.negative_sampling_rate
         )
 
-    def _indices(self, list x):
-        cdef unsigned int index
-        cdef int l
-        cdef int i
-        cdef int j
+    def _bind_arrays(self):
+        """Point the weights of the dtype at the arrays."""
+        self.is_float32 = self.dtype == np.float32
+        if self.is_float32:
+            self._w32.w = <float*>np.PyArray_DATA(self.w)
+            self._w32.c = <float*>np.PyArray_DATA(self.c)
+        else:
+            self._w64.w = <double*>np.PyArray_DATA(self.w)
+            self._w64.c = <double*>np.PyArray_DATA(self.c)
 
-        yield self.n
+    def save(self, path):
+        """Save the model into a directory that load() can memory-map.
 
-        for index in x:
-            yield abs(hash(index)) % self.n
+        Args:
+            path (str): a path to the directory to save the model into
+        """
+        save_state(self, path)
+
+    @classmethod
+    def load(cls, path, bint mmap=True):
+        """Load a model saved by save().
 
-        if self.interaction:
-            l = len(x)
-            x = sorted(x)
-            for i in xrange(l):
-                for j in xrange(i + 1, l):
-                    yield abs(hash('{}_{}'.format(x[i], x[j]))) % self.n
+        Args:
+            path (str): a path to the directory the model is saved in
+            mmap (boolean): whether to memory-map the weights and counts
+                            copy-on-write instead of reading them
+
+        Returns:
+            a SGD object
+        """
+        return load_state(cls, path, mmap)
+
+    def __reduce__(self):
+        return (restore_state, (self.__class__,) + self._get_state())
+
+    def _get_state(self):
+        params = {'a': self.a,
+                  'l1': self.l1,
+                  'l2': self.l2,
+                  'n': self.n,
+                  'epoch': self.epoch,
+                  'interaction': self.interaction,
+                  'negative_sampling_rate': self.negative_sampling_rate,
+                  'dtype': self.dtype.name}
+        arrays = {'w': self.w, 'c': self.c}
+        return params, arrays
+
+    def _set_state(self, dict params, dict arrays):
+        self.a = params['a']
+        self.l1 = params['l1']
+        self.l2 = params['l2']
+        self.n = params['n']
+        self.epoch = params['epoch']
+        self.interaction = params['interaction']
+        self.negative_sampling_rate = params['negative_sampling_rate']
+        self.dtype = check_dtype(params['dtype'])
+        self.w = np.ascontiguousarray(arrays['w'], dtype=self.dtype)
+        self.c = np.ascontiguousarray(arrays['c'], dtype=self.dtype)
+        self._bind_arrays()
+
+    cdef int* _buffer(self, int x_len) except NULL:
+        """Return the index buffer, growing it to fit a row with x_len features."""
+        cdef int size = n_hashed_indices(x_len, self.interaction)
+        cdef int* buf
+
+        if size > self._buf_size:
+            buf = <int*>realloc(self._buf, size * sizeof(int))
+            if buf == NULL:
+                raise MemoryError()
+            self._buf = buf
+            self._buf_size = size
+        return self._buf
+
+    cdef int _indices(self, int* x, int x_len, int* indices) nogil:
+        """Hash features into the index buffer with murmurhash3.
+
+        Args:
+            x (int*): index of non-zero features
+            x_len (int): number of non-zero features
+            indices (int*): buffer with room for the hashed indices of the row
+
+        Returns:
+            the number of indices written into the buffer
+        """
+        return hash_indices(x, x_len, self.n, self.interaction, indices)
 
     def read_sparse(self, path):
         """Apply hashing trick to the libsvm format sparse file.
@@ -98,34 +217,116 @@ cdef class SGD:
             x (list of int): a list of index of non-zero features
             y (int): target value
         """
-        for line in open(path):
-            xs = line.rstrip().split(' ')
+        for X, y in iter_libsvm(path):
+            for row in range(X.shape[0]):
+                start, end = X.indptr[row], X.indptr[row + 1]
+                yield (X.indices[start:end] % self.n).tolist(), int(y[row])
 
-            y = int(xs[0])
-            x = []
-            for item in xs[1:]:
-                index, _ = item.split(':')
-                x.append(abs(hash(index)) % self.n)
+    cpdef fit(self, X, y, sample_weight=None, validation=None):
+        """Update the model with a sparse input feature matrix and its targets.
 
-            yield x, y
+        Args:
+            X (scipy.sparse.csr_matrix): a list of (index, value) of non-zero features
+            y (numpy.array): targets
+            sample_weight (numpy.array): weights of rows. 1 for every row if None
+            validation (ProgressiveValidation): metrics to add the predictions
+                                                of rows before updates to
+
+        Returns:
+            updated model weights and counts
+        """
+        self._fit(X, y, sample_weight, validation, self.epoch)
+        return self
+
+    def partial_fit(self, X, y, sample_weight=None, validation=None):
+        """Update the model with one pass over a sparse input feature matrix.
+
+        Args:
+            X (scipy.sparse.csr_matrix): a list of (index, value) of non-zero features
+            y (numpy.array): targets
+            sample_weight (numpy.array): weights of rows. 1 for every row if None
+            validation (ProgressiveValidation): metrics to add the predictions
+                                                of rows before updates to
+
+        Returns:
+            updated model weights and counts
+        """
+        self._fit(X, y, sample_weight, validation, 1)
+        return self
 
-    cpdef fit(self, X, y):
+    def fit_file(self, path, int chunk_rows=100000, validation=None):
+        """Update the model with a libsvm format sparse file in constant memory.
+
+        The file is parsed in chunks of rows, and the model is updated with
+        each chunk before the next one is read.
+
+        Args:
+            path (str): a file path to the libsvm format sparse file
+            chunk_rows (int): number of rows to parse at a time
+            validation (ProgressiveValidation): metrics to add the predictions
+                                                of rows before updates to
+
+        Returns:
+            updated model weights and counts
+        """
+        for epoch in range(self.epoch):
+            for X, y in iter_libsvm(path, chunk_rows=chunk_rows):
+                self._fit(X, y, None, validation, 1)
+        return self
+
+    cdef _fit(self, X, y, sample_weight, ProgressiveValidation validation, unsigned int n_epoch):
         """Update the model with a sparse input feature matrix and its targets.
 
         Args:
             X (scipy.sparse.csr_matrix): a list of (index, value) of non-zero features
             y (numpy.array): targets
+            sample_weight (numpy.array): weights of rows, which scale their errors
+                                         and regularization. Rows of weight 0 are skipped
+            validation (ProgressiveValidation): metrics to add the predictions
+                                                of rows before updates to
+            n_epoch (int): number of passes over X
 
         Returns:
             updated model weights and counts
         """
+        cdef unsigned int epoch
+        cdef int row
+        cdef int row_num = X.shape[0]
+        cdef int indices_num
+        cdef double p
+        cdef bint track = validation is not None
+
         cdef int[:] indices = X.indices
         cdef int[:] indptr = X.indptr
-        for epoch in range(self.epoch):
-            for row in range(X.shape[0]):
-                x = list(indices[indptr[row] : indptr[row + 1]])
-                self.update_one(x, self.predict_one(x) - y[row])
-        return self
+        cdef double[:] y_view = np.asarray(y, dtype=np.float64)
+        cdef double[:] weight = check_sample_weight(sample_weight, row_num)
+        cdef int* buf
+
+        if row_num == 0:
+            return
+
+        # hash each row once into the buffer shared by prediction and update
+        buf = self._buffer(np.diff(X.indptr).max())
+        with nogil:
+            for epoch in range(n_epoch):
+                for row in range(row_num):
+                    indices_num = self._indices(&indices[indptr[row]], indptr[row + 1] - indptr[row], buf)
+                    if self.is_float32:
+                        p = self._predict_indices(&self._w32, buf, indices_num)
+                        if weight[row] != 0.:
+                            self._update_indices(&self._w32, buf, indices_num, (p - y_view[row]) * weight[row],
+                                                 weight[row])
+                    else:
+                        p = self._predict_indices(&self._w64, buf, indices_num)
+                        if weight[row] != 0.:
+                            self._update_indices(&self._w64, buf, indices_num, (p - y_view[row]) * weight[row],
+                                                 weight[row])
+
+                    if track:
+                        validation.add(p, y_view[row], weight[row], self.negative_sampling_rate)
+                        if validation.due():
+                            with gil:
+                                validation.report()
 
     def predict(self, X):
         """Predict for a sparse matrix X.
@@ -136,13 +337,32 @@ cdef class SGD:
         Returns:
             p (numpy.array): predictions for input features
         """
-        p = np.zeros((X.shape[0], ), dtype=np.float64)
-        for row in range(X.shape[0]):
-            p[row] = self.predict_one(list(X[row].indices))
-
-        return p
+        cdef int row
+        cdef int row_num = X.shape[0]
+        cdef int indices_num
 
-    def predict_one(self, list x):
+        cdef int[:] indices = X.indices
+        cdef int[:] indptr = X.indptr
+        cdef int* buf
+        cdef double[:] p_view
+
+        p = np.zeros((row_num, ), dtype=np.float64)
+        if row_num == 0:
+            return p
+
+        p_view = p
+        buf = self._buffer(np.diff(X.indptr).max())
+        with nogil:
+            for row in range(row_num):
+                indices_num = self._indices(&indices[indptr[row]], indptr[row + 1] - indptr[row], buf)
+                if self.is_float32:
+                    p_view[row] = self._predict_indices(&self._w32, buf, indices_num)
+                else:
+                    p_view[row] = self._predict_indices(&self._w64, buf, indices_num)
+
+        return calibrate(p, self.negative_sampling_rate)
+
+    def predict_one(self, x):
         """Predict for features.
 
         Args:
@@ -151,16 +371,16 @@ cdef class SGD:
         Returns:
             p (double): a prediction for input features
         """
-        cdef int i
-        cdef double wTx
-
-        wTx = 0.
-        for i in self._indices(x):
-            wTx += self.w[i]
+        cdef int[:] x_view = np.array(x, dtype=np.int32)
+        cdef int x_len = x_view.shape[0]
+        cdef int* buf = self._buffer(x_len)
+        cdef int indices_num = self._indices(&x_view[0] if x_len > 0 else NULL, x_len, buf)
 
-        return sigm(wTx)
+        if self.is_float32:
+            return calibrate(self._predict_indices(&self._w32, buf, indices_num), self.negative_sampling_rate)
+        return calibrate(self._predict_indices(&self._w64, buf, indices_num), self.negative_sampling_rate)
 
-    def update_one(self, list x, double e):
+    def update_one(self, x, double e):
         """Update the model.
 
         Args:
@@ -170,12 +390,57 @@ cdef class SGD:
         Returns:
             updates model weights and counts
         """
+        cdef int[:] x_view = np.array(x, dtype=np.int32)
+        cdef int x_len = x_view.shape[0]
+        cdef int* buf = self._buffer(x_len)
+        cdef int indices_num = self._indices(&x_view[0] if x_len > 0 else NULL, x_len, buf)
+
+        if self.is_float32:
+            self._update_indices(&self._w32, buf, indices_num, e, 1.)
+        else:
+            self._update_indices(&self._w64, buf, indices_num, e, 1.)
+
+    cdef double _predict_indices(self, SGDWeights* wt, int* indices, int indices_num) nogil:
+        """Predict for hashed indices.
+
+        Args:
+            wt (SGDWeights*): weights and counters of the model
+            indices (int*): hashed indices of a row
+            indices_num (int): number of hashed indices
+
+        Returns:
+            p (double): a prediction for input features
+        """
+        cdef int j
+        cdef double wTx
+
+        wTx = 0.
+        for j in range(indices_num):
+            wTx += wt.w[indices[j]]
+
+        return sigm(wTx)
+
+    cdef void _update_indices(self, SGDWeights* wt, int* indices, int indices_num, double e,
+                              double weight) nogil:
+        """Update the model with hashed indices.
+
+        Args:
+            wt (SGDWeights*): weights and counters of the model
+            indices (int*): hashed indices of a row
+            indices_num (int): number of hashed indices
+            e (double): error between the prediction of the model and target,
+                        scaled by the weight of the row
+            weight (double): weight of the row, which scales the L1 and L2
+                             regularization as well
+        """
         cdef int i
+        cdef int j
         cdef double g2
 
         g2 = e * e
-        for i in self._indices(x):
-            self.w[i] -= (e +
-                          (self.l1 if self.w[i] >= 0. else -self.l1) +
-                          self.l2 * self.w[i]) * self.a / (sqrt(self.c[i]) + 1)
-            self.c[i] += g2
+        for j in range(indices_num):
+            i = indices[j]
+            wt.w[i] -= (e +
+                        ((self.l1 if wt.w[i] >= 0. else -self.l1) +
+                         self.l2 * wt.w[i]) * weight) * self.a / (sqrt(wt.c[i]) + 1)
+            wt.c[i] += g2
@@ -20,6 +20,13 @@ if platform.system() == "Darwin":
     extra_compile_args += ["-mmacosx-version-min=10.9"]
     extra_link_args += ["-mmacosx-version-min=10.9"]
 
+# Apple clang does not ship OpenMP, so prange loops run serially on macOS.
+openmp_compile_args = extra_compile_args
+openmp_link_args = extra_link_args
+if platform.system() != "Darwin":
+    openmp_compile_args = extra_compile_args + ["-fopenmp"]
+    openmp_link_args = extra_link_args + ["-fopenmp"]
+
 
 with open("requirements.txt") as f:
     requirements = f.readlines()
@@ -71,10 +78,11 @@ setup(
                             'kaggler/online_model/murmurhash/MurmurHash3.cpp'],
                            libraries=[],
                            include_dirs=['.'],
-                           extra_compile_args=extra_compile_args,
-                           extra_link_args=extra_link_args),
+                           extra_compile_args=openmp_compile_args,
+                           extra_link_args=openmp_link_args),
                  Extension('kaggler.online_model.sgd',
-                           ['kaggler/online_model/sgd' + ext],
+                           ['kaggler/online_model/sgd' + ext,
+                            'kaggler/online_model/murmurhash/MurmurHash3.cpp'],
                            libraries=[],
                            include_dirs=['.'],
                            extra_compile_args=extra_compile_args,
@@ -83,8 +91,14 @@ setup(
                            ['kaggler/online_model/fm' + ext],
                            libraries=[],
                            include_dirs=['.'],
-                           extra_compile_args=extra_compile_args,
-                           extra_link_args=extra_link_args),
+                           extra_compile_args=openmp_compile_args,
+                           extra_link_args=openmp_link_args),
+                 Extension('kaggler.online_model.ffm',
+                           ['kaggler/online_model/ffm' + ext],
+                           libraries=[],
+                           include_dirs=['.'],
+                           extra_compile_args=openmp_compile_args,
+                           extra_link_args=openmp_link_args),
                  Extension('kaggler.online_model.nn',
                            ['kaggler/online_model/nn' + ext],
                            libraries=[],
@@ -97,12 +111,24 @@ setup(
                            include_dirs=['.'],
                            extra_compile_args=extra_compile_args,
                            extra_link_args=extra_link_args),
+                 Extension('kaggler.online_model.progressive',
+                           ['kaggler/online_model/progressive' + ext],
+                           libraries=[],
+                           include_dirs=['.'],
+                           extra_compile_args=extra_compile_args,
+                           extra_link_args=extra_link_args),
                  Extension('kaggler.online_model._tree',
                            ['kaggler/online_model/_tree' + ext],
                            libraries=[],
                            include_dirs=['.'],
                            extra_compile_args=extra_compile_args,
                            extra_link_args=extra_link_args),
+                 Extension('kaggler._libsvm',
+                           ['kaggler/_libsvm' + ext],
+                           libraries=[],
+                           include_dirs=['.'],
+                           extra_compile_args=openmp_compile_args,
+                           extra_link_args=openmp_link_args),
                  Extension('kaggler.util',
                            ['kaggler/util' + ext, 'kaggler/util.pxd'],
                            libraries=[],
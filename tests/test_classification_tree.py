@@ -1,6 +1,7 @@
 import numpy as np
 import profile
-from kaggler.online_model import ClassificationTree
+import pytest
+from kaggler.online_model import ClassificationTree, OnlineRandomForest
 from tqdm import tqdm
 
 
@@ -31,5 +32,49 @@ def test():
     print(correct_num)
 
 
+
+def test_hoeffding_split():
+    rng = np.random.RandomState(1234)
+    X = rng.rand(20000, N_FEATURE)
+    y = ((X[:, 0] > .5) ^ (X[:, 1] > .3)).astype(int)
+
+    learner = ClassificationTree(number_of_features=N_FEATURE, number_of_functions=N_FEATURE,
+                                 random_state=1234)
+    for i in range(0, 18000, 1000):
+        learner.update(X[i:i + 1000], y[i:i + 1000])
+    assert learner.node_count > 1
+
+    p = learner.predict(X[18000:])
+    assert (p == y[18000:]).mean() > .9
+    assert [learner.predict(x) for x in X[18000:18100]] == list(p[:100])
+    assert np.allclose(learner.predict_proba(X[18000:]).sum(axis=1), 1.)
+
+    with pytest.raises(ValueError):
+        learner.update(X[:10], np.full(10, 2))
+    with pytest.raises(ValueError):
+        ClassificationTree(number_of_features=N_FEATURE, number_of_functions=N_FEATURE + 1)
+
+
+
+def test_online_random_forest():
+    rng = np.random.RandomState(1234)
+    X = rng.rand(20000, N_FEATURE)
+    y = ((X[:, 0] > .5) ^ (X[:, 1] > .3)).astype(int)
+
+    p = []
+    for n_jobs in [1, 4]:
+        forest = OnlineRandomForest(number_of_features=N_FEATURE, n_estimators=8, n_jobs=n_jobs,
+                                    random_state=1234)
+        for i in range(0, 18000, 1000):
+            forest.update(X[i:i + 1000], y[i:i + 1000])
+        p.append(forest.predict_proba(X[18000:]))
+
+    # bootstrap weights do not depend on the scheduling of threads
+    assert np.array_equal(p[0], p[1])
+    assert np.allclose(p[0].sum(axis=1), 1.)
+    assert (forest.predict(X[18000:]) == y[18000:]).mean() > .9
+    assert forest.predict(X[0]) == forest.predict(X[:1])[0]
+
+
 if __name__ == '__main__':
     profile.run("test()")
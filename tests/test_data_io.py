@@ -0,0 +1,304 @@
+import h5py
+import numpy as np
+import os
+import pytest
+from scipy import sparse
+from sklearn.datasets import dump_svmlight_file, load_svmlight_file
+from kaggler.data_io import (iter_csv, iter_feather, iter_hdf5, iter_libsvm, iter_parquet, load_cached, load_csv,
+                             load_data, load_feather, load_hdf5, load_libsvm, load_parquet, load_sparse, save_data, save_feather,
+                             read_sps, save_hdf5, save_parquet, save_sparse)
+from kaggler._libsvm import parse_libsvm
+
+
+N_OBS = 10000
+N_FEATURE = 100
+
+
+@pytest.fixture(scope='module')
+def sparse_data():
+    rng = np.random.RandomState(1234)
+    X = sparse.random(N_OBS, N_FEATURE, density=.1, format='csr', random_state=rng)
+    y = rng.randint(2, size=N_OBS).astype(np.float64)
+    return X, y
+
+
+def assert_same_sparse(X, X_expected):
+    assert X.shape == X_expected.shape
+    assert abs(X - X_expected).max() < 1e-12
+
+
+def test_load_libsvm(sparse_data, tmp_path):
+    X, y = sparse_data
+    path = str(tmp_path / 'data.sps')
+    save_data(X, y, path)
+
+    X_expected, y_expected = load_svmlight_file(path)
+    for n_jobs in [1, 4]:
+        X_loaded, y_loaded = load_libsvm(path, n_jobs=n_jobs)
+        assert_same_sparse(X_loaded, X_expected)
+        assert np.array_equal(y_loaded, y_expected)
+
+    X_loaded, y_loaded = load_data(path)
+    assert_same_sparse(X_loaded, X)
+    assert np.array_equal(y_loaded, y)
+
+
+def test_iter_libsvm(sparse_data, tmp_path):
+    X, y = sparse_data
+    path = str(tmp_path / 'data.sps')
+    dump_svmlight_file(X, y, path, zero_based=True)
+
+    chunks = list(iter_libsvm(path, chunk_rows=3000, n_features=N_FEATURE, block_size=2**16, n_jobs=2))
+    assert [X_chunk.shape[0] for X_chunk, _ in chunks] == [3000, 3000, 3000, 1000]
+    assert_same_sparse(sparse.vstack([X_chunk for X_chunk, _ in chunks]), X)
+    assert np.array_equal(np.concatenate([y_chunk for _, y_chunk in chunks]), y)
+
+    # chunks of many blocks, and many chunks of a block
+    for chunk_rows, block_size in [(7000, 2**12), (70, 2**20)]:
+        chunks = list(iter_libsvm(path, chunk_rows=chunk_rows, n_features=N_FEATURE, block_size=block_size))
+        assert all(X_chunk.shape[0] == chunk_rows for X_chunk, _ in chunks[:-1])
+        assert_same_sparse(sparse.vstack([X_chunk for X_chunk, _ in chunks]), X)
+        assert np.array_equal(np.concatenate([y_chunk for _, y_chunk in chunks]), y)
+
+
+def test_iter_libsvm_format(tmp_path):
+    path = str(tmp_path / 'data.sps')
+    with open(path, 'w') as f:
+        f.write('# comment\n1 qid:3 1:0.5 10:2 # comment\n\n0 2:1e-3\t3:4\r\n-1 5:1')
+
+    (X, y), = list(iter_libsvm(path))
+    assert np.array_equal(y, [1, 0, -1])
+    assert np.array_equal(X.indptr, [0, 2, 4, 5])
+    assert np.array_equal(X.indices, [1, 10, 2, 3, 5])
+    assert np.allclose(X.data, [.5, 2, 1e-3, 4, 1])
+
+    # indptr is parsed in int64, and narrowed to int32 as it fits
+    assert parse_libsvm(open(path, 'rb').read())[0].dtype == np.int64
+    assert X.indptr.dtype == np.int32
+
+    assert list(read_sps(path)) == [([(1, .5), (10, 2.)], 1), ([(2, 1e-3), (3, 4.)], 0), ([(5, 1.)], -1)]
+
+    # values are not read across whitespace or line breaks, and indices should fit in int
+    for lines in ['1 1:0.5\n0 2:a\n', '1 1: 0.5\n', '1 1:\n0 2:1\n', '1 1:\n', '1 {}:1\n'.format(2**31)]:
+        with open(path, 'w') as f:
+            f.write(lines)
+
+        with pytest.raises(ValueError):
+            list(iter_libsvm(path))
+
+
+def test_load_libsvm_fields(tmp_path):
+    path = str(tmp_path / 'data.ffm')
+    with open(path, 'w') as f:
+        f.write('1 0:1:0.5 2:10:2\n0 1:2:1e-3\t1:3:4\r\n-1 3:5:1')
+
+    X, y, fields = load_libsvm(path, zero_based=True, fields=True)
+    assert np.array_equal(y, [1, 0, -1])
+    assert np.array_equal(X.indptr, [0, 2, 4, 5])
+    assert np.array_equal(X.indices, [1, 10, 2, 3, 5])
+    assert np.allclose(X.data, [.5, 2, 1e-3, 4, 1])
+    assert np.array_equal(fields, [0, 2, 1, 1, 3])
+
+    chunks = list(iter_libsvm(path, chunk_rows=2, fields=True))
+    assert [len(chunk_fields) for _, _, chunk_fields in chunks] == [4, 1]
+    assert np.array_equal(np.concatenate([chunk_fields for _, _, chunk_fields in chunks]), fields)
+
+    for lines in ['1 0:1:0.5\n0 2:1\n', '1 0: 1:0.5\n', '1 0:1:\n0 1:2:1\n', '1 {}:1:1\n'.format(2**31)]:
+        with open(path, 'w') as f:
+            f.write(lines)
+
+        with pytest.raises(ValueError):
+            load_libsvm(path, fields=True)
+
+
+@pytest.mark.parametrize('is_sparse', [True, False])
+def test_load_hdf5(sparse_data, is_sparse, tmp_path):
+    X, y = sparse_data
+    X = X if is_sparse else X.toarray()
+    path = str(tmp_path / 'data.h5')
+    save_data(X, y, path)
+
+    rows = [5, 3, 3, 9000]
+    columns = [10, 2, 2, 50]
+    for lazy in [True, False]:
+        for selected in [slice(100, 2000), slice(None, None, 7), rows]:
+            X_loaded, y_loaded = load_hdf5(path, rows=selected, columns=columns, lazy=lazy)
+            X_expected = X[selected][:, columns]
+            assert np.array_equal(X_loaded.toarray() if is_sparse else X_loaded,
+                                  X_expected.toarray() if is_sparse else X_expected)
+            assert np.array_equal(y_loaded, y[selected])
+
+    chunks = list(iter_hdf5(path, chunk_rows=3000))
+    assert [X_chunk.shape[0] for X_chunk, _ in chunks] == [3000, 3000, 3000, 1000]
+    X_loaded = sparse.vstack([X_chunk for X_chunk, _ in chunks]) if is_sparse else \
+        np.vstack([X_chunk for X_chunk, _ in chunks])
+    assert np.array_equal(X_loaded.toarray() if is_sparse else X_loaded, X.toarray() if is_sparse else X)
+    assert np.array_equal(np.concatenate([y_chunk for _, y_chunk in chunks]), y)
+
+
+@pytest.mark.parametrize('is_sparse', [True, False])
+def test_save_hdf5(sparse_data, is_sparse, tmp_path):
+    X, y = sparse_data
+    X = X if is_sparse else X.toarray()
+    to_array = (lambda X: X.toarray()) if is_sparse else np.asarray
+
+    for compression in ['gzip', 'lzf']:
+        path = str(tmp_path / 'data.h5')
+        save_data(X, y, path, compression=compression, dtype=np.float32)
+        with h5py.File(path, 'r') as f:
+            assert f['data'].compression == compression
+            assert f['data'].dtype == np.float32
+
+        X_loaded, y_loaded = load_data(path)
+        assert np.allclose(to_array(X_loaded), to_array(X), atol=1e-6)
+        assert np.array_equal(y_loaded, y)
+
+    # append blocks of rows to the file
+    path = str(tmp_path / 'appended.h5')
+    for start in range(0, N_OBS, 3000):
+        save_hdf5(X[start:start + 3000], y[start:start + 3000], path, compression='gzip', append=True)
+
+    X_loaded, y_loaded = load_hdf5(path)
+    assert np.array_equal(to_array(X_loaded), to_array(X))
+    assert np.array_equal(y_loaded, y)
+
+    with pytest.raises(ValueError):
+        save_hdf5(X[:, :10], y, path, append=True)
+    with pytest.raises(ValueError):
+        save_hdf5(to_array(X) if is_sparse else sparse.csr_matrix(X), y, path, append=True)
+    assert load_hdf5(path)[0].shape == X.shape
+
+
+def test_save_sparse(sparse_data, tmp_path):
+    X, _ = sparse_data
+    path = str(tmp_path / 'data.sparse')
+    for start in range(0, N_OBS, 4000):
+        save_sparse(path, X[start:start + 4000], compression='lzf', append=True)
+    assert_same_sparse(load_sparse(path), X)
+
+    save_sparse(path, X, chunks=False)
+    assert_same_sparse(load_sparse(path), X)
+
+
+def test_save_sparse_int64_indptr(sparse_data, tmp_path):
+    X, _ = sparse_data
+    path = str(tmp_path / 'data.sparse')
+    save_sparse(path, X[:10], append=True)
+    with h5py.File(path, 'a') as f:
+        assert f['indptr'].dtype == np.int64
+        assert f['shape'].dtype == np.int64
+        # pretend the file holds rows with 2**31 non-zero values
+        f['indptr'][-1] = 2**31
+
+    save_sparse(path, X[10:20], append=True)
+    with h5py.File(path, 'r') as f:
+        assert np.array_equal(f['indptr'][11:], 2**31 + X[10:20].indptr[1:])
+        assert tuple(f['shape'][...]) == (20, N_FEATURE)
+
+    # rows that do not fit into an int32 indptr of an old file are not appended
+    with h5py.File(path, 'w') as f:
+        f['shape'] = np.array((1, N_FEATURE))
+        f.create_dataset('indptr', data=np.array([0, 2**31 - 1], dtype=np.int32), maxshape=(None,), chunks=True)
+        f.create_dataset('indices', data=np.zeros(0, dtype=np.int32), maxshape=(None,), chunks=True)
+        f.create_dataset('data', data=np.zeros(0), maxshape=(None,), chunks=True)
+    with pytest.raises(ValueError):
+        save_sparse(path, X[:10], append=True)
+    with h5py.File(path, 'r') as f:
+        assert tuple(f['shape'][...]) == (1, N_FEATURE)
+        assert f['indptr'].shape == (2,)
+
+
+def test_load_csv(sparse_data, tmp_path):
+    X, y = sparse_data
+    path = str(tmp_path / 'data.csv')
+    save_data(X, y, path)
+
+    X_loaded, y_loaded = load_data(path)
+    assert np.allclose(X_loaded, X.toarray(), rtol=1e-11, atol=0)
+    assert np.array_equal(y_loaded, y)
+
+    X_loaded, _ = load_csv(path, float_precision='round_trip')
+    assert np.array_equal(X_loaded, X.toarray())
+
+    X_loaded, y_loaded = load_csv(path, dtype=np.float32, usecols=[10, 2, 2])
+    assert X_loaded.dtype == np.float32
+    assert np.array_equal(X_loaded, X[:, [10, 2, 2]].toarray().astype(np.float32))
+
+    chunks = list(iter_csv(path, chunk_rows=3000, usecols=[5, 7]))
+    assert [X_chunk.shape[0] for X_chunk, _ in chunks] == [3000, 3000, 3000, 1000]
+    assert np.allclose(np.vstack([X_chunk for X_chunk, _ in chunks]), X[:, [5, 7]].toarray(), rtol=1e-11, atol=0)
+    assert np.array_equal(np.concatenate([y_chunk for _, y_chunk in chunks]), y)
+
+    # a header is skipped
+    with open(path, 'w') as f:
+        f.write('target,a,b\n1,0.5,2\n0,3,4\n')
+    X_loaded, y_loaded = load_csv(path, usecols=[1])
+    assert np.array_equal(X_loaded, [[2], [4]])
+    assert np.array_equal(y_loaded, [1, 0])
+
+
+@pytest.mark.parametrize('is_sparse', [True, False])
+@pytest.mark.parametrize('ext', ['.parquet', '.feather'])
+def test_arrow(sparse_data, is_sparse, ext, tmp_path):
+    pytest.importorskip('pyarrow')
+    X, y = sparse_data
+    X = X if is_sparse else X.toarray()
+    to_array = (lambda X: X.toarray()) if is_sparse else np.asarray
+    path = str(tmp_path / ('data' + ext))
+    if ext == '.parquet':
+        save_parquet(X, y, path, row_group_rows=3000)
+        load, chunks = load_parquet, list(iter_parquet(path, chunk_rows=3000, columns=[10, 2, 2]))
+    else:
+        save_feather(X, y, path, chunk_rows=3000)
+        load, chunks = load_feather, list(iter_feather(path, columns=[10, 2, 2]))
+
+    X_loaded, y_loaded = load_data(path)
+    assert np.array_equal(to_array(X_loaded), to_array(X))
+    assert np.array_equal(y_loaded, y)
+
+    X_loaded, y_loaded = load(path, columns=[10, 2, 2])
+    assert np.array_equal(to_array(X_loaded), to_array(X[:, [10, 2, 2]]))
+
+    assert [X_chunk.shape[0] for X_chunk, _ in chunks] == [3000, 3000, 3000, 1000]
+    X_loaded = sparse.vstack([X_chunk for X_chunk, _ in chunks]) if is_sparse else \
+        np.vstack([X_chunk for X_chunk, _ in chunks])
+    assert np.array_equal(to_array(X_loaded), to_array(X[:, [10, 2, 2]]))
+    assert np.array_equal(np.concatenate([y_chunk for _, y_chunk in chunks]), y)
+
+
+def test_load_cached(sparse_data, tmp_path):
+    X, y = sparse_data
+    path = str(tmp_path / 'data.sps')
+    cache_dir = str(tmp_path / 'cache')
+    save_data(X, y, path)
+
+    calls = []
+
+    def loader(path, **kwargs):
+        calls.append(kwargs)
+        return load_libsvm(path, **kwargs)
+
+    for _ in range(2):
+        X_loaded, y_loaded = load_cached(path, cache_dir=cache_dir, loader=loader)
+        assert_same_sparse(X_loaded, X)
+        assert np.array_equal(y_loaded, y)
+    assert len(calls) == 1
+    assert not X_loaded.data.flags.writeable
+
+    # options and modifications of the file change the key
+    X_loaded, _ = load_cached(path, cache_dir=cache_dir, loader=loader, n_features=N_FEATURE + 1)
+    assert X_loaded.shape == (N_OBS, N_FEATURE + 1)
+    save_data(X[:10], y[:10], path)
+    os.utime(path, ns=(0, 0))
+    X_loaded, _ = load_cached(path, cache_dir=cache_dir, loader=loader)
+    assert X_loaded.shape[0] == 10
+    assert len(calls) == 3
+    assert len(os.listdir(cache_dir)) == 3
+
+    # the least recently used entries are evicted
+    dense_path = str(tmp_path / 'data.h5')
+    save_data(X.toarray(), y, dense_path)
+    X_loaded, _ = load_cached(dense_path, cache_dir=cache_dir, max_bytes=1)
+    assert isinstance(X_loaded, np.memmap)
+    assert np.array_equal(X_loaded, X.toarray())
+    assert len(os.listdir(cache_dir)) == 1
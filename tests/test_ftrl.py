@@ -1,8 +1,11 @@
+from concurrent.futures import ThreadPoolExecutor
 import cProfile
 import numpy as np
+import pytest
 from scipy import sparse
+import time
 from kaggler.online_model import FTRL
-from kaggler.metrics import auc
+from kaggler.metrics import auc, logloss
 
 
 np.random.seed(1234)
@@ -11,6 +14,142 @@ N_OBS = int(1e6)
 N_FEATURE = 100
 
 
+def test_predict_one():
+    X = sparse.random(100, N_FEATURE, density=.1, format='csr', random_state=1234)
+    y = np.random.randint(2, size=100)
+
+    clf = FTRL(n=2**10, interaction=True)
+    clf.fit(X, y)
+
+    p = clf.predict(X)
+    for row in range(X.shape[0]):
+        assert np.isclose(p[row], clf.predict_one(list(X[row].indices)))
+
+
+def test_interaction():
+    # pairs of features with the same product have their own weights
+    X = sparse.csr_matrix(([1., 1., 1., 1.], [2, 6, 3, 4], [0, 2, 4]), shape=(2, N_FEATURE))
+    clf = FTRL(n=2**20, epoch=1, l1=0.).fit(X, np.ones(2))
+    assert np.count_nonzero(clf._get_state()[1]['w']) == 1 + 4 + 2
+
+    # and a pair is hashed the same in either order
+    assert np.isclose(clf.predict_one([2, 6]), clf.predict_one([6, 2]))
+
+
+def generate_hashed_data(n_obs, n_nonzero=40, n_hash=2**20, seed=1234):
+    """Generate a synthetic hashed dataset with a logistic target."""
+    rng = np.random.RandomState(seed)
+    indptr = np.arange(0, (n_obs + 1) * n_nonzero, n_nonzero, dtype=np.int32)
+    indices = np.sort(rng.randint(n_hash, size=(n_obs, n_nonzero)), axis=1).astype(np.int32).ravel()
+    data = np.ones(n_obs * n_nonzero)
+    X = sparse.csr_matrix((data, indices, indptr), shape=(n_obs, n_hash))
+
+    w = rng.normal(scale=.5, size=n_hash) * (rng.rand(n_hash) < .1)
+    p = 1 / (1 + np.exp(-(X.dot(w) - 1)))
+    y = (rng.rand(n_obs) < p).astype(np.float64)
+    return X, y
+
+
+def test_fit_n_jobs():
+    X, y = generate_hashed_data(10000)
+
+    clf = FTRL(interaction=False, n_jobs=1)
+    clf.fit(X, y)
+    p = clf.predict(X)
+
+    # Hogwild updates differ from serial ones only by races between threads
+    clf_threads = FTRL(interaction=False, n_jobs=4)
+    clf_threads.fit(X, y)
+    p_threads = clf_threads.predict(X)
+
+    assert abs(logloss(y, p_threads) - logloss(y, p)) < .01
+    assert abs(auc(y, p_threads) - auc(y, p)) < .01
+    w = clf._get_state()[1]['w']
+    w_threads = clf_threads._get_state()[1]['w']
+    assert np.linalg.norm(w_threads - w) < .1 * np.linalg.norm(w)
+
+    with pytest.raises(ValueError):
+        FTRL(n_jobs=0)
+
+
+def test_predict_concurrently():
+    X, y = generate_hashed_data(10000)
+
+    clf = FTRL(n_jobs=2)
+    clf.fit(X, y)
+    p = clf.predict(X)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        ps = list(executor.map(clf.predict, [X] * 4))
+
+    for p_thread in ps:
+        assert np.array_equal(p, p_thread)
+
+
+def test_freeze():
+    X, y = generate_hashed_data(10000)
+
+    clf = FTRL(l1=.1)
+    clf.fit(X, y)
+    p = clf.predict(X)
+
+    frozen = clf.freeze()
+    assert np.allclose(p, frozen.predict(X))
+    assert np.isclose(p[0], frozen.predict_one(list(X[0].indices)))
+
+    frozen = clf.freeze(dtype=np.float32)
+    assert np.allclose(p, frozen.predict(X), atol=1e-6)
+
+
+def test_crosses():
+    X = sparse.random(1000, N_FEATURE, density=.1, format='csr', random_state=1234)
+    y = np.random.randint(2, size=1000)
+
+    # crosses of all pairs of groups are the same as the full interaction
+    p = FTRL(n=2**10, epoch=2).fit(X, y).predict(X)
+    clf = FTRL(n=2**10, epoch=2, groups=[0, 30, 70], crosses=[(0, 0), (1, 1), (2, 2), (1, 0), (0, 2), (1, 2)])
+    assert np.allclose(p, clf.fit(X, y).predict(X))
+
+    # crosses between groups only hash pairs of features across the groups
+    X = sparse.csr_matrix(([1., 1., 1., 1.], [1, 10, 60, 70], [0, 4]), shape=(1, N_FEATURE))
+    y = np.ones(1)
+    clf = FTRL(n=2**20, epoch=1, l1=0., groups=[0, 50], crosses=[(0, 1)]).fit(X, y)
+    assert np.count_nonzero(clf._get_state()[1]['w']) == 1 + 4 + 2 * 2
+
+    frozen = clf.freeze()
+    assert np.allclose(frozen.predict(X), clf.predict(X))
+    assert np.isclose(frozen.predict_one([1, 10, 60, 70]), clf.predict_one([1, 10, 60, 70]))
+
+    for groups, crosses in [([0, 50], [(0, 2)]), ([50], [(0, 0)]), ([0, 50, 50], [(0, 1)]), (None, [(0, 0)])]:
+        with pytest.raises(ValueError):
+            FTRL(groups=groups, crosses=crosses)
+
+
+def benchmark_crosses(n_obs=100000, n_nonzero=60):
+    X, y = generate_hashed_data(n_obs, n_nonzero=n_nonzero)
+
+    for groups, crosses in [(None, None), ([0, 2**19], [(0, 1)]), ([0, 2**18, 2**19, 3 * 2**18], [(0, 2)])]:
+        clf = FTRL(groups=groups, crosses=crosses)
+        start = time.time()
+        clf.fit(X, y)
+        print('crosses={}: {:10.0f} rows/sec'.format(crosses, n_obs / (time.time() - start)))
+
+
+def benchmark_n_jobs(n_obs=int(1e6)):
+    X, y = generate_hashed_data(n_obs)
+    X_tst, y_tst = generate_hashed_data(n_obs // 10, seed=4321)
+
+    for n_jobs in [1, 4, 16]:
+        clf = FTRL(interaction=False, n_jobs=n_jobs)
+        start = time.time()
+        clf.fit(X, y)
+        elapsed = time.time() - start
+
+        p = clf.predict(X_tst)
+        print('n_jobs={:2d}: {:10.0f} rows/sec, logloss: {:.4f}'.format(
+            n_jobs, n_obs / elapsed, logloss(y_tst, p)))
+
+
 def main():
     print('create y...')
     y = np.random.randint(2, size=N_OBS)
@@ -36,3 +175,5 @@ def main():
 
 if __name__ == '__main__':
     main()
+    benchmark_n_jobs()
+    benchmark_crosses()
@@ -0,0 +1,61 @@
+import numpy as np
+from scipy import sparse
+import time
+from kaggler.online_model import NN, NN_H2
+from kaggler.metrics import auc
+
+
+N_FEATURE = 2**16
+
+
+def generate_data(n_obs, n_nonzero=50, n_feature=N_FEATURE, seed=1234):
+    """Generate a synthetic sparse dataset with a logistic target."""
+    rng = np.random.RandomState(seed)
+    indptr = np.arange(0, (n_obs + 1) * n_nonzero, n_nonzero, dtype=np.int32)
+    indices = np.sort(rng.randint(n_feature, size=(n_obs, n_nonzero)), axis=1).astype(np.int32).ravel()
+    data = rng.rand(n_obs * n_nonzero)
+    X = sparse.csr_matrix((data, indices, indptr), shape=(n_obs, n_feature))
+    X.sum_duplicates()
+
+    w = rng.normal(size=n_feature) * (rng.rand(n_feature) < .1)
+    p = 1 / (1 + np.exp(-(X.dot(w))))
+    y = (rng.rand(n_obs) < p).astype(np.float64)
+    return X, y
+
+
+def test_nn():
+    X, y = generate_data(5000)
+
+    clf = NN(n=N_FEATURE, epoch=3, h=16, a=.1)
+    clf.fit(X, y)
+    assert auc(y, clf.predict(X)) > .8
+
+
+def test_predict_one():
+    X, y = generate_data(1000)
+
+    for clf in [NN(n=N_FEATURE, epoch=1, h=16), NN_H2(n=N_FEATURE, epoch=1, h1=16, h2=8)]:
+        clf.fit(X, y)
+        p = clf.predict(X[:10])
+        assert np.allclose([clf.predict_one(list(zip(X[row].indices, X[row].data))) for row in range(10)], p)
+
+
+def benchmark_h(n_obs=50000):
+    X, y = generate_data(n_obs)
+
+    for h in [64, 128]:
+        for clf in [NN(n=N_FEATURE, epoch=1, h=h), NN_H2(n=N_FEATURE, epoch=1, h1=h, h2=h // 4)]:
+            start = time.time()
+            clf.fit(X, y)
+            fit_elapsed = time.time() - start
+
+            start = time.time()
+            clf.predict(X)
+            predict_elapsed = time.time() - start
+
+            print('{}: fit {:8.0f} rows/sec, predict {:8.0f} rows/sec'.format(
+                clf, n_obs / fit_elapsed, n_obs / predict_elapsed))
+
+
+if __name__ == '__main__':
+    benchmark_h()
@@ -0,0 +1,407 @@
+import numpy as np
+import pickle
+import pytest
+from scipy import sparse
+from sklearn.metrics import log_loss, roc_auc_score
+from sklearn.datasets import dump_svmlight_file
+from kaggler.online_model import FFM, FTRL, FM, NN, NN_H2, SGD, ProgressiveValidation, merge, parallel_fit
+
+
+N_OBS = 1000
+N_FEATURE = 100
+
+
+@pytest.fixture(scope='module')
+def sparse_data():
+    rng = np.random.RandomState(1234)
+    X = sparse.random(N_OBS, N_FEATURE, density=.1, format='csr', random_state=rng)
+    X.data[:] = 1.
+    y = (X[:, :N_FEATURE // 2].sum(axis=1).A1 > X[:, N_FEATURE // 2:].sum(axis=1).A1).astype(np.float64)
+    return X, y
+
+
+# parameters of models for the test data, which tests of features update with their options
+MODEL_PARAMS = {
+    FTRL: {'n': 2**10, 'epoch': 1},
+    SGD: {'n': 2**10, 'epoch': 1},
+    FM: {'n': N_FEATURE, 'epoch': 1},
+    NN: {'n': N_FEATURE, 'epoch': 1},
+    NN_H2: {'n': N_FEATURE, 'epoch': 1, 'h1': 8, 'h2': 8},
+}
+
+
+def model_params(*classes, **kwargs):
+    """Return (model class, parameters) pytest params of the classes, or all models if none, updated by kwargs."""
+    return [pytest.param(model_class, dict(MODEL_PARAMS[model_class], **kwargs), id=model_class.__name__)
+            for model_class in classes or MODEL_PARAMS]
+
+
+# models with options that change how they are fit
+VARIANT_PARAMS = [
+    pytest.param(FTRL, dict(MODEL_PARAMS[FTRL], groups=[0, N_FEATURE // 2], crosses=[(0, 1)]), id='FTRL-crosses'),
+    pytest.param(FM, dict(MODEL_PARAMS[FM], batch_size=100, n_jobs=2), id='FM-batch'),
+]
+
+DTYPES = [np.float64, np.float32]
+
+
+def assert_same_state(model, loaded):
+    params, arrays = model._get_state()
+    loaded_params, loaded_arrays = loaded._get_state()
+
+    assert type(loaded) == type(model)
+    assert loaded_params == params
+    assert sorted(loaded_arrays) == sorted(arrays)
+    for name, array in arrays.items():
+        assert np.array_equal(loaded_arrays[name], array)
+
+
+@pytest.mark.parametrize('model_class, params', model_params() + VARIANT_PARAMS)
+@pytest.mark.parametrize('dtype', DTYPES)
+@pytest.mark.parametrize('mmap', [True, False])
+def test_save_load(model_class, params, dtype, mmap, tmp_path):
+    model = model_class(dtype=dtype, **params)
+
+    path = str(tmp_path / 'model')
+    model.save(path)
+    assert_same_state(model, type(model).load(path, mmap=mmap))
+
+
+@pytest.mark.parametrize('model_class, params', model_params() + VARIANT_PARAMS)
+@pytest.mark.parametrize('dtype', DTYPES)
+def test_pickle(model_class, params, dtype):
+    model = model_class(dtype=dtype, **params)
+    assert_same_state(model, pickle.loads(pickle.dumps(model)))
+
+
+def test_load_mmap(sparse_data, tmp_path):
+    X, y = sparse_data
+    model = FTRL(n=2**10)
+    model.fit(X, y)
+    p = model.predict(X)
+
+    path = str(tmp_path / 'model')
+    model.save(path)
+    loaded = FTRL.load(path)
+    assert np.allclose(loaded.predict(X), p)
+
+    # updating a memory-mapped model should not change the saved model
+    loaded.fit(X, y)
+    assert not np.allclose(loaded.predict(X), p)
+    assert np.allclose(FTRL.load(path).predict(X), p)
+
+    frozen = model.freeze(dtype=np.float32)
+    frozen.save(path + '_frozen')
+    assert np.allclose(type(frozen).load(path + '_frozen').predict(X), frozen.predict(X))
+
+
+@pytest.mark.parametrize('model_class, params', model_params() + VARIANT_PARAMS)
+@pytest.mark.parametrize('dtype', DTYPES)
+def test_fit_file(model_class, params, dtype, sparse_data, tmp_path):
+    X, y = sparse_data
+    path = str(tmp_path / 'data.sps')
+    dump_svmlight_file(X, y, path, zero_based=True)
+
+    model = model_class(dtype=dtype, **params)
+    model.fit(X, y)
+
+    model_file = model_class(dtype=dtype, **params)
+    model_file.fit_file(path, chunk_rows=300)
+    assert_same_state(model, model_file)
+
+    model_partial = model_class(dtype=dtype, **params)
+    for i in range(0, N_OBS, 300):
+        model_partial.partial_fit(X[i:i + 300], y[i:i + 300])
+    assert_same_state(model, model_partial)
+
+
+# models without the hashing trick
+@pytest.mark.parametrize('model_class, params', model_params(FM, NN, NN_H2))
+def test_fit_file_out_of_range(model_class, params, sparse_data, tmp_path):
+    X, y = sparse_data
+    path = str(tmp_path / 'data.sps')
+
+    # a one-based file has the index n
+    dump_svmlight_file(X, y, path, zero_based=False)
+    with pytest.raises(ValueError):
+        model_class(**params).fit_file(path)
+
+    dump_svmlight_file(X, y, path, zero_based=True)
+    model_class(**params).fit_file(path)
+
+
+@pytest.mark.parametrize('model_class, params', model_params(FM, NN, NN_H2))
+def test_out_of_range(model_class, params, sparse_data):
+    X, y = sparse_data
+    model = model_class(**params).fit(X, y)
+    X_out = sparse.csr_matrix(([1.], [N_FEATURE], [0, 1]), shape=(1, N_FEATURE + 1))
+
+    with pytest.raises(ValueError):
+        model.fit(X_out, y[:1])
+    with pytest.raises(ValueError):
+        model.predict(X_out)
+    for x in [[(N_FEATURE, 1.)], [(-1, 1.)]]:
+        with pytest.raises(ValueError):
+            model.predict_one(x)
+        with pytest.raises(ValueError):
+            model.update_one(x, 1.)
+
+
+# models updated row by row with a list of (index, value) of non-zero features
+@pytest.mark.parametrize('model_class, params', model_params(FM, NN, NN_H2))
+@pytest.mark.parametrize('dtype', DTYPES)
+def test_predict_one(model_class, params, dtype, sparse_data):
+    X, y = sparse_data
+
+    model = model_class(dtype=dtype, **params)
+    model.fit(X, y)
+
+    model_one = model_class(dtype=dtype, **params)
+    for row in range(N_OBS):
+        x = list(zip(X[row].indices.tolist(), X[row].data.tolist()))
+        model_one.update_one(x, model_one.predict_one(x) - y[row])
+    assert_same_state(model, model_one)
+
+    p = model.predict(X)
+    assert np.allclose([model.predict_one(list(zip(X[row].indices.tolist(), X[row].data.tolist())))
+                        for row in range(N_OBS)], p)
+
+
+@pytest.mark.parametrize('model_class, params', model_params(epoch=3))
+def test_float32(model_class, params, sparse_data):
+    X, y = sparse_data
+
+    model = model_class(dtype=np.float64, **params)
+    model.fit(X, y)
+    p = model.predict(X)
+
+    model32 = model_class(dtype=np.float32, **params)
+    model32.fit(X, y)
+    p32 = model32.predict(X)
+
+    for name, array in model32._get_state()[1].items():
+        assert array.dtype == np.float32
+        assert array.nbytes * 2 == model._get_state()[1][name].nbytes
+    assert np.allclose(p32, p, atol=1e-3)
+    assert abs(roc_auc_score(y, p32) - roc_auc_score(y, p)) < 1e-3
+
+    with pytest.raises(ValueError):
+        model_class(dtype=np.int32, **params)
+
+
+@pytest.mark.parametrize('model_class, params', model_params(FTRL, SGD, l1=.1))
+@pytest.mark.parametrize('dtype', DTYPES)
+def test_merge(model_class, params, dtype, sparse_data):
+    X, y = sparse_data
+    models = [model_class(dtype=dtype, **params).fit(X[i::3], y[i::3]) for i in range(3)]
+    weights = [1., 2., 3.]
+
+    merged = merge(models, weights)
+    logit = lambda p: np.log(p / (1 - p))
+    assert np.allclose(logit(merged.predict(X)),
+                       np.average([logit(model.predict(X)) for model in models], axis=0, weights=weights),
+                       atol=1e-4)
+
+    # counters of the base are counted once
+    base = model_class(dtype=dtype, **params).fit(X, y)
+    models = [pickle.loads(pickle.dumps(base)).partial_fit(X[i::3], y[i::3]) for i in range(3)]
+    c = merge(models, base=base)._get_state()[1]['c']
+    assert np.allclose(c, sum(model._get_state()[1]['c'] for model in models) - 2 * base._get_state()[1]['c'],
+                       atol=1e-3)
+
+    with pytest.raises(ValueError):
+        merge([FTRL(n=2**10), FTRL(n=2**11)])
+    with pytest.raises(TypeError):
+        merge([FM(n=N_FEATURE)])
+
+
+@pytest.mark.parametrize('model_class, params', model_params(FTRL, SGD, epoch=2))
+def test_parallel_fit(model_class, params, sparse_data, tmp_path):
+    X, y = sparse_data
+    files = [str(tmp_path / 'data{}.sps'.format(i)) for i in range(4)]
+    for i, path in enumerate(files):
+        dump_svmlight_file(X[i::4], y[i::4], path, zero_based=True)
+
+    model = parallel_fit(model_class(**params), files, n_workers=2)
+    assert roc_auc_score(y, model.predict(X)) > .8
+    assert_same_state(model, parallel_fit(model_class(**params), files, n_workers=2))
+
+    for n_workers in [0, -7]:
+        with pytest.raises(ValueError):
+            parallel_fit(model_class(**params), files, n_workers=n_workers)
+
+
+@pytest.mark.parametrize('model_class, params', model_params())
+@pytest.mark.parametrize('dtype', DTYPES)
+def test_sample_weight(model_class, params, dtype, sparse_data):
+    X, y = sparse_data
+    keep = np.arange(N_OBS) % 3 > 0
+
+    # rows with zero weights do not update the model
+    p = model_class(dtype=dtype, **params).fit(X[keep], y[keep]).predict(X)
+    model = model_class(dtype=dtype, **params).fit(X, y, sample_weight=keep.astype(np.float64))
+    assert np.allclose(model.predict(X), p)
+
+    model_partial = model_class(dtype=dtype, **params).partial_fit(X, y, sample_weight=keep.astype(np.float64))
+    assert np.allclose(model_partial.predict(X), p)
+
+    with pytest.raises(ValueError):
+        model_class(dtype=dtype, **params).fit(X, y, sample_weight=np.ones(N_OBS - 1))
+
+
+@pytest.mark.parametrize('model_class, params', model_params(SGD, NN, NN_H2, l2=1e-2))
+def test_sample_weight_regularization(model_class, params, sparse_data):
+    X, y = sparse_data
+    keep = np.arange(N_OBS) % 3 > 0
+    if model_class is SGD:
+        params = dict(params, l1=1e-3)
+
+    # rows with zero weights do not shrink the weights by regularization either
+    p = model_class(**params).fit(X[keep], y[keep]).predict(X)
+    model = model_class(**params).fit(X, y, sample_weight=keep.astype(np.float64))
+    assert np.allclose(model.predict(X), p)
+
+
+@pytest.mark.parametrize('model_class, params', model_params())
+def test_negative_sampling_rate(model_class, params, sparse_data):
+    X, y = sparse_data
+    rate = .2
+
+    p = model_class(negative_sampling_rate=1., **params).fit(X, y).predict(X)
+    model = model_class(negative_sampling_rate=rate, **params).fit(X, y)
+    assert np.allclose(model.predict(X), p / (p + (1 - p) / rate))
+    assert np.allclose(pickle.loads(pickle.dumps(model)).predict(X), model.predict(X))
+
+    if isinstance(model, (FTRL, SGD)):
+        x = X[0].indices.tolist()
+    else:
+        x = list(zip(X[0].indices.tolist(), X[0].data.tolist()))
+    assert np.isclose(model.predict_one(x), model.predict(X[0])[0])
+
+    for rate in [0., 1.5]:
+        with pytest.raises(ValueError):
+            model_class(negative_sampling_rate=rate, **params)
+
+
+def test_negative_downsampling(sparse_data):
+    X, y = sparse_data
+    rng = np.random.RandomState(1234)
+    rate = .3
+    keep = (y == 1) | (rng.rand(N_OBS) < rate)
+
+    model = FTRL(n=2**10, epoch=10, a=.1, interaction=False, negative_sampling_rate=rate).fit(X[keep], y[keep])
+    model_biased = FTRL(n=2**10, epoch=10, a=.1, interaction=False).fit(X[keep], y[keep])
+    assert abs(model.predict(X).mean() - y.mean()) < abs(model_biased.predict(X).mean() - y.mean()) / 2
+
+    frozen = model.freeze()
+    assert np.allclose(frozen.predict(X), model.predict(X))
+
+
+@pytest.mark.parametrize('model_class, params', model_params() + VARIANT_PARAMS)
+def test_progressive_validation(model_class, params, sparse_data):
+    X, y = sparse_data
+    reports = []
+    validation = ProgressiveValidation(callback=reports.append, every=300)
+
+    model_class(**params).fit(X, y, validation=validation)
+    assert [metrics['rows'] for metrics in reports] == [300, 600, 900]
+    assert 0. < reports[-1]['logloss'] < 1.
+    assert 0. <= reports[-1]['auc'] <= 1.
+
+    with pytest.raises(ValueError):
+        ProgressiveValidation(every=0)
+
+
+@pytest.mark.parametrize('model_class, params', model_params(FTRL, SGD, NN))
+@pytest.mark.parametrize('rate', [1., .5])
+def test_progressive_validation_metrics(model_class, params, rate, sparse_data):
+    X, y = sparse_data
+    validation = ProgressiveValidation(every=N_OBS, n_buckets=100000)
+    model_class(negative_sampling_rate=rate, **params).partial_fit(X, y, validation=validation)
+
+    # predict each row, calibrated for the negative sampling rate, before
+    # updating the model with it
+    model = model_class(negative_sampling_rate=rate, **params)
+    p = np.zeros(N_OBS)
+    for i in range(N_OBS):
+        p[i] = model.predict(X[i])[0]
+        model.partial_fit(X[i], y[i:i + 1])
+
+    metrics = validation.metrics()
+    assert metrics['rows'] == N_OBS
+    assert np.isclose(metrics['logloss'], log_loss(y, p))
+    assert np.isclose(metrics['auc'], roc_auc_score(y, p), atol=1e-3)
+
+
+def test_fm_batch(sparse_data):
+    X, y = sparse_data
+
+    model = FM(n=N_FEATURE, epoch=10, batch_size=32)
+    model.fit(X, y)
+    assert roc_auc_score(y, model.predict(X)) > .9
+
+    # the forward pass does not change the model, so threads do not matter
+    model_threads = FM(n=N_FEATURE, epoch=10, batch_size=32, n_jobs=4)
+    model_threads.fit(X, y)
+    for name, array in model._get_state()[1].items():
+        assert np.array_equal(model_threads._get_state()[1][name], array)
+
+    for kwargs in [{'batch_size': 0}, {'batch_size': -1}, {'n_jobs': 0}, {'n_jobs': -2}]:
+        with pytest.raises(ValueError):
+            FM(n=N_FEATURE, **kwargs)
+
+
+def write_ffm(X, y, fields, path):
+    with open(path, 'w') as f:
+        for row in range(X.shape[0]):
+            start, end = X.indptr[row], X.indptr[row + 1]
+            f.write('{:g} {}\n'.format(y[row], ' '.join('{}:{}:{:.17g}'.format(*x) for x in zip(
+                fields[start:end], X.indices[start:end], X.data[start:end]))))
+
+
+def test_ffm(sparse_data, tmp_path):
+    X, y = sparse_data
+    fields = X.indices // (N_FEATURE // 10)
+    path = str(tmp_path / 'data.ffm')
+    write_ffm(X, y, fields, path)
+
+    model = FFM(n=N_FEATURE, n_fields=10, epoch=3)
+    model.fit(X, y, fields)
+    assert roc_auc_score(y, model.predict(X, fields)) > .9
+
+    model_file = FFM(n=N_FEATURE, n_fields=10, epoch=3)
+    model_file.fit_file(path, chunk_rows=300)
+    assert_same_state(model, model_file)
+
+    model_one = FFM(n=N_FEATURE, n_fields=10, epoch=1)
+    for x, target in model_one.read_sparse(path):
+        model_one.update_one(x, model_one.predict_one(x) - target)
+    model_partial = FFM(n=N_FEATURE, n_fields=10, epoch=1).partial_fit(X, y, fields)
+    assert_same_state(model_one, model_partial)
+
+    assert_same_state(model, pickle.loads(pickle.dumps(model)))
+    model.save(str(tmp_path / 'model'))
+    assert np.array_equal(FFM.load(str(tmp_path / 'model')).predict(X, fields), model.predict(X, fields))
+
+    model_threads = FFM(n=N_FEATURE, n_fields=10, epoch=3, n_jobs=4).fit(X, y, fields)
+    assert roc_auc_score(y, model_threads.predict(X, fields)) > .9
+    for n_jobs in [0, -5]:
+        with pytest.raises(ValueError):
+            FFM(n=N_FEATURE, n_fields=10, n_jobs=n_jobs)
+
+    with pytest.raises(ValueError):
+        model.fit(X, y, fields + 1)
+
+    keep = np.arange(N_OBS) % 3 > 0
+    model_weighted = FFM(n=N_FEATURE, n_fields=10, epoch=3, l2=1e-2).fit(X, y, fields, keep.astype(np.float64))
+    model_kept = FFM(n=N_FEATURE, n_fields=10, epoch=3, l2=1e-2).fit(X[keep], y[keep],
+                                                                     fields[np.repeat(keep, np.diff(X.indptr))])
+    assert np.allclose(model_weighted.predict(X, fields), model_kept.predict(X, fields))
+
+    reports = []
+    FFM(n=N_FEATURE, n_fields=10, epoch=1, n_jobs=4).fit(
+        X, y, fields, validation=ProgressiveValidation(callback=reports.append, every=400))
+    assert [metrics['rows'] for metrics in reports] == [400, 800]
+
+    model32 = FFM(n=N_FEATURE, n_fields=10, epoch=3, dtype=np.float32).fit(X, y, fields)
+    assert np.allclose(model32.predict(X, fields), model.predict(X, fields), atol=1e-3)
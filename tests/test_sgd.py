@@ -1,4 +1,6 @@
+import numpy as np
 import os
+from scipy import sparse
 import unittest
 from kaggler.online_model import SGD
 
@@ -42,6 +44,20 @@ class TestSGD(unittest.TestCase):
         # check if the number of feature index are correct
         self.assertEqual(len_xs, DUMMY_LEN_X)
 
+    def test_fit_predict(self):
+        X = sparse.random(100, 20, density=.2, format='csr', random_state=1234)
+        y = np.random.RandomState(1234).randint(2, size=100)
+
+        self.model.fit(X, y)
+        p = self.model.predict(X)
+        for row in range(X.shape[0]):
+            self.assertAlmostEqual(p[row], self.model.predict_one(list(X[row].indices)))
+
+        # hashing is deterministic, so the same data gives the same model
+        model = SGD(n=2**10, a=0.1, l1=1, l2=1, interaction=True)
+        model.fit(X, y)
+        self.assertTrue(np.array_equal(model.predict(X), p))
+
 
 if __name__ == '__main__':
     unittest.main()
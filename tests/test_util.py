@@ -0,0 +1,25 @@
+import numpy as np
+from kaggler.util import argmax, count_dict, gini, gini_split_scores
+
+
+def test_count_dict():
+    y = np.array([2, 0, 2, 2, 1])
+    assert count_dict(y) == {0: 1, 1: 1, 2: 3}
+    assert count_dict(y - 1) == {-1: 1, 0: 1, 1: 3}
+    assert argmax(count_dict(y)) == 2
+    assert argmax(np.bincount(y)) == 2
+    assert np.isclose(gini(y), 1 - (.2 ** 2 + .2 ** 2 + .6 ** 2))
+    assert gini(np.array([1, 1])) == 0.
+
+
+def test_gini_split_scores():
+    rng = np.random.RandomState(1234)
+    x = rng.randint(20, size=200)
+    y = rng.randint(3, size=200)
+
+    thresholds, scores = gini_split_scores(x, y)
+    assert list(thresholds) == list(np.unique(x)[:-1])
+    for threshold, score in zip(thresholds, scores):
+        left, right = y[x <= threshold], y[x > threshold]
+        expected = gini(y) - (len(left) * gini(left) + len(right) * gini(right)) / len(y)
+        assert np.isclose(score, expected)